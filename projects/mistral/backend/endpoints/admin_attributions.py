@@ -1,6 +1,7 @@
 from typing import Any
 
 from marshmallow import pre_load
+from mistral.services.sqlapi_db_manager import SqlApiDbManager
 from restapi import decorators
 from restapi.connectors import sqlalchemy
 from restapi.exceptions import Conflict, DatabaseDuplicatedEntry, NotFound
@@ -82,6 +83,7 @@ def post(self, user: User, **kwargs: Any) -> Response:
             db.session.rollback()
             raise Conflict(str(exc))
 
+        SqlApiDbManager.invalidate_dataset_catalog()
         return self.response(new_attr.id)
 
     @decorators.auth.require_all(Role.ADMIN)
@@ -110,6 +112,7 @@ def put(self, attribution_id: str, user: User, **kwargs: Any) -> Response:
             db.session.rollback()
             raise Conflict(str(exc))
 
+        SqlApiDbManager.invalidate_dataset_catalog()
         return self.empty_response()
 
     @decorators.auth.require_all(Role.ADMIN)
@@ -130,4 +133,5 @@ def delete(self, attribution_id: str, user: User) -> Response:
         db.session.delete(attribution)
         db.session.commit()
 
+        SqlApiDbManager.invalidate_dataset_catalog()
         return self.empty_response()
@@ -0,0 +1,28 @@
+from mistral.services.archive_cache import ArchiveDaysCache
+from mistral.services.dballe_pool import DballePools
+from mistral.services.maps_cache import MapsResponseCache
+from mistral.services.summary_cache import SummaryCache
+from restapi import decorators
+from restapi.rest.definition import EndpointResource, Response
+from restapi.services.authentication import Role, User
+
+
+class AdminCache(EndpointResource):
+
+    labels = ["management"]
+    private = True
+
+    @decorators.auth.require_all(Role.ADMIN)
+    @decorators.endpoint(
+        path="/admin/cache",
+        summary="Usage statistics of the caches and pools of the serving process",
+        responses={200: "Cache statistics successfully retrieved"},
+    )
+    def get(self, user: User) -> Response:
+        stats = {
+            "fields_summary": SummaryCache.get_stats(),
+            "dballe_pools": DballePools.get_stats(),
+            "observations_maps": MapsResponseCache.get_stats(),
+            "archived_days": ArchiveDaysCache.get_stats(),
+        }
+        return self.response(stats)
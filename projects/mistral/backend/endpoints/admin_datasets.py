@@ -1,6 +1,7 @@
 from typing import Any, Dict, Optional, Union
 
 from marshmallow import pre_load
+from mistral.services.sqlapi_db_manager import SqlApiDbManager
 from restapi import decorators
 from restapi.connectors import sqlalchemy
 from restapi.exceptions import Conflict, DatabaseDuplicatedEntry, NotFound
@@ -216,6 +217,7 @@ def post(self, user: User, **kwargs: Any) -> Response:
         new_dataset.attribution_id = attribution_id
         db.session.commit()
 
+        SqlApiDbManager.invalidate_dataset_catalog()
         return self.response(new_dataset.id)
 
     @decorators.auth.require_all(Role.ADMIN)
@@ -260,6 +262,7 @@ def put(self, dataset_id: str, user: User, **kwargs: Any) -> Response:
             dataset.attribution_id = attribution_id
             db.session.commit()
 
+        SqlApiDbManager.invalidate_dataset_catalog()
         return self.empty_response()
 
     @decorators.auth.require_all(Role.ADMIN)
@@ -278,4 +281,5 @@ def delete(self, dataset_id: str, user: User) -> Response:
         db.session.delete(dataset)
         db.session.commit()
 
+        SqlApiDbManager.invalidate_dataset_catalog()
         return self.empty_response()
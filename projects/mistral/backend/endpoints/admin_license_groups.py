@@ -88,6 +88,7 @@ def post(self, user: User, **kwargs: Any) -> Response:
             db.session.rollback()
             raise Conflict(str(exc))
 
+        SqlApiDbManager.invalidate_dataset_catalog()
         return self.response(new_gl.id)
 
     @decorators.auth.require_all(Role.ADMIN)
@@ -116,6 +117,7 @@ def put(self, lic_group_id: str, user: User, **kwargs: Any) -> Response:
             db.session.rollback()
             raise Conflict(str(exc))
 
+        SqlApiDbManager.invalidate_dataset_catalog()
         return self.empty_response()
 
     @decorators.auth.require_all(Role.ADMIN)
@@ -136,4 +138,5 @@ def delete(self, lic_group_id: str, user: User) -> Response:
         db.session.delete(lgroup)
         db.session.commit()
 
+        SqlApiDbManager.invalidate_dataset_catalog()
         return self.empty_response()
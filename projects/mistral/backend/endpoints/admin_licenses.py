@@ -155,6 +155,7 @@ def post(self, user: User, **kwargs: Any) -> Response:
         new_lic.group_license_id = lgroup_id
         db.session.commit()
 
+        SqlApiDbManager.invalidate_dataset_catalog()
         return self.response(new_lic.id)
 
     @decorators.auth.require_all(Role.ADMIN)
@@ -191,6 +192,7 @@ def put(self, license_id: str, user: User, **kwargs: Any) -> Response:
             license.group_license_id = lgroup_id
             db.session.commit()
 
+        SqlApiDbManager.invalidate_dataset_catalog()
         return self.empty_response()
 
     @decorators.auth.require_all(Role.ADMIN)
@@ -209,4 +211,5 @@ def delete(self, license_id: str, user: User) -> Response:
         db.session.delete(license)
         db.session.commit()
 
+        SqlApiDbManager.invalidate_dataset_catalog()
         return self.empty_response()
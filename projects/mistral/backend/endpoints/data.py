@@ -1,14 +1,14 @@
 import math
-import subprocess
 from datetime import datetime
 from typing import Any, Dict, List, Optional
 
 from marshmallow import ValidationError, pre_load
-from mistral.endpoints import DOWNLOAD_DIR, PostProcessorsType
+from mistral.endpoints import PostProcessorsType
 from mistral.exceptions import DiskQuotaException, MaxOutputSizeExceeded
 from mistral.services.arkimet import BeArkimet as arki
 from mistral.services.dballe import BeDballe as dballe
 from mistral.services.sqlapi_db_manager import SqlApiDbManager as repo
+from mistral.services.usage_ledger import UsageLedger
 from mistral.tasks import data_extraction as data_ext
 from mistral.tools import grid_interpolation as pp3_1
 from mistral.tools import spare_point_interpol as pp3_3
@@ -546,13 +546,12 @@ def get_observed_data_size_count(
         dballe_queries[dballe_fields.index("datetimemax")][0],
     )
 
-    explorer = dballe.build_explorer(
+    with dballe.build_explorer(
         db_type, license_group=license_group, network_list=dataset_names
-    )
-
-    summary = dballe.get_summary(
-        dataset_names, explorer, None, fields=dballe_fields, queries=dballe_queries
-    )
+    ) as explorer:
+        summary = dballe.get_summary(
+            dataset_names, explorer, None, fields=dballe_fields, queries=dballe_queries
+        )
 
     if summary and "s" in summary:
         esti_obs_data_size = (
@@ -584,17 +583,8 @@ def check_user_quota_for_observed_data(user_id, db, esti_obs_data_size):
         )
         raise MaxOutputSizeExceeded(message)
 
-    # check for exceeding quota
-    max_user_quota = db.session.query(db.User.disk_quota).filter_by(id=user_id).scalar()
-
-    user_dir = DOWNLOAD_DIR.joinpath(user.uuid, "outputs")
-
-    # check for current used space
-    used_quota = (
-        int(subprocess.check_output(["du", "-sb", user_dir]).split()[0])
-        if user_dir.exists()
-        else 0
-    )
+    # check for current used space and for exceeding quota
+    used_quota, max_user_quota = UsageLedger.get_usage(db, user_id)
     log.info(f"user used disk quota: {used_quota} ({data_ext.human_size(used_quota)})")
 
     if used_quota + esti_obs_data_size > max_user_quota:
@@ -2,6 +2,7 @@
 
 from mistral.services.arkimet import BeArkimet as arki
 from mistral.services.sqlapi_db_manager import SqlApiDbManager
+from mistral.services.summary_cache import SummaryCache
 from restapi import decorators
 from restapi.connectors import celery, sqlalchemy
 from restapi.env import Env
@@ -51,6 +52,9 @@ def post(self, cluster: str, model: str, rundate: datetime, user: User) -> Respo
                 )
                 return self.response("1", code=202)
 
+        # new data are available: cached summaries of the model are outdated
+        SummaryCache.invalidate(model)
+
         db = sqlalchemy.get_instance()
         schedules_list = db.Schedule.query.all()
         log.debug("rundate type: {}", type(rundate))
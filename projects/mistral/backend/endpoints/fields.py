@@ -75,16 +75,11 @@ def get(
                 raise Unauthorized(
                     "to access this functionality the user has to be logged"
                 )
+            authorized_datasets = {
+                ds.get("id", "") for ds in SqlApiDbManager.get_datasets(db, user)
+            }
             for ds_name in datasets:
-                found = next(
-                    (
-                        ds
-                        for ds in SqlApiDbManager.get_datasets(db, user)
-                        if ds.get("id", "") == ds_name
-                    ),
-                    None,
-                )
-                if not found:
+                if ds_name not in authorized_datasets:
                     raise NotFound(
                         f"Dataset '{ds_name}' not found: check for dataset name or for your authorizations"
                     )
@@ -1,11 +1,15 @@
 import datetime
+import functools
 import itertools
-from typing import Any, Dict, List, Optional
+import json
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 from flask import Response as FlaskResponse
-from flask import stream_with_context
+from flask import copy_current_request_context, stream_with_context
 from mistral.exceptions import (
     AccessToDatasetDenied,
+    DballePoolTimeout,
     NetworkNotInLicenseGroup,
     UnAuthorizedUser,
     UnexistingLicenseGroup,
@@ -13,16 +17,29 @@
 )
 from mistral.services.arkimet import BeArkimet as arki
 from mistral.services.dballe import BeDballe as dballe
+from mistral.services.maps_cache import MapsResponseCache, Stamps
+from mistral.services.maps_grid import MapsGrid
+from mistral.services.maps_response import MapsResponseBuilder
 from mistral.services.sqlapi_db_manager import SqlApiDbManager
 from restapi import decorators
 from restapi.connectors import sqlalchemy
-from restapi.exceptions import BadRequest, Conflict, NotFound, ServerError, Unauthorized
+from restapi.env import Env
+from restapi.exceptions import (
+    BadRequest,
+    Conflict,
+    NotFound,
+    ServerError,
+    ServiceUnavailable,
+    Unauthorized,
+)
 from restapi.models import Schema, fields, validate
 from restapi.rest.definition import EndpointResource, Response
 from restapi.services.authentication import User
 from restapi.utilities.logs import log
 
 FILEFORMATS = ["BUFR", "JSON"]
+# max number of queries of a multi-valued maps request run concurrently
+MAPS_QUERY_WORKERS = Env.get_int("MAPS_QUERY_WORKERS", 4)
 
 
 class ObservationsQuery(Schema):
@@ -41,6 +58,9 @@ class ObservationsQuery(Schema):
     allStationProducts = fields.Bool(required=False)
     reliabilityCheck = fields.Bool(required=False)
     last = fields.Bool(required=False)
+    # aggregate stations and values in the cells of a grid
+    zoom = fields.Int(required=False, validate=validate.Range(min=0, max=18))
+    gridSize = fields.Float(required=False, validate=validate.Range(min=0.001, max=90))
 
 
 class ObservationsDownloader(Schema):
@@ -74,7 +94,6 @@ class MapsObservations(EndpointResource):
             409: "The requested interval is greater than the requested timerange",
         },
     )
-    @decorators.cache(timeout=600)
     # 200: {'schema': {'$ref': '#/definitions/MapStations'}}
     def get(
         self,
@@ -94,13 +113,25 @@ def get(
         allStationProducts: bool = True,
         reliabilityCheck: bool = False,
         last: bool = False,
+        zoom: Optional[int] = None,
+        gridSize: Optional[float] = None,
     ) -> Response:
         alchemy_db = sqlalchemy.get_instance()
+        cell_size = self.get_grid_cell_size(zoom, gridSize, stationDetails)
         query: Dict[str, Any] = {}
+        # the stations of the response are clipped to the requested bounding box
+        requested_bbox = None
         if lonmin or latmin or lonmax or latmax:
             if not lonmin or not lonmax or not latmin or not latmax:
                 raise BadRequest("Coordinates for bounding box are missing")
             else:
+                requested_bbox = (latmin, lonmin, latmax, lonmax)
+                if not cell_size:
+                    # the bounding box of the query is snapped to a grid,
+                    # so that close boxes share the same cached response
+                    latmin, lonmin, latmax, lonmax = MapsResponseCache.snap_bbox(
+                        *requested_bbox
+                    )
                 # append bounding box params to the query
                 query["lonmin"] = lonmin
                 query["lonmax"] = lonmax
@@ -236,6 +267,39 @@ def get(
                     raise Conflict(
                         "the requested interval is greater than the requested timerange"
                     )
+
+        # the response is cached only after all the authorization checks
+        cache_key = MapsResponseCache.get_key(
+            q=q,
+            networks=networks,
+            interval=interval,
+            lonmin=lonmin,
+            latmin=latmin,
+            lonmax=lonmax,
+            latmax=latmax,
+            lat=lat,
+            lon=lon,
+            ident=ident,
+            onlyStations=onlyStations,
+            stationDetails=stationDetails,
+            allStationProducts=allStationProducts,
+            reliabilityCheck=reliabilityCheck,
+            last=last,
+            zoom=zoom,
+            gridSize=gridSize,
+            license=query["license"],
+            dsn_subset=tuple(sorted(dsn_subset)) if dsn_subset else None,
+            db_type=db_type,
+        )
+        stamp_names = MapsResponseCache.get_stamp_names(
+            [networks] if networks else None, group_license.dballe_dsn
+        )
+        cached_res, stamps = self.get_cached_response(
+            cache_key, stamp_names, requested_bbox, last
+        )
+        if cached_res is not None:
+            return cached_res
+
         try:
             query_list: Optional[List[Dict[str, Any]]] = []
             if query:
@@ -243,7 +307,10 @@ def get(
                 single_params = {}
                 list_params = {}
                 for k, v in query.items():
-                    if not isinstance(v, list) or len(v) == 1:
+                    if k == "product" and isinstance(v, list) and len(v) > 1:
+                        # many products are extracted by dballe with a single query
+                        single_params["varlist"] = ",".join(v)
+                    elif not isinstance(v, list) or len(v) == 1:
                         single_params[k] = v
                     else:
                         list_params[k] = v
@@ -267,47 +334,232 @@ def get(
                 # you need to iterate over query list to extract data, so add an empty element to the list
                 query_list.append(None)
 
-            raw_res: Optional[Any] = None
-            for q in query_list:
-                if q and query_station_data:
-                    # add the params that can be multiple to the query for station details
-                    if "timerange" in q:
-                        query_station_data["timerange"] = q["timerange"]
-                    if "level" in q:
-                        query_station_data["level"] = q["level"]
-                    if "product" in q and not allStationProducts:
-                        query_station_data["product"] = q["product"]
-                if db_type == "mixed":
-                    raw_res = dballe.get_maps_response_for_mixed(
-                        q,
-                        onlyStations,
-                        query_station_data=query_station_data,
-                        dsn_subset=dsn_subset,
-                        previous_res=raw_res,
+            if cell_size:
+                station_index = self.get_grid_station_index(
+                    query_list, db_type, group_license, dsn_subset
+                )
+                if onlyStations:
+                    # no need to query the data to count the stations
+                    grid_res = self.get_grid_response(
+                        cell_size, station_index.within(requested_bbox)
                     )
-                else:
-                    raw_res = dballe.get_maps_response(
-                        q,
-                        onlyStations,
-                        interval=interval,
-                        db_type=db_type,
-                        query_station_data=query_station_data,
-                        dsn_subset=dsn_subset,
-                        previous_res=raw_res,
+                    return self.cache_response(
+                        cache_key, json.dumps(grid_res), stamp_names, stamps
                     )
+
+            raw_res = self.get_raw_responses(
+                query_list,
+                query_station_data=query_station_data,
+                db_type=db_type,
+                only_stations=onlyStations,
+                all_station_products=allStationProducts,
+                interval=interval,
+                dsn_subset=dsn_subset,
+            )
         except AccessToDatasetDenied:
             raise ServerError("Access to dataset denied")
+        except DballePoolTimeout:
+            raise ServiceUnavailable(
+                "The observed data database is busy, please retry later"
+            )
         except WrongDbConfiguration:
             raise ServerError(
                 "no dballe DSN configured for the requested license group"
             )
+        if cell_size:
+            grid_res = self.get_grid_response(cell_size, station_index, raw_res, last)
+            return self.cache_response(
+                cache_key, json.dumps(grid_res), stamp_names, stamps
+            )
+
         # parse the response
         res = dballe.parse_obs_maps_response(raw_res, last)
 
         if not res and stationDetails:
             raise NotFound("Station data not found")
 
-        return self.response(res)
+        # the data are cached with their serialized response, to be clipped
+        # to the requested bounding box
+        return self.cache_response(
+            cache_key,
+            (raw_res, res),
+            stamp_names,
+            stamps,
+            bbox=requested_bbox,
+            last=last,
+        )
+
+    @staticmethod
+    def get_raw_response(
+        q: Optional[Dict[str, Any]],
+        query_station_data: Dict[str, Any],
+        db_type: str,
+        only_stations: bool,
+        all_station_products: bool,
+        interval: Optional[int],
+        dsn_subset: Optional[List[str]],
+    ) -> Any:
+        station_query = {**query_station_data}
+        if q and station_query:
+            # add the params that can be multiple to the query for station details
+            if "timerange" in q:
+                station_query["timerange"] = q["timerange"]
+            if "level" in q:
+                station_query["level"] = q["level"]
+            if "product" in q and not all_station_products:
+                station_query["product"] = q["product"]
+            if "varlist" in q and not all_station_products:
+                station_query["varlist"] = q["varlist"]
+        if db_type == "mixed":
+            return dballe.get_maps_response_for_mixed(
+                q,
+                only_stations,
+                query_station_data=station_query,
+                dsn_subset=dsn_subset,
+            )
+        return dballe.get_maps_response(
+            q,
+            only_stations,
+            interval=interval,
+            db_type=db_type,
+            query_station_data=station_query,
+            dsn_subset=dsn_subset,
+        )
+
+    @staticmethod
+    def get_raw_responses(
+        query_list: List[Optional[Dict[str, Any]]], **params: Any
+    ) -> MapsResponseBuilder:
+        get_raw_response = functools.partial(
+            MapsObservations.get_raw_response, **params
+        )
+        workers = min(MAPS_QUERY_WORKERS, len(query_list))
+        if workers > 1:
+            # the queries are run concurrently, each in its own copy of the
+            # request context, and their results are merged in the query order
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = [
+                    pool.submit(copy_current_request_context(get_raw_response), q)
+                    for q in query_list
+                ]
+                raw_responses = [f.result() for f in futures]
+        else:
+            raw_responses = [get_raw_response(q) for q in query_list]
+
+        raw_res = MapsResponseBuilder()
+        for res in raw_responses:
+            if res:
+                raw_res.merge(res)
+        return raw_res
+
+    @staticmethod
+    def get_cached_response(
+        cache_key: Any,
+        stamp_names: Tuple[str, ...],
+        bbox: Optional[Tuple[float, float, float, float]],
+        last: bool,
+    ) -> Tuple[Optional[FlaskResponse], Stamps]:
+        # the stamps are read before querying the data of a missing response
+        cached_res, stamps = MapsResponseCache.get(cache_key, stamp_names)
+        if cached_res is None:
+            return None, stamps
+        return (
+            FlaskResponse(
+                MapsObservations.get_response_json(cached_res, bbox, last),
+                mimetype="application/json",
+            ),
+            stamps,
+        )
+
+    @staticmethod
+    def get_response_json(
+        res: Union[str, Tuple[MapsResponseBuilder, str]],
+        bbox: Optional[Tuple[float, float, float, float]],
+        last: bool,
+    ) -> str:
+        if isinstance(res, str):
+            # the grids are not clipped
+            return res
+        raw_res, serialized = res
+        # the stations outside the requested bounding box are removed from
+        # the data, then only the remaining ones are serialized
+        clipped = raw_res.clip(bbox)
+        if clipped is raw_res:
+            return serialized
+        return dballe.parse_obs_maps_response(clipped, last)
+
+    @staticmethod
+    def get_grid_cell_size(
+        zoom: Optional[int], gridSize: Optional[float], stationDetails: bool
+    ) -> Optional[float]:
+        if zoom is None and not gridSize:
+            return None
+        if stationDetails:
+            raise BadRequest("Station details can not be aggregated in a grid")
+        return MapsGrid.get_cell_size(zoom, gridSize)
+
+    @staticmethod
+    def get_grid_station_index(
+        query_list: List[Optional[Dict[str, Any]]],
+        db_type: str,
+        group_license: Any,
+        dsn_subset: Optional[List[str]],
+    ) -> Any:
+        # stations of the grid are indexed from the summaries
+        summary_queries = []
+        for q in query_list:
+            summary_query = dballe.parse_query_for_maps(q or {})
+            summary_query.pop("query", None)
+            summary_queries.append(summary_query)
+        grid_networks = None
+        if dsn_subset:
+            grid_networks = [
+                n for ds in dsn_subset for n in arki.get_observed_dataset_params(ds)
+            ]
+        with dballe.build_explorer(db_type, license_group=group_license) as explorer:
+            return MapsGrid.get_station_index(
+                MapsGrid.get_index_key(
+                    group_license.name, db_type, summary_queries, grid_networks
+                ),
+                explorer,
+                summary_queries,
+                networks=grid_networks,
+            )
+
+    @staticmethod
+    def get_grid_response(
+        cell_size: float,
+        station_index: Any,
+        raw_res: Optional[MapsResponseBuilder] = None,
+        last: bool = False,
+    ) -> Dict[str, Any]:
+        if raw_res is None:
+            # only the stations are counted
+            return {
+                "descr": {},
+                "grid": {"size": cell_size},
+                "data": MapsGrid.aggregate_stations(station_index, cell_size),
+            }
+        return {
+            "descr": dballe.get_maps_descriptions(raw_res),
+            "grid": {"size": cell_size},
+            "data": MapsGrid.aggregate_values(raw_res, station_index, cell_size, last),
+        }
+
+    @staticmethod
+    def cache_response(
+        cache_key: Any,
+        res: Union[str, Tuple[MapsResponseBuilder, str]],
+        stamp_names: Tuple[str, ...],
+        stamps: Stamps,
+        bbox: Optional[Tuple[float, float, float, float]] = None,
+        last: bool = False,
+    ) -> FlaskResponse:
+        MapsResponseCache.set(cache_key, res, stamp_names, stamps)
+        return FlaskResponse(
+            MapsObservations.get_response_json(res, bbox, last),
+            mimetype="application/json",
+        )
 
     @decorators.auth.optional()
     @decorators.use_kwargs(ObservationsDownloader, location="query")
@@ -622,3 +874,7 @@ def post(
                 return self.response([])
         except AccessToDatasetDenied:
             raise ServerError("Access to dataset denied")
+        except DballePoolTimeout:
+            raise ServiceUnavailable(
+                "The observed data database is busy, please retry later"
+            )
@@ -1,11 +1,10 @@
-import subprocess
 from pathlib import Path
 from typing import Any, Dict, List, Optional, Union
 from zipfile import ZipFile
 
 from flask import request
-from mistral.endpoints import DOWNLOAD_DIR
 from mistral.services.sqlapi_db_manager import SqlApiDbManager
+from mistral.services.usage_ledger import UsageLedger
 from osgeo import gdal
 from restapi import decorators
 from restapi.config import DATA_PATH
@@ -215,23 +214,21 @@ def post(self, user: User) -> Response:
             upload_filepath = self.convert_to_shapefile(upload_filepath)
 
         # check user quota
-        user_dir = DOWNLOAD_DIR.joinpath(user.uuid)
-        used_quota = int(subprocess.check_output(["du", "-sb", user_dir]).split()[0])
-        # check for exceeding quota
         db = sqlalchemy.get_instance()
-        max_user_quota = (
-            db.session.query(db.User.disk_quota).filter_by(id=user.id).scalar()
-        )
-        file_size = upload_filepath.stat().st_size
+        used_quota, max_user_quota = UsageLedger.get_usage(db, user.id)
+        # all the files related to the template
+        template_files = list(upload_filepath.parent.glob(f"{upload_filepath.stem}*"))
+        file_size = UsageLedger.get_files_size(template_files)
+        # check for exceeding quota
         if used_quota + file_size > max_user_quota:
-            filebase = upload_filepath.stem
-
-            # delete all the files related to the template
-            for f in zip_upload_path.parent.glob(f"{filebase}*"):
+            for f in template_files:
                 f.unlink()
 
             raise Forbidden("Disk quota exceeded")
 
+        UsageLedger.add(db, user.id, file_size)
+        db.session.commit()
+
         r = {
             "filepath": upload_filepath,
             "format": upload_filepath.suffix.strip("."),
@@ -280,9 +277,15 @@ def delete(self, template_name: str, user: User) -> Response:
             raise NotFound("The template doesn't exist")
 
         filebase = template.stem
-        for f in filepath.parent.glob(f"{filebase}*"):
+        template_files = list(filepath.parent.glob(f"{filebase}*"))
+        file_size = UsageLedger.get_files_size(template_files)
+        for f in template_files:
             f.unlink()
 
+        db = sqlalchemy.get_instance()
+        UsageLedger.remove(db, user.id, file_size)
+        db.session.commit()
+
         return self.response(
             f"File {template_name} succesfully deleted",
         )
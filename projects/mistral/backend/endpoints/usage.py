@@ -1,7 +1,6 @@
-import subprocess
-
-from mistral.endpoints import DOWNLOAD_DIR
+from mistral.services.usage_ledger import UsageLedger
 from restapi import decorators
+from restapi.connectors import sqlalchemy
 from restapi.rest.definition import EndpointResource, Response
 from restapi.services.authentication import User
 
@@ -21,12 +20,8 @@ def get(self, user: User) -> Response:
         """
         Get actual user disk quota and current usage
         """
-        used_quota = 0
-        user_dir = DOWNLOAD_DIR.joinpath(user.uuid)
-        if user_dir.is_dir():
-            used_quota = int(
-                subprocess.check_output(["du", "-sb", user_dir]).split()[0]
-            )
+        db = sqlalchemy.get_instance()
+        used_quota, disk_quota = UsageLedger.get_usage(db, user.id)
 
-        data = {"quota": user.disk_quota, "used": used_quota}
+        data = {"quota": disk_quota, "used": used_quota}
         return self.response(data)
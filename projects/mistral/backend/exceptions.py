@@ -48,3 +48,7 @@ class InvalidFiltersException(Exception):
 
 class DeleteScheduleException(Exception):
     """Exception for Deletion of a schedule from celerybeat"""
+
+
+class DballePoolTimeout(Exception):
+    """Exception raised if no connection to a dballe dsn becomes available in time"""
@@ -366,6 +366,28 @@ def __init__(self) -> None:
 
         log.info("Automatic_cleanup task installed every day at {}:{}", HOUR, MINUTE)
 
+        UNIQUE_NAME = "usage_reconciliation"
+
+        task = celery_app.get_periodic_task(name=UNIQUE_NAME)
+
+        if task:
+            log.info("Usage_reconciliation task already installed, deleting...")
+            res = celery_app.delete_periodic_task(name=UNIQUE_NAME)
+            log.info("Usage_reconciliation task deleted = {}", res)
+
+        # after the cleanup, that deletes the expired files
+        HOUR = "4"
+        MINUTE = "30"
+        celery_app.create_crontab_task(
+            name=UNIQUE_NAME,
+            task="usage_reconciliation",
+            hour=HOUR,
+            minute=MINUTE,
+            args=[],
+        )
+
+        log.info("Usage_reconciliation task installed every day at {}:{}", HOUR, MINUTE)
+
     # This method is called after normal initialization if TESTING mode is enabled
     def initialize_testing_environment(self) -> None:
         pass
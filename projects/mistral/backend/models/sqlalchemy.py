@@ -8,6 +8,8 @@
 
 # Add (inject) attributes to User
 setattr(User, "disk_quota", db.Column(db.BigInteger, default=1073741824))  # 1 GB
+# space currently used by the user files (see services/usage_ledger.py)
+setattr(User, "used_quota", db.Column(db.BigInteger, default=0, server_default="0"))
 
 setattr(User, "requests", db.relationship("Request", backref="author", lazy="dynamic"))
 setattr(
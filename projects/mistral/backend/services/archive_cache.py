@@ -0,0 +1,259 @@
+import os
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+import dballe
+from mistral.services.arkimet import BeArkimet as arki_service
+from restapi.env import Env
+from restapi.utilities.logs import log
+
+# max size in MB of the decoded archived days kept on disk (0 disables the cache)
+ARCHIVE_CACHE_SIZE = Env.get_int("ARCHIVE_CACHE_SIZE", 4096)
+# seconds after which a decoded day is read again from arkimet
+ARCHIVE_CACHE_TTL = Env.get_int("ARCHIVE_CACHE_TTL", 7 * 86400)
+# queries spanning more days are answered by a temporary db, as before
+ARCHIVE_CACHE_MAX_DAYS = Env.get_int("ARCHIVE_CACHE_MAX_DAYS", 31)
+ARCHIVE_CACHE_DIR = Path(Env.get("DATA_PATH", "/data"), ".archive_cache")
+# the days after the last migration from dballe can still be partial in arkimet
+# (dballe2arkimet moves the data older than LASTDAYS every night)
+ARCHIVE_CACHE_RECENT_DAYS = Env.get_int("LASTDAYS", 10) + 1
+
+
+class ArchiveTransaction:
+    """
+    Read-only transaction on a group of DB-All.e files: the queries are run on
+    every file in turn, with a single file open at a time
+    """
+
+    def __init__(self, paths: List[Path]) -> None:
+        self.paths = paths
+
+    def query(self, method: str, query: Dict[str, Any]) -> Iterator[Any]:
+        for path in self.paths:
+            with ArchiveDaysCache.connect(path) as db:
+                with db.transaction() as tr:
+                    yield from getattr(tr, method)(query)
+
+    def query_data(self, query: Dict[str, Any]) -> Iterator[Any]:
+        return self.query("query_data", query)
+
+    def query_messages(self, query: Dict[str, Any]) -> Iterator[Any]:
+        return self.query("query_messages", query)
+
+    def query_station_data(self, query: Dict[str, Any]) -> Iterator[Any]:
+        return self.query("query_station_data", query)
+
+
+class ArchiveDB:
+    """
+    The decoded archived days of a query, used in place of a single DB-All.e
+    """
+
+    def __init__(self, paths: List[Path]) -> None:
+        self.paths = paths
+
+    @contextmanager
+    def transaction(self) -> Iterator[ArchiveTransaction]:
+        yield ArchiveTransaction(self.paths)
+
+
+class ArchiveDaysCache:
+    """
+    Observed data archived in arkimet, decoded in a SQLite DB-All.e file for each
+    dataset and day. The days are decoded the first time they are requested and
+    the least recently used ones are removed when the cache exceeds ARCHIVE_CACHE_SIZE
+    """
+
+    _locks: Dict[Path, threading.Lock] = {}
+    _lock = threading.Lock()
+    _stats: Dict[str, int] = {"hits": 0, "misses": 0, "evicted": 0}
+
+    @staticmethod
+    def get_days(datemin: datetime, datemax: datetime) -> List[date]:
+        days = []
+        day = datemin.date()
+        while day <= datemax.date():
+            days.append(day)
+            day += timedelta(days=1)
+        return days
+
+    @staticmethod
+    def get_day_path(dataset: str, day: date) -> Path:
+        return ARCHIVE_CACHE_DIR.joinpath(dataset, f"{day.isoformat()}.sqlite")
+
+    @classmethod
+    def get_db(
+        cls,
+        datasets: List[str],
+        datemin: Optional[datetime],
+        datemax: Optional[datetime],
+    ) -> Optional[ArchiveDB]:
+        """
+        Return the decoded days of the datasets in the reftime interval,
+        or None if the interval can not be served by the cache
+        """
+        if ARCHIVE_CACHE_SIZE <= 0:
+            return None
+        if not isinstance(datemin, datetime) or not isinstance(datemax, datetime):
+            return None
+        days = cls.get_days(datemin, datemax)
+        if len(days) > ARCHIVE_CACHE_MAX_DAYS:
+            log.debug("{} archived days requested: cache not used", len(days))
+            return None
+        first_recent_day = datetime.utcnow().date() - timedelta(
+            days=ARCHIVE_CACHE_RECENT_DAYS
+        )
+        if days[-1] >= first_recent_day:
+            log.debug("recent archived days requested: cache not used")
+            return None
+
+        paths = []
+        decoded = False
+        for dataset in datasets:
+            for day in days:
+                path, day_decoded = cls.get_day(dataset, day)
+                paths.append(path)
+                decoded = decoded or day_decoded
+        # the cache grows only when a day is decoded
+        if decoded:
+            cls.evict(keep=set(paths))
+        return ArchiveDB(paths)
+
+    @classmethod
+    def get_day(cls, dataset: str, day: date) -> Tuple[Path, bool]:
+        """
+        Path of the decoded day and whether it has just been decoded
+        """
+        path = cls.get_day_path(dataset, day)
+        with cls._lock:
+            lock = cls._locks.setdefault(path, threading.Lock())
+        # the same day is decoded only once by the threads of this process
+        with lock:
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                stat = None
+            now = time.time()
+            if stat and stat.st_mtime + ARCHIVE_CACHE_TTL > now:
+                # the access time orders the days for the eviction
+                os.utime(path, (now, stat.st_mtime))
+                with cls._lock:
+                    cls._stats["hits"] += 1
+                return path, False
+
+            with cls._lock:
+                cls._stats["misses"] += 1
+            cls.fill_day(dataset, day, path)
+        return path, True
+
+    @classmethod
+    @contextmanager
+    def connect(cls, path: Path) -> Iterator[Any]:
+        """
+        Connect to a decoded day through a private hard link: a day evicted by
+        another process stays readable until the link is removed, and a missing
+        day is decoded again instead of being created empty by the connection
+        """
+        link = path.with_name(f"{path.stem}.{uuid.uuid4().hex}.read")
+        try:
+            os.link(path, link)
+        except FileNotFoundError:
+            log.debug("archived day {} evicted: decoding it again", path)
+            _, decoded = cls.get_day(path.parent.name, date.fromisoformat(path.stem))
+            if decoded:
+                cls.evict(keep={path})
+            os.link(path, link)
+        try:
+            yield dballe.DB.connect(f"sqlite:{link}")
+        finally:
+            link.unlink(missing_ok=True)
+
+    @staticmethod
+    def fill_day(dataset: str, day: date, path: Path) -> None:
+        log.debug("decoding archived data of {} for {}", dataset, day)
+        start = time.perf_counter()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        query = "reftime: >={day} 00:00:00,<={day} 23:59:59".format(day=day.isoformat())
+        # the day is decoded in a temporary file, then moved in place:
+        # other processes always find a complete db
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        os.close(fd)
+        try:
+            with tempfile.TemporaryFile(mode="a+b") as tmpf:
+                arki_service.extract_dataset(dataset, query, tmpf)
+                tmpf.seek(0)
+                db = dballe.DB.connect(f"sqlite:{tmp_name}?wipe=1")
+                importer = dballe.Importer("BUFR")
+                # all the messages are imported in a single transaction
+                with db.transaction() as tr:
+                    with importer.from_file(tmpf) as f:
+                        for msgs in f:
+                            tr.import_messages(msgs)
+                del db
+            os.replace(tmp_name, path)
+        except BaseException:
+            Path(tmp_name).unlink(missing_ok=True)
+            raise
+        log.info(
+            "archived data of {} for {} decoded in {:.3f}s",
+            dataset,
+            day,
+            time.perf_counter() - start,
+        )
+
+    @classmethod
+    def evict(cls, keep: Optional[Set[Path]] = None) -> None:
+        """
+        Remove the least recently used days until the cache fits ARCHIVE_CACHE_SIZE
+        """
+        # links of the days read by processes that did not remove them
+        for link in ARCHIVE_CACHE_DIR.glob("*/*.read"):
+            try:
+                if link.stat().st_ctime + ARCHIVE_CACHE_TTL < time.time():
+                    link.unlink()
+            except FileNotFoundError:
+                continue
+
+        days = []
+        total = 0
+        for path in ARCHIVE_CACHE_DIR.glob("*/*.sqlite"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                # removed by another process
+                continue
+            days.append((stat.st_atime, stat.st_size, path))
+            total += stat.st_size
+        max_size = ARCHIVE_CACHE_SIZE * 1024 * 1024
+        for _, size, path in sorted(days, key=lambda d: d[0]):
+            if total <= max_size:
+                break
+            if keep and path in keep:
+                continue
+            # the processes reading the day keep their open file
+            path.unlink(missing_ok=True)
+            total -= size
+            with cls._lock:
+                cls._stats["evicted"] += 1
+
+    @classmethod
+    def get_stats(cls) -> Dict[str, Any]:
+        with cls._lock:
+            stats: Dict[str, Any] = dict(cls._stats)
+        sizes = []
+        for path in ARCHIVE_CACHE_DIR.glob("*/*.sqlite"):
+            try:
+                sizes.append(path.stat().st_size)
+            except FileNotFoundError:
+                continue
+        stats["days"] = len(sizes)
+        stats["size"] = sum(sizes)
+        stats["max_size"] = ARCHIVE_CACHE_SIZE * 1024 * 1024
+        stats["ttl"] = ARCHIVE_CACHE_TTL
+        return stats
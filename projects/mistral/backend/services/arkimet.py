@@ -1,20 +1,88 @@
 import io
 import json
 import math
+import os
 import re
 import shlex
 import subprocess
-from typing import List
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
 
 import arkimet as arki
 import dateutil.parser
 from arkimet.cfg import Sections
 from arkimet.formatter import Formatter
 from mistral.exceptions import AccessToDatasetDenied
+from mistral.services.summary_cache import SummaryCache
 from restapi.env import Env
 from restapi.utilities.logs import log
 
 DATASET_ROOT = Env.get("DATASET_ROOT", "/")
+# max number of datasets queried concurrently during an extraction (1: one at a time)
+EXTRACTION_WORKERS = Env.get_int("ARKIMET_EXTRACTION_WORKERS", 1)
+
+
+class ArkimetRegistry:
+    """
+    Datasets configuration parsed from arkimet.conf, with the lookup tables
+    needed by the BeArkimet helpers
+    """
+
+    def __init__(self, cfg: Sections, signature: Tuple[int, int]) -> None:
+        self.cfg = cfg
+        self.signature = signature
+        self.sections: Dict[str, Dict[str, str]] = {}
+        self.formats: Dict[str, str] = {}
+        self.categories: Dict[str, str] = {}
+        self.networks: Dict[str, List[str]] = {}
+        self.network_to_dataset: Dict[str, str] = {}
+        self.datasets: List[Dict[str, str]] = []
+
+        for name, section in cfg.items():
+            items = dict(section.items())
+            self.sections[name] = items
+            if "format" in items:
+                self.formats[name] = items["format"]
+            if "_category" in items:
+                self.categories[name] = items["_category"]
+            # networks is the parameter that defines the different dataset for observed data
+            nets = [
+                f.split("=")[1]
+                for f in shlex.split(items.get("filter", ""))
+                if f.startswith("BUFR")
+            ]
+            self.networks[name] = nets
+            if name in ["error", "duplicates"]:
+                continue
+            for net in nets:
+                self.network_to_dataset.setdefault(net, name)
+            self.datasets.append(ArkimetRegistry.describe_dataset(name, items))
+
+    @staticmethod
+    def describe_dataset(name: str, items: Dict[str, str]) -> Dict[str, str]:
+        ds = {"id": name}
+        if "_name" in items:
+            name_key = "_name"
+        else:
+            name_key = "name"
+        for k, v in items.items():
+            if k == name_key:
+                ds["name"] = v
+            elif k == "description":
+                ds["description"] = v
+            elif k == "_license":
+                ds["license"] = v
+            elif k == "_category":
+                ds["category"] = v
+            elif k == "format":
+                ds["format"] = v
+            elif k == "bounding":
+                ds["bounding"] = v
+            elif k == "_attribution":
+                ds["attribution"] = v
+        return ds
 
 
 class BeArkimet:
@@ -36,6 +104,62 @@ class BeArkimet:
     allowed_licenses = ("CCBY4.0", "CCBY-SA4.0")
     arkimet_conf = "/arkimet/config/arkimet.conf"
 
+    # arkimet.conf is parsed once per process and parsed again only when the file changes
+    _registry: Optional[ArkimetRegistry] = None
+    _registry_lock = threading.Lock()
+
+    @staticmethod
+    def get_registry() -> ArkimetRegistry:
+        st = os.stat(BeArkimet.arkimet_conf)
+        signature = (st.st_mtime_ns, st.st_ino)
+        registry = BeArkimet._registry
+        if registry is None or registry.signature != signature:
+            with BeArkimet._registry_lock:
+                registry = BeArkimet._registry
+                if registry is None or registry.signature != signature:
+                    log.debug("parsing {}", BeArkimet.arkimet_conf)
+                    cfg = Sections.parse(BeArkimet.arkimet_conf)
+                    registry = ArkimetRegistry(cfg, signature)
+                    BeArkimet._registry = registry
+        return registry
+
+    @staticmethod
+    def get_dataset_section(dataset):
+        return BeArkimet.get_registry().cfg.section(dataset)
+
+    # arkimet session and dataset readers are opened once and reused by the following calls.
+    # Readers are not shared between threads: every thread (e.g. a celery worker) has its own pool
+    _reader_pool = threading.local()
+
+    @staticmethod
+    def get_dataset_reader(dataset):
+        registry = BeArkimet.get_registry()
+        pool = BeArkimet._reader_pool
+        if getattr(pool, "signature", None) != registry.signature:
+            # arkimet configuration has changed: open a new session
+            if getattr(pool, "signature", None) is not None:
+                log.debug("arkimet configuration changed: refreshing the readers")
+            pool.session = arki.dataset.Session()
+            pool.readers = {}
+            pool.signature = registry.signature
+
+        reader = pool.readers.get(dataset)
+        if reader is None or not BeArkimet.is_dataset_reader_healthy(registry, dataset):
+            reader = pool.session.dataset_reader(cfg=registry.cfg.section(dataset))
+            pool.readers[dataset] = reader
+        return reader
+
+    @staticmethod
+    def is_dataset_reader_healthy(registry, dataset):
+        # the reader can be reused as long as its dataset is still on disk
+        path = registry.sections.get(dataset, {}).get("path")
+        return not path or os.path.isdir(path)
+
+    @staticmethod
+    def drop_dataset_reader(dataset):
+        readers = getattr(BeArkimet._reader_pool, "readers", {})
+        readers.pop(dataset, None)
+
     @staticmethod
     def load_datasets():
         """
@@ -43,32 +167,7 @@ def load_datasets():
 
         :return: list of datasets
         """
-        datasets = []
-        cfg_sections = Sections()
-        cfg = cfg_sections.parse(BeArkimet.arkimet_conf)
-        for i in [a for a in cfg.items() if a[0] not in ["error", "duplicates"]]:
-            ds = {"id": i[0]}
-            for k, v in i[1].items():
-                if "_name" in i[1]:
-                    name_key = "_name"
-                else:
-                    name_key = "name"
-                if k == name_key:
-                    ds["name"] = v
-                elif k == "description":
-                    ds["description"] = v
-                elif k == "_license":
-                    ds["license"] = v
-                elif k == "_category":
-                    ds["category"] = v
-                elif k == "format":
-                    ds["format"] = v
-                elif k == "bounding":
-                    ds["bounding"] = v
-                elif k == "_attribution":
-                    ds["attribution"] = v
-            datasets.append(ds)
-        return datasets
+        return [dict(ds) for ds in BeArkimet.get_registry().datasets]
 
     @staticmethod
     def load_summary(datasets=[], query=""):
@@ -82,32 +181,25 @@ def load_summary(datasets=[], query=""):
         if query is None:
             query = ""
 
-        # parse the config
-        cfg_sections = Sections()
-        cfg = cfg_sections.parse(BeArkimet.arkimet_conf)
+        sections = BeArkimet.get_registry().sections
+        if datasets:
+            datasets = [d for d in datasets if d in sections]
+        else:
+            # consider all the datasets
+            datasets = list(sections)
+
+        cache_key = SummaryCache.get_key(datasets, query)
+        summary = SummaryCache.get(cache_key)
+        if summary is not None:
+            log.debug("summary for {} found in cache", cache_key)
+            return summary
 
         summary = ""
-        arki_summary = None
-        # add the datasets to a session
-        with arki.dataset.Session() as session:
-            for name, section in cfg.items():
-                if datasets:
-                    # add the selected datasets to the session
-                    if name in datasets:
-                        log.debug(f"added {name}")
-                        session.add_dataset(section)
-                else:
-                    # add all datasets to the section
-                    log.debug(f"added {name}")
-                    session.add_dataset(section)
-            # use Session.merged() to see all the selected datasets as it is one
-            with session.merged() as dataset:
-                with dataset.reader() as reader:
-                    # import query
-                    matcher = session.matcher(query)
-                    log.debug(f"query: {query}")
-                    # ask the summary
-                    arki_summary = reader.query_summary(matcher)
+        # the summary of the datasets is the same of their merged view
+        arki_summary = arki.Summary()
+        log.debug(f"query: {query}")
+        for name in datasets:
+            BeArkimet.query_dataset_summary(name, query, arki_summary)
 
         if arki_summary:
             with io.BytesIO() as out:
@@ -115,6 +207,7 @@ def load_summary(datasets=[], query=""):
                 out.seek(0)
                 summary = json.load(out)
 
+        SummaryCache.set(cache_key, summary)
         return summary
 
     @staticmethod
@@ -122,15 +215,21 @@ def estimate_data_size(datasets, query):
         """
         Estimate arki-query output size.
         """
-        cfg = arki.cfg.Sections.parse(BeArkimet.arkimet_conf)
         summary = arki.Summary()
         for d in datasets:
-            dt = cfg.section(d)
-            source = arki.dataset.Session().dataset_reader(cfg=dt)
-            source.query_summary(query, summary)
+            BeArkimet.query_dataset_summary(d, query, summary)
 
         return summary.size
 
+    @staticmethod
+    def query_dataset_summary(dataset, query, summary):
+        try:
+            BeArkimet.get_dataset_reader(dataset).query_summary(query, summary)
+        except Exception:
+            # do not reuse a reader that failed
+            BeArkimet.drop_dataset_reader(dataset)
+            raise
+
     @staticmethod
     def is_filter_allowed(filter_name):
         return True if filter_name in BeArkimet.allowed_filters else False
@@ -199,13 +298,8 @@ def get_datasets_format(datasets):
         :return: format of files in datasets
         """
 
-        formats = []
-        cfg = arki.cfg.Sections.parse(BeArkimet.arkimet_conf)
-        for ds in datasets:
-            ds_section = cfg.section(ds)
-            for k, v in ds_section.items():
-                if k == "format":
-                    formats.append(v)
+        registry = BeArkimet.get_registry()
+        formats = [registry.formats[ds] for ds in datasets if ds in registry.formats]
 
         # check if all the datasets are of the same type (else return an error)
         # return the general format of the datasets (bufr or grib)
@@ -219,13 +313,10 @@ def get_datasets_category(datasets):
         """
         :return: datasets category (forecast or observed)
         """
-        category = []
-        cfg = arki.cfg.Sections.parse(BeArkimet.arkimet_conf)
-        for ds in datasets:
-            ds_section = cfg.section(ds)
-            for k, v in ds_section.items():
-                if k == "_category":
-                    category.append(v)
+        registry = BeArkimet.get_registry()
+        category = [
+            registry.categories[ds] for ds in datasets if ds in registry.categories
+        ]
         # check if all the datasets are of the same type (else return an error)
         # return the general format of the datasets (bufr or grib)
         if all(x == category[0] for x in category):
@@ -236,20 +327,8 @@ def get_datasets_category(datasets):
     # to configure observed datasets one by one
     @staticmethod
     def get_observed_dataset_params(dataset):
-        cfg = arki.cfg.Sections.parse(BeArkimet.arkimet_conf)
-        ds_section = cfg.section(dataset)
-        filters = ""
-        for k, v in ds_section.items():
-            if k == "filter":
-                filters = v
-
-        filters_split = shlex.split(filters)
         # networks is the parameter that defines the different dataset for observed data
-        networks = []
-        for f in filters_split:
-            if f.startswith("BUFR"):
-                networks.append(f.split("=")[1])
-        return networks
+        return list(BeArkimet.get_registry().networks.get(dataset, []))
 
     # to configure all observed datasets at one time
     # @staticmethod
@@ -276,40 +355,17 @@ def get_observed_dataset_params(dataset):
 
     @staticmethod
     def from_network_to_dataset(network):
-        cfg_sections = Sections()
-        cfg = cfg_sections.parse(BeArkimet.arkimet_conf)
-        for i in [a for a in cfg.items() if a[0] not in ["error", "duplicates"]]:
-            filter = i[1]["filter"]
-            filters_split = shlex.split(filter)
-            # networks is the parameter that defines the different dataset for observed data
-            nets = []
-            for f in filters_split:
-                if f.startswith("BUFR"):
-                    nets.append(f.split("=")[1])
-            if network in nets:
-                return i[0]
-        return None
+        return BeArkimet.get_registry().network_to_dataset.get(network)
 
     @staticmethod
     def from_dataset_to_networks(dataset):
-        nets = []
-        cfg_sections = Sections()
-        cfg = cfg_sections.parse(BeArkimet.arkimet_conf)
-        for i in [a for a in cfg.items() if a[0] == dataset]:
-            filter = i[1]["filter"]
-            filters_split = shlex.split(filter)
-            # networks is the parameter that defines the different dataset for observed data
-            for f in filters_split:
-                if f.startswith("BUFR"):
-                    nets.append(f.split("=")[1])
-        return nets
+        return list(BeArkimet.get_registry().networks.get(dataset, []))
 
     @staticmethod
     def get_obs_datasets(query, license):
         # actually this function is used only in tests and in a "side" script. For other purpose is better to use SqlApiDbManager.get_datasets that retrieve datasets from the db instead of arkimet config
         datasets = []
-        cfg_sections = Sections()
-        cfg = cfg_sections.parse(BeArkimet.arkimet_conf)
+        cfg = BeArkimet.get_registry().cfg
         for i in [a for a in cfg.items() if a[0] not in ["error", "duplicates"]]:
             category = i[1]["_category"]
             # check if the dataset is for observed data
@@ -329,8 +385,8 @@ def get_obs_datasets(query, license):
                     continue
             # filter by query
             if query:
-                source = arki.dataset.Session().dataset_reader(cfg=i[1])
-                summary = source.query_summary(query)
+                summary = arki.Summary()
+                BeArkimet.query_dataset_summary(i[0], query, summary)
                 if summary.count == 0:
                     continue
             # append the filtered datasets
@@ -352,15 +408,83 @@ def get_obs_datasets(query, license):
         return datasets
 
     @staticmethod
-    def arkimet_extraction(datasets, query, outfile):
-        cfg = arki.cfg.Sections.parse(BeArkimet.arkimet_conf)
+    def arkimet_extraction(datasets, query, outfile, workers=None):
+        if workers is None:
+            workers = EXTRACTION_WORKERS
+        if workers > 1 and len(datasets) > 1:
+            BeArkimet.parallel_arkimet_extraction(datasets, query, outfile, workers)
+            return
 
         with open(outfile, mode="a+b") as outfile:
             for d in datasets:
-                dt_part = cfg.section(d)
-                source = arki.dataset.Session().dataset_reader(cfg=dt_part)
-                bin_data = source.query_bytes(query, with_data=True)
-                outfile.write(bin_data)
+                BeArkimet.extract_dataset(d, query, outfile)
+
+    @staticmethod
+    def extract_dataset(dataset, query, outfile):
+        source = BeArkimet.get_dataset_reader(dataset)
+        # arkimet streams the data directly to the output file,
+        # without loading the whole result in memory
+        try:
+            source.query_bytes(query, with_data=True, file=outfile)
+        except Exception:
+            # do not reuse a reader that failed
+            BeArkimet.drop_dataset_reader(dataset)
+            raise
+        outfile.flush()
+
+    @staticmethod
+    def parallel_arkimet_extraction(datasets, query, outfile, workers):
+        """
+        Query the datasets concurrently, each one to its own part file,
+        then append the parts to the output file in the order of the datasets
+        """
+        parts = [Path(f"{outfile}_part{i}.tmp") for i in range(len(datasets))]
+
+        def extract(dataset, part):
+            with open(part, mode="wb") as part_file:
+                BeArkimet.extract_dataset(dataset, query, part_file)
+
+        try:
+            with ThreadPoolExecutor(max_workers=min(workers, len(datasets))) as pool:
+                futures = [
+                    pool.submit(extract, d, part) for d, part in zip(datasets, parts)
+                ]
+                # raise the first error, if any
+                for future in futures:
+                    future.result()
+            BeArkimet.append_files(parts, outfile)
+        finally:
+            for part in parts:
+                if part.exists():
+                    part.unlink()
+
+    @staticmethod
+    def append_files(parts, outfile):
+        # copy_file_range and sendfile do not support outputs opened in append mode
+        out_fd = os.open(outfile, os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            os.lseek(out_fd, 0, os.SEEK_END)
+            for part in parts:
+                with open(part, "rb") as part_file:
+                    in_fd = part_file.fileno()
+                    remaining = os.fstat(in_fd).st_size
+                    use_copy_file_range = hasattr(os, "copy_file_range")
+                    while remaining > 0:
+                        # the data is copied by the kernel without passing through python
+                        if use_copy_file_range:
+                            try:
+                                copied = os.copy_file_range(in_fd, out_fd, remaining)
+                            except OSError:
+                                # e.g. not supported by the filesystem
+                                use_copy_file_range = False
+                                continue
+                        else:
+                            copied = os.sendfile(out_fd, in_fd, None, remaining)
+                        if copied == 0:
+                            break
+                        remaining -= copied
+        finally:
+            os.close(out_fd)
 
     @staticmethod
     def get_leveltype_descriptions(level_list):
@@ -1,30 +1,92 @@
+import calendar
 import itertools
 import math
-import subprocess
 import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from datetime import datetime, time, timedelta
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple, Union
+from time import perf_counter
+from typing import Any, Dict, List, Optional, Set, Tuple, Union
 
-import arkimet as arki
 import dateutil
 import dballe
+import numpy as np
 import wreport
+from flask import copy_current_request_context, has_request_context
 from mistral.exceptions import (
     EmptyOutputFile,
     InvalidFiltersException,
-    JoinObservedExtraction,
     NetworkNotInLicenseGroup,
     UnAuthorizedUser,
     UnexistingLicenseGroup,
     WrongDbConfiguration,
 )
+from mistral.services.archive_cache import ArchiveDaysCache, ArchiveDB
 from mistral.services.arkimet import BeArkimet as arki_service
+from mistral.services.dballe_pool import DballePools
+from mistral.services.explorer_cache import ExplorerCache
+from mistral.services.maps_response import NO_FLAG, NO_TIME, MapsResponseBuilder
+from mistral.services.message_filter import QC_CODES, MessageFilter
+from mistral.services.query_planner import QueryPlanner
 from mistral.services.sqlapi_db_manager import SqlApiDbManager
+from mistral.services.station_details import StationDetailsCache
+from mistral.services.summary_store import SummaryStore
 from restapi.connectors import sqlalchemy
 from restapi.env import Env
 from restapi.utilities.logs import log
 
+# bits needed to encode the physical variables in BUFR messages, by B table code.
+# Shared by the whole process (see BeDballe.load_physical_variable_bits)
+PHYSICAL_VARIABLE_BITS: Dict[str, int] = {}
+PHYSICAL_VARIABLE_VARTABLES: Dict[str, Any] = {}
+PHYSICAL_VARIABLE_BITS_LOCK = threading.Lock()
+
+# threads querying the archive for the maps of mixed dbs (see BeDballe.get_archive_executor)
+MAPS_ARCHIVE_EXECUTOR: Optional[ThreadPoolExecutor] = None
+MAPS_ARCHIVE_EXECUTOR_LOCK = threading.Lock()
+
+
+def with_current_context(func):
+    # the request context is needed by the threads using the sqlalchemy connector
+    if has_request_context():
+        return copy_current_request_context(func)
+    return func
+
+
+class ExtractionOutput:
+    """
+    Binary output of the observed data extractions. The file is created only
+    when the first message is found and it is removed if the extraction fails
+    """
+
+    def __init__(self, path: Union[str, Path]) -> None:
+        self.path = Path(path)
+        self.file = None
+
+    def __bool__(self) -> bool:
+        return self.file is not None
+
+    def __enter__(self) -> "ExtractionOutput":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if self.file is None:
+            return
+        self.file.close()
+        if exc_type is not None:
+            # do not leave a partial output
+            self.path.unlink(missing_ok=True)
+
+    def open(self) -> None:
+        if self.file is None:
+            self.file = open(self.path, "wb")
+
+    def write(self, data: bytes) -> None:
+        self.open()
+        self.file.write(data)
+
 
 class BeDballe:
     MAPS_NETWORK_FILTER = []  # ["multim-forecast"]
@@ -40,8 +102,14 @@ class BeDballe:
     DBALLE_JSON_SUMMARY_PATH = "/arkimet/config/dballe_summary"
     DBALLE_JSON_SUMMARY_PATH_FILTERED = "/arkimet/config/dballe_summary_filtered"
 
+    # max number of concurrent archive queries for the maps of mixed dbs
+    MAPS_ARCHIVE_WORKERS = Env.get_int("MAPS_ARCHIVE_WORKERS", 2)
+
+    # compute messages and size count of the observed data in bulk with numpy
+    VECTORIZED_SUMMARY = Env.get_bool("VECTORIZED_SUMMARY", True)
+
     # dballe codes for quality check attributes to consider for quality check filters
-    QC_CODES = ["B33007", "B33192"]
+    QC_CODES = list(QC_CODES)
 
     ################################################
     # CONSTANTS USEFUL FOR MESSAGES AND SIZE COUNT #
@@ -244,8 +312,8 @@ def build_arkimet_query(
         network=None,
         bounding_box=None,
         dballe_query=None,
-        all_dballe_queries=None,
         fields=None,
+        queries=None,
         license_group=None,
     ):
         if isinstance(datemin, datetime):
@@ -267,44 +335,32 @@ def build_arkimet_query(
                 for i in network[1:]:
                     arkimet_query += f" or  BUFR:t = {i}"
             arkimet_query += ";"
-        if dballe_query or all_dballe_queries:
+        if dballe_query or queries:
             # improve the query adding stations
-            explorer = BeDballe.build_explorer(
+            # coordinates of the stations, without duplicates
+            stations: Dict[Tuple[Any, Any], None] = {}
+            with BeDballe.build_explorer(
                 "arkimet", license_group=license_group, network_list=network
-            )
-            # create a list of station details
-            station_list = []
-            # populate the station list.
-            # If there is all_dballe_queries do an iteration to populate the list
-            if dballe_query:
-                for cur in explorer.query_summary_all(dballe_query):
-                    el = {}
-                    el["lat"] = cur["lat"]
-                    el["lon"] = cur["lon"]
-                    station_list.append(el)
-            elif all_dballe_queries:
-                for q in all_dballe_queries:
-                    dballe_query = {}
-                    for k, v in zip(fields, q):
-                        dballe_query[k] = v
+            ) as explorer:
+                # populate the station list. With the lists of values of the fields,
+                # levels and timeranges are checked on the summaries in memory
+                if dballe_query:
                     for cur in explorer.query_summary_all(dballe_query):
-                        el = {}
-                        el["lat"] = cur["lat"]
-                        el["lon"] = cur["lon"]
-                        station_list.append(el)
-            if station_list:
-                arkimet_query += "area: GRIB:lat={}, lon={}".format(
-                    str(station_list[0]["lat"]).replace(".", ""),
-                    str(station_list[0]["lon"]).replace(".", ""),
+                        stations[(cur["lat"], cur["lon"])] = None
+                elif queries:
+                    for q, post_filter in QueryPlanner.get_summary_queries(
+                        fields, queries
+                    ):
+                        for cur in explorer.query_summary_all(q):
+                            if QueryPlanner.matches(cur, post_filter):
+                                stations[(cur["lat"], cur["lon"])] = None
+            if stations:
+                arkimet_query += "area: " + " or ".join(
+                    "GRIB:lat={}, lon={}".format(
+                        str(lat).replace(".", ""), str(lon).replace(".", "")
+                    )
+                    for lat, lon in stations
                 )
-                if len(station_list) > 1:
-                    for e in station_list[1:]:
-                        query_to_add = " or GRIB:lat={}, lon={}".format(
-                            str(e["lat"]).replace(".", ""),
-                            str(e["lon"]).replace(".", ""),
-                        )
-                        if query_to_add not in arkimet_query:
-                            arkimet_query += query_to_add
             else:
                 # if there is no station list it means there are no data for this query
                 return None
@@ -344,41 +400,43 @@ def build_explorer(db_type, license_group=None, network_list=None):
         if not license_group:
             raise UnexistingLicenseGroup
         # log.debug("filtered {}", need_filtered)
-        explorer = dballe.DBExplorer()
-        with explorer.update() as updater:
+        summary_file_suffix = license_group.name.replace(" ", "_")
+        summary_files = []
+        if db_type == "dballe" or db_type == "mixed":
+            if need_filtered:
+                summary_file_prefix = BeDballe.DBALLE_JSON_SUMMARY_PATH_FILTERED
+            else:
+                summary_file_prefix = BeDballe.DBALLE_JSON_SUMMARY_PATH
+            summary_files.append(
+                Path(f"{summary_file_prefix}_{summary_file_suffix}.json")
+            )
 
-            if db_type == "dballe" or db_type == "mixed":
-                if need_filtered:
-                    summary_file_prefix = BeDballe.DBALLE_JSON_SUMMARY_PATH_FILTERED
-                else:
-                    summary_file_prefix = BeDballe.DBALLE_JSON_SUMMARY_PATH
+        if db_type == "arkimet" or db_type == "mixed":
+            if need_filtered:
+                summary_file_prefix = BeDballe.ARKI_JSON_SUMMARY_PATH_FILTERED
+            else:
+                summary_file_prefix = BeDballe.ARKI_JSON_SUMMARY_PATH
+            summary_files.append(
+                Path(f"{summary_file_prefix}_{summary_file_suffix}.json")
+            )
 
-                summary_file_suffix = license_group.name.replace(" ", "_")
-                json_summary_file = Path(
-                    f"{summary_file_prefix}_{summary_file_suffix}.json"
-                )
-                # log.debug("dballe summary file{}", json_summary_file)
-                log.debug("loaded in explorer {}", json_summary_file)
-                if json_summary_file.exists():
-                    with open(json_summary_file) as fd:
-                        updater.add_json(fd.read())
-
-            if db_type == "arkimet" or db_type == "mixed":
-                if need_filtered:
-                    summary_file_prefix = BeDballe.ARKI_JSON_SUMMARY_PATH_FILTERED
-                else:
-                    summary_file_prefix = BeDballe.ARKI_JSON_SUMMARY_PATH
+        # the parsed explorer is shared by the whole process and reloaded only when
+        # the summary files change: each request gets its own filtered view on it
+        explorer_key = (license_group.name, db_type, str(need_filtered))
 
-                summary_file_suffix = license_group.name.replace(" ", "_")
-                json_summary_file = Path(
-                    f"{summary_file_prefix}_{summary_file_suffix}.json"
-                )
+        # use the indexed summary stores if all the summaries have been migrated
+        store_files = [SummaryStore.get_store_path(f) for f in summary_files]
+        if any(f.exists() for f in store_files) and all(
+            s.exists() or not j.exists() for j, s in zip(summary_files, store_files)
+        ):
+            log.debug("summary stores for explorer: {}", store_files)
+            return SummaryStore.get_view(
+                [f for f in store_files if f.exists()],
+                # for the queries the stores can not answer
+                fallback=lambda: ExplorerCache.get_view(explorer_key, summary_files),
+            )
 
-                log.debug("loaded in explorer {}", json_summary_file)
-                if json_summary_file.exists():
-                    with open(json_summary_file) as fd:
-                        updater.add_json(fd.read())
-        return explorer
+        return ExplorerCache.get_view(explorer_key, summary_files)
 
     @staticmethod
     def get_summary(params, explorer, query=None, fields=None, queries=None):
@@ -424,22 +482,17 @@ def get_summary(params, explorer, query=None, fields=None, queries=None):
 
         log.debug("Counting messages: fields: {}, queries: {}", fields, queries)
 
-        # get all the possible combinations of queries to count the messages
-        all_queries = list(itertools.product(*queries))
+        # the messages are counted as they will be extracted,
+        # with all the requested variables in the same query
+        planned_fields, planned_queries = QueryPlanner.plan(fields, queries)
+        all_queries = list(itertools.product(*planned_queries))
 
         # "query_important_params" contains info and flags that lead us to the correct way of counting messages and
-        # size, as explained in the comments of the method
+        # size, as explained in the comments of the method. They are computed on the planned queries: the variables
+        # of a varlist are extracted in the same messages, so they are counted as a request without a product filter
         query_important_params = BeDballe.__get_query_important_params(
-            params, fields, queries
+            params, planned_fields, planned_queries
         )
-        # Obtaining the Vartables containing all BUFR variable codes.
-        # This is necessary to retrieve physical variables' encoding bits.
-        vartables = BeDballe.get_wreport_vartables()
-
-        # Dictionary to be populated with bits accounting for physical variables (as total bits needed for encoding
-        # and descriptor in BUFR messages)
-        physical_variable_bits_dict: {str: int} = {}
-
         # messages and size counters
         message_count = 0
         size_count = 0
@@ -449,7 +502,7 @@ def get_summary(params, explorer, query=None, fields=None, queries=None):
         summary_max_date: Optional[datetime] = None
 
         for q in all_queries:
-            dballe_query = {k: v for k, v in zip(fields, q)}
+            dballe_query = {k: v for k, v in zip(planned_fields, q)}
             dballe_query["query"] = "details"
 
             explorer.set_filter(dballe_query)
@@ -481,6 +534,28 @@ def get_summary(params, explorer, query=None, fields=None, queries=None):
                     )
                 continue
 
+            if BeDballe.VECTORIZED_SUMMARY:
+                # same counts of the per-cursor methods below, computed on the whole summary at once
+                (
+                    query_message_count,
+                    query_size_count,
+                    query_effective_dt_interval,
+                ) = BeDballe.__get_vectorized_messages_and_size_count(
+                    explorer.query_summary(dballe_query),
+                    query_important_params,
+                    BeDballe.get_physical_variable_bits,
+                )
+                message_count += query_message_count
+                size_count += query_size_count
+                if query_effective_dt_interval:
+                    (
+                        summary_min_date,
+                        summary_max_date,
+                    ) = BeDballe.__adjust_summary_time_interval_boundaries(
+                        query_effective_dt_interval, summary_min_date, summary_max_date
+                    )
+                continue
+
             if query_important_params["need_different_size_count"]:
                 # We need to populate 'all_stations_reference_data' in order to compute the non-standard size and
                 # message count
@@ -523,10 +598,8 @@ def get_summary(params, explorer, query=None, fields=None, queries=None):
                     message_count, size_count, = BeDballe.__get_messages_and_size_count(
                         cur,
                         effective_messages,
-                        physical_variable_bits_dict,
                         query_important_params,
                         all_stations_reference_data,
-                        vartables,
                         size_count,
                         message_count,
                     )
@@ -701,6 +774,12 @@ def get_wreport_vartables():
 
         return vartables
 
+    @staticmethod
+    def get_station_key(cur):
+        # the summary stores have no ana_id: a station is identified by its
+        # network, coordinates and ident, as in dballe
+        return (cur["rep_memo"], cur["lat"], cur["lon"], cur["ident"])
+
     @staticmethod
     def __populate_all_stations_reference_data(
         cur, effective_messages, selected_filters_keys, all_stations_reference_data
@@ -721,17 +800,16 @@ def __populate_all_stations_reference_data(
         )
 
         # Update all_stations_reference_data if station ID is already in the dictionary
-        if cur["ana_id"] not in all_stations_reference_data:
-            all_stations_reference_data[cur["ana_id"]] = {}
+        station = BeDballe.get_station_key(cur)
+        if station not in all_stations_reference_data:
+            all_stations_reference_data[station] = {}
 
         if (
-            filters_values not in all_stations_reference_data[cur["ana_id"]]
+            filters_values not in all_stations_reference_data[station]
             or effective_messages
-            > all_stations_reference_data[cur["ana_id"]][filters_values][
-                "ref_eff_mex_count"
-            ]
+            > all_stations_reference_data[station][filters_values]["ref_eff_mex_count"]
         ):
-            all_stations_reference_data[cur["ana_id"]][filters_values] = {
+            all_stations_reference_data[station][filters_values] = {
                 "ref_trange": cur["trange"],
                 "ref_var": cur["var"],
                 "ref_level": cur["level"],
@@ -887,10 +965,8 @@ def __populate_cursor_effective_datetime_dict(cur_original_dt, query_original_dt
     def __get_messages_and_size_count(
         cur,
         effective_messages,
-        physical_variable_bits_dict,
         query_important_params,
         all_stations_reference_data,
-        vartables,
         size_count,
         message_count,
     ):
@@ -917,8 +993,6 @@ def __get_messages_and_size_count(
             size_count, message_count = BeDballe.__get_standard_size_and_message_count(
                 cur,
                 effective_messages,
-                physical_variable_bits_dict,
-                vartables,
                 size_count,
                 message_count,
             )
@@ -931,9 +1005,7 @@ def __get_messages_and_size_count(
             ) = BeDballe.get_non_standard_size_and_message_count(
                 cur,
                 effective_messages,
-                physical_variable_bits_dict,
                 new_attr_covered_flags,
-                vartables,
                 size_count,
                 message_count,
             )
@@ -953,9 +1025,9 @@ def __check_is_this_cursor_reference_or_new_attributes_are_covered(
             else tuple([cur[key] for key in selected_filters_keys])
         )
 
-        station_summary_data = all_stations_reference_data[cur["ana_id"]][
-            filter_values
-        ]  # cur['ana_id'] is station ID
+        station_summary_data = all_stations_reference_data[
+            BeDballe.get_station_key(cur)
+        ][filter_values]
 
         is_this_cursor_the_reference = all(
             cur[cur_field_key] == station_summary_data[reference_field_key]
@@ -996,8 +1068,6 @@ def __check_new_attr_covered(covered_fields, field_attr, cursor_attribute):
     def __get_standard_size_and_message_count(
         cursor,
         effective_messages,
-        physical_variable_bits_dict,
-        vartables,
         size_count,
         message_count,
     ):
@@ -1009,9 +1079,7 @@ def __get_standard_size_and_message_count(
             add_level_bits += 47 if cursor[cur_key] else 0
 
         # Total number of bits for the physical variable
-        phys_var_total_bits = BeDballe.__get_physical_variable_bits(
-            vartables, physical_variable_bits_dict, cursor["var"]
-        )
+        phys_var_total_bits = BeDballe.get_physical_variable_bits(cursor["var"])
 
         total_bits_per_message = (
             BeDballe.STANDARD_FIXED_BITS
@@ -1028,71 +1096,76 @@ def __get_standard_size_and_message_count(
         return size_count, message_count
 
     @staticmethod
-    def __get_physical_variable_bits(vartables, physical_variable_bits_dict, var_code):
+    def load_physical_variable_bits():
         """
-        This method calculates the number of bits needed to encode the value of the physical variable. It then adds 16
-        to this number, representing the bits required for the variable in SECTION 3 of the BUFR message.
-        Consequently, the method returns the total bit count for the physical variable.
+        Build the table of the bits needed to encode the value of every physical variable of the B tables,
+        plus 16 bits representing the variable in SECTION 3 of the BUFR message.
+        The table is shared by the whole process and built only once: size count becomes a dictionary lookup.
         """
-        phys_var_encoding_bits = 0
-        principal_vartable = vartables["principal_vartable"]
-        secondary_vartable = vartables["secondary_vartable"]
-
-        if not isinstance(principal_vartable, wreport.Vartable) and not isinstance(
-            secondary_vartable, wreport.Vartable
-        ):
-            # It was not possible to retrieve Vartables from wreport folder 'usr/share/wreport'
-            phys_var_total_bits = 16  # 16 + phys_var_encoding_bits = 16 + 0 = 16
-            return phys_var_total_bits
-
-        if var_code not in physical_variable_bits_dict:
-            b_table_variable = None
-
-            if isinstance(principal_vartable, wreport.Vartable):
-                try:
-                    b_table_variable = principal_vartable[var_code]
-                except KeyError:
-                    pass
-                    # log.warning(
-                    #     f"B code {var_code} variable's bit size cannot be obtained from principal Vartable. "
-                    #     f"KeyError Exception message: {e}"
-                    # )
-
-            if not b_table_variable and isinstance(
-                secondary_vartable, wreport.Vartable
-            ):
+        with PHYSICAL_VARIABLE_BITS_LOCK:
+            if PHYSICAL_VARIABLE_VARTABLES:
+                return
+            vartables = BeDballe.get_wreport_vartables()
+            table: Dict[str, int] = {}
+            # variables of the principal Vartable take precedence over the secondary one
+            for vartable_key in ("secondary_vartable", "principal_vartable"):
+                vartable = vartables[vartable_key]
+                if not isinstance(vartable, wreport.Vartable):
+                    continue
                 try:
-                    b_table_variable = secondary_vartable[var_code]
-                    # log.info(
-                    #     f"Variable {var_code} bit size was obtained from secondary Vartable: {secondary_vartable}"
-                    # )
-                except KeyError as e:
-                    log.warning(
-                        f"B code {var_code} variable's bit size cannot be obtained from either the primary or the "
-                        f"secondary Vartable. "
-                        f"KeyError Exception message: {e}"
-                    )
+                    for b_table_variable in vartable:
+                        table[b_table_variable.code] = 16 + b_table_variable.bit_len
+                except (TypeError, KeyError) as e:
+                    # variables will be added to the table at their first lookup
+                    log.warning(f"Unable to list the variables of {vartable_key}: {e}")
+            PHYSICAL_VARIABLE_BITS.update(table)
+            PHYSICAL_VARIABLE_VARTABLES.update(vartables)
+            log.debug("bits loaded for {} physical variables", len(table))
 
-            if b_table_variable:
-                # Retrieving the physical variable
-                phys_variable = wreport.Var(b_table_variable)
-                # Bits that account for the physical variable encoding
-                phys_var_encoding_bits = phys_variable.info.bit_len
+    @staticmethod
+    def get_physical_variable_bits(var_code):
+        """
+        Returns the total bit count for the physical variable: encoding bits and 16 bits for SECTION 3
+        """
+        phys_var_total_bits = PHYSICAL_VARIABLE_BITS.get(var_code)
+        if phys_var_total_bits is not None:
+            return phys_var_total_bits
 
-            # Total number of bits for the physical variable as sum of encoding-bits and 16 bits for SECTION 3
-            physical_variable_bits_dict[var_code] = 16 + phys_var_encoding_bits
+        if not PHYSICAL_VARIABLE_VARTABLES:
+            BeDballe.load_physical_variable_bits()
+            if var_code in PHYSICAL_VARIABLE_BITS:
+                return PHYSICAL_VARIABLE_BITS[var_code]
 
-        phys_var_total_bits = physical_variable_bits_dict[var_code]
+        # variable not listed in the table: look for it in the Vartables
+        phys_var_encoding_bits = 0
+        b_table_variable = None
+        for vartable_key in ("principal_vartable", "secondary_vartable"):
+            vartable = PHYSICAL_VARIABLE_VARTABLES.get(vartable_key)
+            if not isinstance(vartable, wreport.Vartable):
+                continue
+            try:
+                b_table_variable = vartable[var_code]
+                break
+            except KeyError:
+                pass
+        if b_table_variable:
+            phys_var_encoding_bits = b_table_variable.bit_len
+        else:
+            log.warning(
+                f"B code {var_code} variable's bit size cannot be obtained from either the primary or the "
+                f"secondary Vartable."
+            )
 
-        return phys_var_total_bits
+        with PHYSICAL_VARIABLE_BITS_LOCK:
+            return PHYSICAL_VARIABLE_BITS.setdefault(
+                var_code, 16 + phys_var_encoding_bits
+            )
 
     @staticmethod
     def get_non_standard_size_and_message_count(
         cur,
         effective_messages,
-        physical_variable_bits_dict,
         new_attr_covered_flags,
-        vartables,
         size_count,
         message_count,
     ):
@@ -1108,14 +1181,202 @@ def get_non_standard_size_and_message_count(
             )
 
         # Total number of bits for the physical variable
-        phys_var_total_bits = BeDballe.__get_physical_variable_bits(
-            vartables, physical_variable_bits_dict, cur["var"]
-        )
+        phys_var_total_bits = BeDballe.get_physical_variable_bits(cur["var"])
 
         size_count += (add_new_attr_bits + phys_var_total_bits) * effective_messages
 
         return size_count, message_count
 
+    @staticmethod
+    def __get_vectorized_messages_and_size_count(
+        cursors, query_important_params, get_physical_variable_bits
+    ):
+        """
+        Vectorized version of the per-cursor message and size count of get_summary.
+        The summary cursors are loaded once in arrays, then the effective messages, the reference cursors
+        and the bits are computed in bulk. Results are the same of the per-cursor methods:
+        - a cursor is the reference one if it has the maximum number of effective messages for its station and
+          filters values (the first one in case of ties)
+        - an attribute of a non-reference cursor is newly covered if its value is different from the reference one
+          and it is the first cursor of the station and filters values having that value
+        Returns the message count, the size count in bits and the effective datetime interval of the counted cursors.
+        """
+        selected_filters_keys = query_important_params["selected_filters_keys"]
+        rows = [
+            (
+                BeDballe.get_station_key(cur),
+                tuple(cur[key] for key in selected_filters_keys),
+                cur["var"],
+                tuple(cur[key] for key in BeDballe.LEVEL_AND_TRANGES_CUR_KEYS),
+                cur["datetimemin"],
+                cur["datetimemax"],
+                cur["count"],
+            )
+            for cur in cursors
+        ]
+        if not rows:
+            return 0, 0, None
+
+        (
+            stations,
+            filters_values,
+            var_codes,
+            attributes,
+            datetimemins,
+            datetimemaxs,
+            counts,
+        ) = zip(*rows)
+        count = np.array(counts, dtype=np.int64)
+        cur_min = np.array(datetimemins, dtype="datetime64[us]")
+        cur_max = np.array(datetimemaxs, dtype="datetime64[us]")
+        a = cur_min.astype(np.int64)
+        b = cur_max.astype(np.int64)
+        # durations in seconds, as timedelta.total_seconds()
+        original_duration = (b - a).astype(np.float64) / 1e6
+
+        # EFFECTIVE MESSAGES (see __populate_cursor_effective_datetime_dict)
+        query_original_dt = query_important_params["query_original_dt_interval"]
+        if not query_original_dt:
+            eff_a, eff_b = a, b
+            ratio = np.where(original_duration != 0, 1.0, -1.0)
+        else:
+            if "datetimemin" in query_original_dt:
+                q_min = np.datetime64(query_original_dt["datetimemin"], "us").astype(
+                    np.int64
+                )
+            if "datetimemax" in query_original_dt:
+                q_max = np.datetime64(query_original_dt["datetimemax"], "us").astype(
+                    np.int64
+                )
+            if (
+                "datetimemin" in query_original_dt
+                and "datetimemax" in query_original_dt
+            ):
+                qa = np.full_like(a, q_min)
+                qb = np.full_like(b, q_max)
+            elif "datetimemin" not in query_original_dt:
+                qa = np.where(a <= q_max, a, q_max)
+                qb = np.full_like(b, q_max)
+            else:
+                qa = np.full_like(a, q_min)
+                qb = np.where(b >= q_min, b, q_min)
+
+            outside = (qb < a) | (b < qa)
+            inside = (qa <= a) & (a <= b) & (b <= qb)
+            contains = (a <= qa) & (qa <= qb) & (qb <= b)
+            from_right = (qa <= a) & (a <= qb)
+            conditions = [outside, inside, contains, from_right]
+            eff_a = np.select(conditions, [a, a, qa, a], default=qa)
+            eff_b = np.select(conditions, [b, b, qb, qb], default=b)
+            effective_duration = (eff_b - eff_a).astype(np.float64) / 1e6
+            overlap_ratio = np.divide(
+                effective_duration,
+                original_duration,
+                out=np.zeros_like(effective_duration),
+                where=original_duration != 0,
+            )
+            ratio = np.select(
+                [outside, inside, effective_duration == 0],
+                [0.0, np.where(original_duration == 0, -1.0, 1.0), -1.0],
+                default=overlap_ratio,
+            )
+
+        # ratio = -1 -> the cursor interval is a point on the timeline: 1 message
+        effective_messages = np.where(ratio >= 0, np.floor(count * ratio), 1)
+        effective_messages = effective_messages.astype(np.int64)
+        counted = np.flatnonzero(effective_messages > 0)
+        if not counted.size:
+            return 0, 0, None
+        eff = effective_messages[counted]
+
+        # BITS
+        physical_bits = np.array(
+            [get_physical_variable_bits(var_codes[i]) for i in counted], dtype=np.int64
+        )
+        attrs = [attributes[i] for i in counted]
+        level_attr_indexes = [
+            BeDballe.LEVEL_AND_TRANGES_CUR_KEYS.index(key)
+            for key in BeDballe.LEVEL_ATTR_CUR_KEYS
+        ]
+        add_level_bits = np.array(
+            [sum(47 for j in level_attr_indexes if attr[j]) for attr in attrs],
+            dtype=np.int64,
+        )
+        standard_bits = (
+            BeDballe.STANDARD_FIXED_BITS
+            + BeDballe.STANDARD_SECTION_3_BITS
+            + BeDballe.STANDARD_ATTR_ENCODING_BITS
+            + add_level_bits
+            + physical_bits
+        )
+
+        effective_dt_interval = [
+            eff_a[counted].min().astype("datetime64[us]").item(),
+            eff_b[counted].max().astype("datetime64[us]").item(),
+        ]
+
+        if not query_important_params["need_different_size_count"]:
+            return (
+                int(eff.sum()),
+                int((standard_bits * eff).sum()),
+                effective_dt_interval,
+            )
+
+        # REFERENCE CURSORS for every station and filters values
+        group_codes: Dict[Any, int] = {}
+        group = np.array(
+            [
+                group_codes.setdefault(
+                    (stations[i], filters_values[i]), len(group_codes)
+                )
+                for i in counted
+            ],
+            dtype=np.int64,
+        )
+        position = np.arange(counted.size)
+        order = np.lexsort((position, -eff, group))
+        group_start = np.ones(order.size, dtype=bool)
+        group_start[1:] = group[order][1:] != group[order][:-1]
+        reference = np.empty(len(group_codes), dtype=np.int64)
+        reference[group[order][group_start]] = order[group_start]
+        ref_of_row = reference[group]
+
+        data_codes: Dict[Any, int] = {}
+        data = np.array(
+            [
+                data_codes.setdefault((var_codes[i], attributes[i]), len(data_codes))
+                for i in counted
+            ],
+            dtype=np.int64,
+        )
+        is_reference = data == data[ref_of_row]
+
+        # NEWLY COVERED ATTRIBUTES of the non-reference cursors
+        add_new_attr_bits = np.zeros(counted.size, dtype=np.int64)
+        for j, cur_key in enumerate(BeDballe.LEVEL_AND_TRANGES_CUR_KEYS):
+            value_codes: Dict[Any, int] = {}
+            value = np.array(
+                [value_codes.setdefault(attr[j], len(value_codes)) for attr in attrs],
+                dtype=np.int64,
+            )
+            not_null = np.array([attr[j] is not None for attr in attrs], dtype=bool)
+            _, first_index = np.unique(
+                group * len(value_codes) + value, return_index=True
+            )
+            first_occurrence = np.zeros(counted.size, dtype=bool)
+            first_occurrence[first_index] = True
+            newly_covered = first_occurrence & not_null & (value != value[ref_of_row])
+            add_new_attr_bits += np.where(
+                newly_covered, BeDballe.NEW_ATTR_BITS[cur_key], 0
+            )
+
+        bits = np.where(is_reference, standard_bits, add_new_attr_bits + physical_bits)
+        return (
+            int(eff[is_reference].sum()),
+            int((bits * eff).sum()),
+            effective_dt_interval,
+        )
+
     @staticmethod
     def __adjust_summary_time_interval_boundaries(
         cur_effective_dt_interval, min_date, max_date
@@ -1590,13 +1851,21 @@ def get_fields(
 
     @staticmethod
     def data_qc(attrs):
-        attrs_dict = {v.code: v.get() for v in attrs}
         # Data already checked and checked as invalid by QC filter
-        for key, val in attrs_dict.items():
-            if key in BeDballe.QC_CODES and val < 50:
-                # data is considered unreliable if its confidence is less than 50%
-                return 0
-        return 1
+        return MessageFilter.data_qc(attrs)
+
+    @staticmethod
+    def get_archive_executor():
+        # the threads are kept alive, so that they reuse their arkimet readers
+        global MAPS_ARCHIVE_EXECUTOR
+        if MAPS_ARCHIVE_EXECUTOR is None:
+            with MAPS_ARCHIVE_EXECUTOR_LOCK:
+                if MAPS_ARCHIVE_EXECUTOR is None:
+                    MAPS_ARCHIVE_EXECUTOR = ThreadPoolExecutor(
+                        max_workers=BeDballe.MAPS_ARCHIVE_WORKERS,
+                        thread_name_prefix="maps-archive",
+                    )
+        return MAPS_ARCHIVE_EXECUTOR
 
     @staticmethod
     def get_maps_response_for_mixed(
@@ -1607,15 +1876,13 @@ def get_maps_response_for_mixed(
         dsn_subset=[],
         previous_res=None,
     ):
-        # get data from the dballe database
-        log.debug("mixed dbs: get data from dballe")
         query_for_dballe = {}
         if query_station_data:
             query_for_dballe = {**query_station_data}
         elif query_data:
             query_for_dballe = {**query_data}
 
-        refmin_arki = None
+        query_for_arki = None
 
         datetime_max = None
         datetime_min = None
@@ -1633,6 +1900,17 @@ def get_maps_response_for_mixed(
             ) = BeDballe.split_reftimes(datetime_min, datetime_max)
             # set up query for dballe with the correct reftimes
             query_for_dballe["datetimemin"] = refmin_dballe
+
+            # set up query for arkimet with the correct reftimes
+            if query_station_data:
+                query_for_arki = {**query_station_data}
+            elif query_data:
+                query_for_arki = {**query_data}
+            else:
+                query_for_arki = {}
+            if refmin_arki:
+                query_for_arki["datetimemin"] = refmin_arki
+                query_for_arki["datetimemax"] = refmax_arki
         else:
             # if there is no reftime i'll get the data of the last hour
             # TODO last hour or last day as default?
@@ -1648,70 +1926,55 @@ def get_maps_response_for_mixed(
                 instant_now, time(instant_now.hour, 0, 0)
             )
 
-        if query_station_data:
-            dballe_maps_data = BeDballe.get_maps_response(
-                query_station_data=query_for_dballe,
-                only_stations=only_stations,
-                interval=interval,
-                db_type="dballe",
-                dsn_subset=dsn_subset,
-                previous_res=previous_res,
+        def get_leg(db_type, leg_query):
+            log.debug("mixed dbs: get data from {}", db_type)
+            start = perf_counter()
+            if query_station_data:
+                res = BeDballe.get_maps_response(
+                    query_station_data=leg_query,
+                    only_stations=only_stations,
+                    interval=interval,
+                    db_type=db_type,
+                    dsn_subset=dsn_subset,
+                )
+            else:
+                res = BeDballe.get_maps_response(
+                    query_data=leg_query,
+                    only_stations=only_stations,
+                    interval=interval,
+                    db_type=db_type,
+                    dsn_subset=dsn_subset,
+                )
+            log.info(
+                "mixed dbs: {} data retrieved in {:.3f}s",
+                db_type,
+                perf_counter() - start,
             )
+            return res
+
+        arki_maps_data = None
+        if query_for_arki is None:
+            dballe_maps_data = get_leg("dballe", query_for_dballe)
         else:
-            dballe_maps_data = BeDballe.get_maps_response(
-                query_data=query_for_dballe,
-                only_stations=only_stations,
-                interval=interval,
-                db_type="dballe",
-                dsn_subset=dsn_subset,
-                previous_res=previous_res,
+            # the archive is usually the slowest source: it is queried in background
+            # while the data of the last days are retrieved from dballe
+            arki_future = BeDballe.get_archive_executor().submit(
+                with_current_context(get_leg), "arkimet", query_for_arki
             )
-
-        if query_for_dballe:
-            # if there is not reftime, only the data of the last hour will be extracted
-            if not datetime_min and not datetime_max:
-                return dballe_maps_data
-            else:
-                # get data from the arkimet database
-                log.debug("mixed dbs: get data from arkimet")
-                query_for_arki = {}
-                if query_station_data:
-                    query_for_arki = {**query_station_data}
-                elif query_data:
-                    query_for_arki = {**query_data}
-
-                # set up query for arkimet with the correct reftimes
-                if refmin_arki:
-                    query_for_arki["datetimemin"] = refmin_arki
-                    query_for_arki["datetimemax"] = refmax_arki
-
-                if query_station_data:
-                    arki_maps_data = BeDballe.get_maps_response(
-                        query_station_data=query_for_arki,
-                        only_stations=only_stations,
-                        interval=interval,
-                        db_type="arkimet",
-                        previous_res=dballe_maps_data,
-                        dsn_subset=dsn_subset,
-                    )
-                else:
-                    arki_maps_data = BeDballe.get_maps_response(
-                        query_data=query_for_arki,
-                        only_stations=only_stations,
-                        interval=interval,
-                        db_type="arkimet",
-                        previous_res=dballe_maps_data,
-                        dsn_subset=dsn_subset,
-                    )
-
-                if not dballe_maps_data and not arki_maps_data:
-                    response: List[object] = []
-                    return response
-
-                if arki_maps_data:
-                    return arki_maps_data
-
-        return dballe_maps_data
+            try:
+                dballe_maps_data = get_leg("dballe", query_for_dballe)
+            finally:
+                # wait for the archive also on errors, not to leave it running
+                arki_maps_data = arki_future.result()
+
+        # most recent data first, as if they were extracted in sequence
+        response = MapsResponseBuilder()
+        for res in (previous_res, dballe_maps_data, arki_maps_data):
+            if res:
+                response.merge(res)
+        if not response:
+            return []
+        return response
 
     @staticmethod
     def get_maps_response(
@@ -1750,7 +2013,7 @@ def get_maps_response(
             # integrate the already existent response
             response = previous_res
         else:
-            response = {}
+            response = MapsResponseBuilder()
         # choose the right query for the right situation
         # (station details response or default one)
         query = {}
@@ -1829,14 +2092,16 @@ def get_maps_response(
 
             log.debug("datasets: {}", datasets)
         mobile_db = None
+        dballe_url = f"{engine}://{user}:{pw}@{host}:{port}/{dballe_dsn}"
         if db_type == "arkimet":
-            db = BeDballe.fill_db_from_arkimet(datasets, query_for_arkimet)
-        else:
-            # connect to the correct dballe dsn
+            db = BeDballe.get_archive_db(
+                datasets, query_for_arkimet, datemin=datemin, datemax=datemax
+            )
+        elif download:
+            # the connection is used by the streamed response,
+            # so it is not taken from the pool
             try:
-                db = dballe.DB.connect(
-                    f"{engine}://{user}:{pw}@{host}:{port}/{dballe_dsn}"
-                )
+                db = dballe.DB.connect(dballe_url)
             except OSError:
                 raise Exception("Unable to connect to dballe database")
             # connect to the eventual dsn for mobile station
@@ -1855,46 +2120,62 @@ def get_maps_response(
         if download:
             return db, query_data, query_station_data, mobile_db
 
-        log.debug("start retrieving data: query data for maps {}", query)
-        if db_type == "arkimet" or not dsn_subset:
-            # extract all data in db
-            response = BeDballe.extract_data_for_maps(
-                db, query, query_station_data, response, only_stations
-            )
-            if mobile_db:
-                # add the data extracted from the corresponding dsn for mobile stations
-                response = BeDballe.extract_data_for_maps(
-                    mobile_db, query, query_station_data, response, only_stations
-                )
+        if db_type == "arkimet":
+            db_context = nullcontext(db)
+            pool_dsn = None
         else:
-            log.debug("extraction from a dsn subset case")
-            # get all networks of the requested datasets
-            nets = []
-            for ds in dsn_subset:
-                for el in arki_service.get_observed_dataset_params(ds):
-                    nets.append(el)
-            for n in nets:
-                # extract querying network by network
-                query["rep_memo"] = n
+            # connect to the correct dballe dsn
+            db_context = DballePools.connection(dballe_url, dballe_dsn)
+            pool_dsn = dballe_dsn
+
+        log.debug("start retrieving data: query data for maps {}", query)
+        with db_context as db:
+            if db_type == "arkimet" or not dsn_subset:
+                # extract all data in db
                 response = BeDballe.extract_data_for_maps(
-                    db, query, query_station_data, response, only_stations
+                    db, query, query_station_data, response, only_stations, dsn=pool_dsn
                 )
                 if mobile_db:
-                    # add data extracted from the corresponding dsn for mobile stations
+                    # add the data extracted from the corresponding dsn for mobile stations
                     response = BeDballe.extract_data_for_maps(
                         mobile_db, query, query_station_data, response, only_stations
                     )
+            else:
+                log.debug("extraction from a dsn subset case")
+                # get all networks of the requested datasets
+                nets = []
+                for ds in dsn_subset:
+                    for el in arki_service.get_observed_dataset_params(ds):
+                        nets.append(el)
+                for n in nets:
+                    # extract querying network by network
+                    query["rep_memo"] = n
+                    response = BeDballe.extract_data_for_maps(
+                        db,
+                        query,
+                        query_station_data,
+                        response,
+                        only_stations,
+                        dsn=pool_dsn,
+                    )
+                    if mobile_db:
+                        # add data extracted from the corresponding dsn for mobile stations
+                        response = BeDballe.extract_data_for_maps(
+                            mobile_db,
+                            query,
+                            query_station_data,
+                            response,
+                            only_stations,
+                        )
 
         return response
 
     @staticmethod
-    def extract_data_for_maps(db, query, query_station_data, response, only_stations):
+    def extract_data_for_maps(
+        db, query, query_station_data, response, only_stations, dsn=None
+    ):
         with db.transaction() as tr:
-            # check if query gives back a result
-            count_data = tr.query_data(query).remaining
-            # log.debug('count {}',count_data)
-            if count_data == 0:
-                return response
+            # the query is run only once: an empty result leaves the response unchanged
             # check if an extended response is requested:
             extend_res = False
             if query:
@@ -1902,6 +2183,10 @@ def extract_data_for_maps(db, query, query_station_data, response, only_stations
                     extend_res = True
 
             station_tuple: Tuple[Any, ...] = ()
+            # details of all the stations, read once when the first station is found
+            stations_details = None
+            # requested run of the multimodel data, as epoch seconds
+            actual_reftime = None
             for rec in tr.query_data(query):
                 # discard data from excluded networks
                 if rec["rep_memo"] in BeDballe.MAPS_NETWORK_FILTER:
@@ -1910,178 +2195,109 @@ def extract_data_for_maps(db, query, query_station_data, response, only_stations
                     else:
                         if rec["rep_memo"] not in query["rep_memo"]:
                             continue
-                query_for_details = {}
-                if rec["ident"]:
-                    station_tuple = (rec["ident"], rec["rep_memo"])
-                    query_for_details["ident"] = rec["ident"]
-                else:
-                    station_tuple = (
-                        float(rec["lat"]),
-                        float(rec["lon"]),
-                        rec["rep_memo"],
-                    )
-                    query_for_details["lat"] = float(rec["lat"])
-                    query_for_details["lon"] = float(rec["lon"])
-                query_for_details["rep_memo"] = rec["rep_memo"]
-
-                if station_tuple not in response.keys():
-                    response[station_tuple] = {}
-                    details = []
-                    if not query_station_data:
-                        # append the variable of station name to the query for details
-                        query_for_details["var"] = "B01019"
+                station_tuple = StationDetailsCache.get_station_key(rec)
+
+                station_id = response.stations.get(station_tuple)
+                if station_id is None:
+                    if stations_details is None:
+                        # only the station name is needed, unless a single station is requested
+                        stations_details = StationDetailsCache.get_details(
+                            tr, query, all_details=bool(query_station_data), dsn=dsn
+                        )
                     # add station details
-                    for el in tr.query_station_data(query_for_details):
-                        detail_el = {}
-                        var = el["variable"]
-                        code = var.code
-                        detail_el["var"] = code
-                        detail_el["val"] = var.get()
-                        details.append(detail_el)
-
-                    response[station_tuple]["details"] = details
+                    station_id = response.add_station(
+                        station_tuple, list(stations_details.get(station_tuple, []))
+                    )
 
                 # get data values
                 if not only_stations:
-                    if (
-                        not query_station_data
-                        and not extend_res
-                        and not rec["var"] in response[station_tuple].keys()
-                    ):
-                        response[station_tuple][rec["var"]] = []
-                    product_val = {}
-                    product_val["val"] = rec[rec["var"]].get()
-                    reftime = datetime(
-                        rec["year"],
-                        rec["month"],
-                        rec["day"],
-                        rec["hour"],
-                        rec["min"],
-                        rec["sec"],
+                    # reference time as epoch seconds
+                    reftime = calendar.timegm(
+                        (
+                            rec["year"],
+                            rec["month"],
+                            rec["day"],
+                            rec["hour"],
+                            rec["min"],
+                            rec["sec"],
+                        )
                     )
                     if "rep_memo" in query and query["rep_memo"] == "multim-forecast":
                         if "datetimemin" in query:
                             # multimodel case
                             # check if the data is from the requested run
-                            actual_reftime = query["datetimemin"]
+                            if actual_reftime is None:
+                                actual_reftime = calendar.timegm(
+                                    query["datetimemin"].timetuple()
+                                )
                             trange = rec["trange"]
-                            validity_interval = timedelta(seconds=trange.p1)
-                            if not actual_reftime == reftime - validity_interval:
+                            if not actual_reftime == reftime - trange.p1:
                                 # this data is not from the requested run
                                 continue
-                            else:
-                                product_val["ref"] = reftime.isoformat()
-                    else:
-                        product_val["ref"] = reftime.isoformat()
+                        else:
+                            reftime = NO_TIME
 
+                    is_reliable = NO_FLAG
                     if query:
                         if "query" in query:
                             # add reliable flag
                             variable = rec["variable"]
                             attrs = variable.get_attrs()
                             is_reliable = BeDballe.data_qc(attrs)
-                            product_val["rel"] = is_reliable
-                    if (
-                        "rel" not in product_val.keys()
-                        and rec["rep_memo"] != "multim-forecast"
-                    ):
+                    if is_reliable == NO_FLAG and rec["rep_memo"] != "multim-forecast":
                         # QC filter is not active: use the default value (1)
                         # this param is not useful for multimodel use case
-                        product_val["rel"] = 1
+                        is_reliable = 1
 
                     if query_station_data or extend_res:
                         level = BeDballe.from_level_object_to_string(rec["level"])
                         timerange = BeDballe.from_trange_object_to_string(rec["trange"])
-                        product_tuple = (rec["var"], level, timerange)
-                        if product_tuple not in response[station_tuple].keys():
-                            response[station_tuple][product_tuple] = []
-                        response[station_tuple][product_tuple].append(product_val)
+                        product = (rec["var"], level, timerange)
                     else:
-                        # append the value
-                        response[station_tuple][rec["var"]].append(product_val)
+                        product = rec["var"]
+                    response.add_value(
+                        station_id,
+                        product,
+                        rec[rec["var"]].get(),
+                        time=reftime,
+                        reliability=is_reliable,
+                    )
         return response
 
+    @staticmethod
+    def get_maps_descriptions(raw_res):
+        descriptions_dic = {}
+        product_varcodes, station_varcodes, levels, timeranges = raw_res.get_varcodes()
+        for el in product_varcodes:
+            descr_el = {}
+            var_info = dballe.varinfo(el)
+            descr_el["descr"] = var_info.desc
+            descr_el["unit"] = var_info.unit
+            descriptions_dic[el] = descr_el
+        for el in station_varcodes:
+            descr_el = {}
+            var_info = dballe.varinfo(el)
+            descr_el["descr"] = var_info.desc
+            descriptions_dic[el] = descr_el
+        for el in levels:
+            descr_el = {}
+            descr_el["descr"] = BeDballe.get_description(el, "level")
+            descriptions_dic[el] = descr_el
+        for el in timeranges:
+            descr_el = {}
+            descr_el["descr"] = BeDballe.get_description(el, "timerange")
+            descriptions_dic[el] = descr_el
+        return descriptions_dic
+
     @staticmethod
     def parse_obs_maps_response(raw_res, only_last_data=False):
         log.debug("start parsing response for maps")
-        response: Dict[str, Any] = {}
-        response_data = []
-        descriptions_dic = {}
-        if raw_res:
-            product_varcodes = []
-            station_varcodes = []
-            levels = []
-            timeranges = []
-            for key, value in raw_res.items():
-                res_el: Dict[str, Any] = {}
-                station_el = {}
-                products_list = []
-                if len(key) == 2:
-                    station_el["ident"] = key[0]
-                    station_el["net"] = key[1]
-                else:
-                    station_el["lat"] = key[0]
-                    station_el["lon"] = key[1]
-                    station_el["net"] = key[2]
-                for prod_key, prod_value in value.items():
-                    if prod_key != "details":
-                        product_el = {}
-                        if type(prod_key) != tuple:
-                            product_el["var"] = prod_key
-                            if only_last_data:
-                                sorted_values = sorted(
-                                    prod_value, key=lambda d: d["ref"], reverse=True
-                                )
-                                # log.debug(product_el["val"])
-                                product_el["val"] = [sorted_values[0]]
-                            else:
-                                product_el["val"] = prod_value
-                            if prod_key not in product_varcodes:
-                                product_varcodes.append(prod_key)
-                        else:
-                            product_el["var"] = prod_key[0]
-                            product_el["lev"] = prod_key[1]
-                            product_el["trange"] = prod_key[2]
-                            product_el["val"] = prod_value
-                            if product_el["var"] not in product_varcodes:
-                                product_varcodes.append(product_el["var"])
-                            if product_el["lev"] not in levels:
-                                levels.append(product_el["lev"])
-                            if product_el["trange"] not in timeranges:
-                                timeranges.append(product_el["trange"])
-                        products_list.append(product_el)
-                    else:
-                        station_el["details"] = prod_value
-                        for i in prod_value:
-                            if i["var"] not in station_varcodes:
-                                station_varcodes.append(i["var"])
-                res_el["stat"] = station_el
-                res_el["prod"] = products_list
-                response_data.append(res_el)
-
-            for el in product_varcodes:
-                descr_el = {}
-                var_info = dballe.varinfo(el)
-                descr_el["descr"] = var_info.desc
-                descr_el["unit"] = var_info.unit
-                descriptions_dic[el] = descr_el
-            for el in station_varcodes:
-                descr_el = {}
-                var_info = dballe.varinfo(el)
-                descr_el["descr"] = var_info.desc
-                descriptions_dic[el] = descr_el
-            for el in levels:
-                descr_el = {}
-                descr_el["descr"] = BeDballe.get_description(el, "level")
-                descriptions_dic[el] = descr_el
-            for el in timeranges:
-                descr_el = {}
-                descr_el["descr"] = BeDballe.get_description(el, "timerange")
-                descriptions_dic[el] = descr_el
-        response["descr"] = descriptions_dic
-        response["data"] = response_data
+        if not raw_res:
+            raw_res = MapsResponseBuilder()
+        descriptions_dic = BeDballe.get_maps_descriptions(raw_res)
 
-        return response
+        # the response is serialized directly from the collected data
+        return raw_res.to_json(descriptions_dic, only_last_data)
 
     @staticmethod
     def extend_reftime_for_multimodel(query, db_type, interval=None):
@@ -2096,11 +2312,7 @@ def extend_reftime_for_multimodel(query, db_type, interval=None):
             new_datetimemax = last_reftime + timedelta(hours=interval)
         else:
             # get multimodel max interval
-            explorer = BeDballe.build_explorer(
-                db_type, network_list=["multim-forecast"]
-            )
-            explorer.set_filter({"rep_memo": "multim-forecast"})
-            tranges = explorer.tranges
+            tranges = BeDballe.get_multimodel_tranges(db_type)
             max_interval: float = 0
             for t in tranges:
                 trange_interval = t.p1
@@ -2112,6 +2324,14 @@ def extend_reftime_for_multimodel(query, db_type, interval=None):
             new_datetimemax = last_reftime + timedelta(seconds=max_interval)
         return new_datetimemax
 
+    @staticmethod
+    def get_multimodel_tranges(db_type):
+        with BeDballe.build_explorer(
+            db_type, network_list=["multim-forecast"]
+        ) as explorer:
+            explorer.set_filter({"rep_memo": "multim-forecast"})
+            return explorer.tranges
+
     @staticmethod
     def import_data_in_temp_db(db, temp_db, query):
         with db.transaction() as tr:
@@ -2130,6 +2350,14 @@ def merge_db_for_download(
     ):
         # merge the dbs
         query_data = BeDballe.parse_query_for_maps(dballe_query_data)
+        if isinstance(arki_db, ArchiveDB):
+            # the cached archived days are shared and read-only:
+            # the data are merged in a temporary db
+            temp_db = dballe.DB.connect("mem:")
+            BeDballe.import_data_in_temp_db(
+                arki_db, temp_db, BeDballe.parse_query_for_maps(arki_query_data or {})
+            )
+            arki_db = temp_db
         if arki_db:
             log.debug("Filling temp db with data from dballe. query: {}", query_data)
             if not dsn_subset:
@@ -2197,7 +2425,7 @@ def download_data_from_map(
                         else:
                             msg = row.message
                         if msg:
-                            yield exporter.to_binary(row.message)
+                            yield exporter.to_binary(msg)
             else:
                 for row in tr.query_messages(download_query):
                     if qc_filter:
@@ -2205,7 +2433,7 @@ def download_data_from_map(
                     else:
                         msg = row.message
                     if msg:
-                        yield exporter.to_binary(row.message)
+                        yield exporter.to_binary(msg)
         if mobile_db:
             with mobile_db.transaction() as tr:
                 exporter = dballe.Exporter(output_format)
@@ -2221,7 +2449,7 @@ def download_data_from_map(
                             else:
                                 msg = row.message
                             if msg:
-                                yield exporter.to_binary(row.message)
+                                yield exporter.to_binary(msg)
                 else:
                     for row in tr.query_messages(download_query):
                         if qc_filter:
@@ -2231,7 +2459,7 @@ def download_data_from_map(
                         else:
                             msg = row.message
                         if msg:
-                            yield exporter.to_binary(row.message)
+                            yield exporter.to_binary(msg)
 
     @staticmethod
     def from_query_to_dic(q):
@@ -2400,6 +2628,7 @@ def parse_query_for_maps(query):
             "lon",
             "ident",
             "rep_memo",
+            "varlist",
         ]
         for key, value in query.items():
             if key in to_parse:
@@ -2545,18 +2774,23 @@ def from_datetime_to_list(dt):
             list.append(int(s))
         return list
 
+    @staticmethod
+    def get_archive_db(datasets, query, datemin=None, datemax=None):
+        # the archived days already decoded are read from the cache
+        db = ArchiveDaysCache.get_db(datasets, datemin, datemax)
+        if db is None:
+            db = BeDballe.fill_db_from_arkimet(datasets, query)
+        return db
+
     @staticmethod
     def fill_db_from_arkimet(datasets, query):
         log.debug("filling dballe with data from arkimet")
         db = dballe.DB.connect("mem:")
-        cfg = arki.cfg.Sections.parse(arki_service.arkimet_conf)
         importer = dballe.Importer("BUFR")
-        with tempfile.SpooledTemporaryFile(mode="a+b", max_size=10000000) as tmpf:
+        # arkimet streams the data to a temporary file, then the messages are imported one by one
+        with tempfile.TemporaryFile(mode="a+b") as tmpf:
             for d in datasets:
-                dt_part = cfg.section(d)
-                source = arki.dataset.Session().dataset_reader(cfg=dt_part)
-                bin_data = source.query_bytes(query, with_data=True)
-                tmpf.write(bin_data)
+                arki_service.extract_dataset(d, query, tmpf)
             tmpf.seek(0)
             with dballe.File(tmpf, "BUFR") as f:
                 for binmsg in f:
@@ -2637,73 +2871,50 @@ def extract_data_for_mixed(
             # set up query for dballe with the correct reftimes
             dballe_queries[fields.index("datetimemin")][0] = refmin_dballe
 
-        dballe_outfile = Path(f"{outfile}_dballe_part.tmp")
-
-        # extract
-        BeDballe.extract_data(
-            datasets,
-            fields,
-            dballe_queries,
-            dballe_outfile,
-            db_type="dballe",
-            queried_reftime=queried_reftime,
-            additional_runs=additional_runs,
-            mixed_extraction=True,
-        )
-
         # extract data from the arkimet database
-        log.debug("mixed dbs: extract data from arkimet")
         arki_queries = []
         for q in queries:
-            arki_queries.append(q)
+            # the reftimes of the dballe queries are not changed
+            arki_queries.append(list(q))
         if "datetimemin" in fields:
             # set up query for arkimet with the correct reftimes
             arki_queries[fields.index("datetimemin")][0] = refmin_arki
             arki_queries[fields.index("datetimemax")][0] = refmax_arki
-
-        arki_outfile = Path(f"{outfile}_arki_part.tmp")
-
-        # extract
         queried_reftime_for_arki = None
         if queried_reftime:
             # use il reftime arki as queried reftime
             queried_reftime_for_arki = refmax_arki
-        BeDballe.extract_data(
-            datasets,
-            fields,
-            arki_queries,
-            arki_outfile,
-            db_type="arkimet",
-            queried_reftime=queried_reftime_for_arki,
-            mixed_extraction=True,
-        )
 
-        cat_cmd = ["cat"]
-        if dballe_outfile.exists():
-            cat_cmd.append(str(dballe_outfile))
-        if arki_outfile.exists():
-            cat_cmd.append(str(arki_outfile))
-
-        # check if the extractions were done
-        if len(cat_cmd) == 1:
-            # any extraction file exists
-            raise EmptyOutputFile(
-                "Failure in data extraction: the query does not give any result"
+        # both the extractions are streamed to the same output, dballe data first.
+        # The output file is created when the first message is found
+        with ExtractionOutput(outfile) as output:
+            BeDballe.extract_data(
+                datasets,
+                fields,
+                dballe_queries,
+                output,
+                db_type="dballe",
+                queried_reftime=queried_reftime,
+                additional_runs=additional_runs,
+                mixed_extraction=True,
             )
 
-        # join the dballe extraction with the arki one
-        with open(outfile, mode="w") as output:
-            ext_proc = subprocess.Popen(cat_cmd, stdout=output)
-            ext_proc.wait()
-            if ext_proc.wait() != 0:
-                raise JoinObservedExtraction(
-                    "Failure in data extraction: error in creating the output file for mixed archives"
-                )
+            log.debug("mixed dbs: extract data from arkimet")
+            BeDballe.extract_data(
+                datasets,
+                fields,
+                arki_queries,
+                output,
+                db_type="arkimet",
+                queried_reftime=queried_reftime_for_arki,
+                mixed_extraction=True,
+            )
 
-        # delete the partial extractions
-        for f in cat_cmd:
-            if Path(f).is_file():
-                Path(f).unlink()
+            # check if the extractions were done
+            if not output:
+                raise EmptyOutputFile(
+                    "Failure in data extraction: the query does not give any result"
+                )
 
     @staticmethod
     def extract_data(
@@ -2735,21 +2946,15 @@ def extract_data(
             datemin = None
             datemax = None
             if "datetimemin" in fields:
-                datemin = queries[fields.index("datetimemin")][0].strftime(
-                    "%Y-%m-%d %H:%M"
-                )
-                datemax = queries[fields.index("datetimemax")][0].strftime(
-                    "%Y-%m-%d %H:%M"
-                )
+                datemin = queries[fields.index("datetimemin")][0]
+                datemax = queries[fields.index("datetimemax")][0]
 
-            # get all the possible combinations of queries
-            all_queries = list(itertools.product(*queries))
             arkimet_query = BeDballe.build_arkimet_query(
-                datemin=datemin,
-                datemax=datemax,
+                datemin=datemin.strftime("%Y-%m-%d %H:%M") if datemin else None,
+                datemax=datemax.strftime("%Y-%m-%d %H:%M") if datemax else None,
                 network=network,
-                all_dballe_queries=all_queries,
                 fields=fields,
+                queries=queries,
                 license_group=license_group,
             )
             if not arkimet_query:
@@ -2762,18 +2967,20 @@ def extract_data(
                     )
 
             # log.debug(f" arkimet query: {arkimet_query}")
-            DB = BeDballe.fill_db_from_arkimet(datasets, arkimet_query)
+            db_context = nullcontext(
+                BeDballe.get_archive_db(
+                    datasets, arkimet_query, datemin=datemin, datemax=datemax
+                )
+            )
 
         else:
             # get the dsn
             dballe_dsn = license_group.dballe_dsn
-            try:
-                DB = dballe.DB.connect(
-                    f"{engine}://{user}:{pw}@{host}:{port}/{dballe_dsn}"
-                )
-            except OSError:
-                raise OSError("Unable to connect to dballe database")
-        requested_runs = []
+            db_context = DballePools.connection(
+                f"{engine}://{user}:{pw}@{host}:{port}/{dballe_dsn}", dballe_dsn
+            )
+        # runs of the multimodel forecasts, checked by membership for every data
+        requested_runs: Set[datetime] = set()
         if queried_reftime:
             # multimodel case. get a list of all runs
             total_runs = queried_reftime - queries[fields.index("datetimemin")][0]
@@ -2785,11 +2992,11 @@ def extract_data(
                 multim_run = queries[fields.index("datetimemin")][0] + timedelta(days=i)
                 if not queries[fields.index("datetimemin")][0] == multim_run:
                     # be sure that all runs are 00:00
-                    requested_runs.append(
+                    requested_runs.add(
                         multim_run.replace(hour=0, minute=0, second=0, microsecond=0)
                     )
                 else:
-                    requested_runs.append(multim_run)
+                    requested_runs.add(multim_run)
             # mixed db case: add the requested runs that are supposed to be in arkimet
             if additional_runs:
                 for i in range(additional_runs + 1):
@@ -2798,139 +3005,74 @@ def extract_data(
                     )
                     if not queries[fields.index("datetimemin")][0] == multim_run:
                         # be sure that all runs are 00:00
-                        requested_runs.append(
+                        requested_runs.add(
                             multim_run.replace(
                                 hour=0, minute=0, second=0, microsecond=0
                             )
                         )
-            log.debug("requested runs: {}", requested_runs)
-        # get all the possible combinations of queries
-        all_queries = list(itertools.product(*queries))
-        counter = 1
-        cat_cmd = ["cat"]
-        for q in all_queries:
-            dballe_query = {}
-            for k, v in zip(fields, q):
-                dballe_query[k] = v
-
-            # set the filename for the partial extraction
-            part_outfile = f"{outfile}_part{counter}.tmp"
-
-            with DB.transaction() as tr:
-                # check if the query gives a result
-                count = tr.query_data(dballe_query).remaining
-                # log.debug(
-                #     "counter = {} dballe query: {} count: {}",
-                #     counter, dballe_query, count
-                # )
-                if count == 0:
-                    continue
-                log.debug("Extract data from dballe. query: {}", dballe_query)
-                exporter = dballe.Exporter("BUFR")
-                with open(part_outfile, "wb") as out:
+            log.debug("requested runs: {}", sorted(requested_runs))
+            # only the validity times of the requested runs are queried
+            if "trange" in fields:
+                tranges = queries[fields.index("trange")]
+            else:
+                tranges = BeDballe.get_multimodel_tranges(db_type)
+            all_queries = QueryPlanner.get_run_queries(
+                fields, queries, requested_runs, tranges
+            )
+        else:
+            # the lists of values DB-All.e can not match are queried one by one
+            all_queries = QueryPlanner.get_queries(fields, queries)
+        if isinstance(outfile, ExtractionOutput):
+            # the extraction is appended to an output shared with other extractions
+            output_context = nullcontext(outfile)
+        else:
+            output_context = ExtractionOutput(outfile)
+        runs_filter = None
+        if queried_reftime:
+            # multimodel case: the data of other runs with the same validity time
+            # and timerange, if any, are discarded
+            runs_filter = MessageFilter(runs=requested_runs)
+        with output_context as output, db_context as DB:
+            exporter = dballe.Exporter("BUFR")
+            for dballe_query in all_queries:
+                with DB.transaction() as tr:
+                    # the messages of every query are written straight to the output,
+                    # in order of query: the output file is created with the first one
+                    found = False
                     for row in tr.query_messages(dballe_query):
-                        if queried_reftime:
-                            msg = BeDballe.filter_messages(
-                                row.message, list_of_runs=requested_runs
+                        if not found:
+                            log.debug(
+                                "Extract data from dballe. query: {}", dballe_query
                             )
+                            output.open()
+                            found = True
+                        if runs_filter:
+                            msg = runs_filter.filter(row.message)
                         else:
                             msg = row.message
                         if msg:
-                            out.write(exporter.to_binary(msg))
+                            output.write(exporter.to_binary(msg))
 
-            cat_cmd.append(part_outfile)
-            # update counter
-            counter += 1
+            if db_type == "arkimet" and not isinstance(DB, ArchiveDB):
+                # clear the temporary db
+                DB.remove_all()
 
-        if db_type == "arkimet":
-            # clear the temporary db
-            DB.remove_all()
-
-        if counter == 1:
-            # any query has given a result
-            if mixed_extraction:
-                return
-            else:
+            if not output and not mixed_extraction:
+                # any query has given a result
                 raise EmptyOutputFile(
                     "Failure in data extraction: the query does not give any result"
                 )
 
-        # join all the partial extractions
-        with open(outfile, mode="w") as output:
-            ext_proc = subprocess.Popen(cat_cmd, stdout=output)
-            ext_proc.wait()
-            if ext_proc.wait() != 0:
-                raise JoinObservedExtraction(
-                    "Failure in data extraction: error in creating the output file"
-                )
-        # delete the partial extractions
-        for f in cat_cmd:
-            if Path(f).is_file():
-                Path(f).unlink()
-
     @staticmethod
     def filter_messages(msg, list_of_runs=None, quality_check=False):
-        count_msgs = 0
-        new_msg = dballe.Message("generic")
-
-        new_msg.set_named("year", msg.get_named("year"))
-        new_msg.set_named("month", msg.get_named("month"))
-        new_msg.set_named("day", msg.get_named("day"))
-        new_msg.set_named("hour", msg.get_named("hour"))
-        new_msg.set_named("minute", msg.get_named("minute"))
-        new_msg.set_named("second", msg.get_named("second"))
-        new_msg.set_named("rep_memo", msg.report)
-        new_msg.set_named("longitude", int(msg.coords[0] * 10**5))
-        new_msg.set_named("latitude", int(msg.coords[1] * 10**5))
-        if msg.ident:
-            new_msg.set_named("ident", msg.ident)
-
-        for data in msg.query_data({"query": "attrs"}):
-            variable = data["variable"]
-            attrs = variable.get_attrs()
-            v = dballe.var(data["variable"].code, data["variable"].get())
-            to_be_discarded = False
-            # 1.Multimodel filter
-            if list_of_runs:
-                for a in attrs:
-                    v.seta(a)
-
-                # get the validity interval from the data timerange
-                validity_interval = timedelta(seconds=data["trange"].p1)
-                # get the message date
-                validity_time = datetime(
-                    msg.get_named("year").get(),
-                    msg.get_named("month").get(),
-                    msg.get_named("day").get(),
-                    msg.get_named("hour").get(),
-                    msg.get_named("minute").get(),
-                )
-                # compare the resulting reftime with the list of run
-                if not validity_time - validity_interval in list_of_runs:
-                    to_be_discarded = True
-            # 2. Quality control filter
-            if quality_check:
-                is_ok = BeDballe.data_qc(attrs)
-                if not is_ok:
-                    to_be_discarded = True
-            if not to_be_discarded:
-                # if matches proceed saving the message
-                new_msg.set(data["level"], data["trange"], v)
-                count_msgs += 1
-            else:
-                continue
+        # the message is returned as it is if no data are discarded. As before, the
+        # attributes of the data are kept only by the multimodel filter
+        return MessageFilter(
+            runs=list_of_runs,
+            quality_check=quality_check,
+            data_attrs=bool(list_of_runs),
+        ).filter(msg)
 
-        for data in msg.query_station_data({"query": "attrs"}):
-            variable = data["variable"]
-            attrs = variable.get_attrs()
-            v = dballe.var(data["variable"].code, data["variable"].get())
-            for a in attrs:
-                v.seta(a)
-
-            new_msg.set(dballe.Level(), dballe.Trange(), v)
-        if count_msgs > 0:
-            # there are matching messages:
-            # return the filtered message in order to be exported
-            return new_msg
-        else:
-            return None
+
+# the bits table is built when the module is loaded by the app and by the workers
+BeDballe.load_physical_variable_bits()
@@ -0,0 +1,175 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Tuple
+
+import dballe
+from mistral.exceptions import DballePoolTimeout
+from restapi.env import Env
+from restapi.utilities.logs import log
+
+# max number of connections opened by a process on each dsn
+POOL_SIZE = Env.get_int("DBALLE_POOL_SIZE", 4)
+# seconds a request waits for a free connection before failing
+POOL_TIMEOUT = Env.get_int("DBALLE_POOL_TIMEOUT", 30)
+# seconds after that an unused connection is closed
+POOL_MAX_IDLE = Env.get_int("DBALLE_POOL_MAX_IDLE", 300)
+# connections unused for more than these seconds are checked before being reused
+POOL_LIVENESS_CHECK = Env.get_int("DBALLE_POOL_LIVENESS_CHECK", 30)
+
+
+class DballeConnectionPool:
+    """
+    Bounded pool of DB-All.e connections to a single dsn.
+    A connection is used by one caller at a time, as dballe does not allow
+    concurrent transactions on the same connection
+    """
+
+    def __init__(self, url: str, name: str, size: int, max_idle: int) -> None:
+        self._url = url
+        self.name = name
+        self.size = size
+        self.max_idle = max_idle
+        # (last usage, connection), the most recently used at the end
+        self._idle: List[Tuple[float, dballe.DB]] = []
+        self._opened = 0
+        self._cond = threading.Condition()
+        self.stats = {
+            "created": 0,
+            "reused": 0,
+            "discarded": 0,
+            "evicted": 0,
+            "waits": 0,
+            "timeouts": 0,
+            "wait_time_ms": 0,
+            "max_wait_time_ms": 0,
+        }
+
+    def _evict_idle(self, now: float) -> None:
+        while self._idle and now - self._idle[0][0] > self.max_idle:
+            self._idle.pop(0)
+            self._opened -= 1
+            self.stats["evicted"] += 1
+
+    @staticmethod
+    def is_alive(db: dballe.DB) -> bool:
+        try:
+            with db.transaction() as tr:
+                tr.query_stations({"ana_id": 0}).remaining
+        except Exception as exc:
+            log.warning("dballe connection is no more usable: {}", exc)
+            return False
+        return True
+
+    def acquire(self, timeout: float = POOL_TIMEOUT) -> dballe.DB:
+        start = time.monotonic()
+        deadline = start + timeout
+        with self._cond:
+            waited = False
+            while True:
+                now = time.monotonic()
+                self._evict_idle(now)
+                if self._idle or self._opened < self.size:
+                    break
+                remaining = deadline - now
+                if remaining <= 0:
+                    self.stats["timeouts"] += 1
+                    raise DballePoolTimeout(
+                        f"No dballe connection available for {self.name}"
+                    )
+                waited = True
+                self._cond.wait(remaining)
+
+            if waited:
+                wait_time_ms = int((time.monotonic() - start) * 1000)
+                self.stats["waits"] += 1
+                self.stats["wait_time_ms"] += wait_time_ms
+                self.stats["max_wait_time_ms"] = max(
+                    self.stats["max_wait_time_ms"], wait_time_ms
+                )
+                log.debug("waited {}ms for a connection to {}", wait_time_ms, self.name)
+
+            last_usage, db = self._idle.pop() if self._idle else (None, None)
+            # the connection slot is reserved before leaving the lock
+            if db is None:
+                self._opened += 1
+
+        if db is not None:
+            if now - last_usage < POOL_LIVENESS_CHECK or self.is_alive(db):
+                with self._cond:
+                    self.stats["reused"] += 1
+                return db
+            # replace the dead connection
+            with self._cond:
+                self.stats["discarded"] += 1
+
+        try:
+            db = dballe.DB.connect(self._url)
+        except Exception:
+            with self._cond:
+                self._opened -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self.stats["created"] += 1
+        return db
+
+    def release(self, db: dballe.DB, discard: bool = False) -> None:
+        with self._cond:
+            if discard:
+                self._opened -= 1
+                self.stats["discarded"] += 1
+            else:
+                self._idle.append((time.monotonic(), db))
+            self._cond.notify()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._cond:
+            stats: Dict[str, Any] = dict(self.stats)
+            stats["size"] = self.size
+            stats["opened"] = self._opened
+            stats["idle"] = len(self._idle)
+            stats["in_use"] = self._opened - len(self._idle)
+        return stats
+
+
+class DballePools:
+    """
+    Connection pools of the process, one for each dsn.
+    They are shared by the requests of the API and by the tasks of a celery worker
+    """
+
+    _pools: Dict[str, DballeConnectionPool] = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_pool(cls, url: str, name: str) -> DballeConnectionPool:
+        pool = cls._pools.get(url)
+        if pool is None:
+            with cls._lock:
+                pool = cls._pools.get(url)
+                if pool is None:
+                    pool = DballeConnectionPool(url, name, POOL_SIZE, POOL_MAX_IDLE)
+                    cls._pools[url] = pool
+        return pool
+
+    @classmethod
+    @contextmanager
+    def connection(cls, url: str, name: str) -> Iterator[dballe.DB]:
+        pool = cls.get_pool(url, name)
+        db = pool.acquire()
+        discard = False
+        try:
+            yield db
+        except (OSError, RuntimeError):
+            # do not give back to the pool a connection that may be broken
+            discard = True
+            raise
+        finally:
+            pool.release(db, discard=discard)
+
+    @classmethod
+    def get_stats(cls) -> Dict[str, Dict[str, Any]]:
+        with cls._lock:
+            pools = list(cls._pools.values())
+        return {pool.name: pool.get_stats() for pool in pools}
@@ -0,0 +1,151 @@
+import os
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import dballe
+from restapi.utilities.logs import log
+
+# keys copied from the explorer summary cursors when a view materializes them.
+# They are all the keys read by BeDballe on the query_summary results
+SUMMARY_CURSOR_KEYS = (
+    "ana_id",
+    "rep_memo",
+    "ident",
+    "lat",
+    "lon",
+    "var",
+    "level",
+    "trange",
+    "leveltype1",
+    "l1",
+    "leveltype2",
+    "l2",
+    "pindicator",
+    "p1",
+    "p2",
+    "datetimemin",
+    "datetimemax",
+    "count",
+)
+
+FileSignature = Optional[Tuple[int, int, int]]
+
+
+class ExplorerView:
+    """
+    Per-request view on a shared DBExplorer.
+    The filter is stored in the view and applied to the shared explorer
+    only while the lock is held, so concurrent requests cannot see each other filters
+    """
+
+    def __init__(self, explorer: dballe.DBExplorer, lock: threading.Lock) -> None:
+        self._explorer = explorer
+        self._lock = lock
+        self._filter: Dict[str, Any] = {}
+
+    def set_filter(self, query: Dict[str, Any]) -> None:
+        self._filter = dict(query)
+
+    def close(self) -> None:
+        # the shared explorer stays loaded: nothing to release
+        pass
+
+    def __enter__(self) -> "ExplorerView":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def _get(self, attr: str) -> Any:
+        with self._lock:
+            self._explorer.set_filter(self._filter)
+            return getattr(self._explorer, attr)
+
+    @property
+    def varcodes(self) -> List[str]:
+        return self._get("varcodes")
+
+    @property
+    def levels(self) -> List[dballe.Level]:
+        return self._get("levels")
+
+    @property
+    def tranges(self) -> List[dballe.Trange]:
+        return self._get("tranges")
+
+    @property
+    def reports(self) -> List[str]:
+        return self._get("reports")
+
+    @property
+    def all_reports(self) -> List[str]:
+        return self._get("all_reports")
+
+    @staticmethod
+    def _materialize(cursor: Any) -> List[Dict[str, Any]]:
+        return [{k: cur[k] for k in SUMMARY_CURSOR_KEYS} for cur in cursor]
+
+    def query_summary(self, query: Dict[str, Any]) -> List[Dict[str, Any]]:
+        with self._lock:
+            self._explorer.set_filter(self._filter)
+            return self._materialize(self._explorer.query_summary(query))
+
+    def query_summary_all(self, query: Dict[str, Any]) -> List[Dict[str, Any]]:
+        with self._lock:
+            return self._materialize(self._explorer.query_summary_all(query))
+
+
+class ExplorerCache:
+    """
+    Process-wide cache of the explorers loaded from the json summary files.
+    An explorer is reloaded only when the mtime or the inode of one of its files changes
+    """
+
+    _entries: Dict[Tuple[str, ...], Tuple[Tuple[FileSignature, ...], Any]] = {}
+    _lock = threading.Lock()
+    # one lock per cache key, so that a slow load does not block the other groups
+    _load_locks: Dict[Tuple[str, ...], threading.Lock] = {}
+
+    @staticmethod
+    def get_signature(path: Path) -> FileSignature:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_ino, st.st_size)
+
+    @staticmethod
+    def load_explorer(files: List[Path]) -> dballe.DBExplorer:
+        explorer = dballe.DBExplorer()
+        with explorer.update() as updater:
+            for json_summary_file in files:
+                log.debug("loaded in explorer {}", json_summary_file)
+                if json_summary_file.exists():
+                    with open(json_summary_file) as fd:
+                        updater.add_json(fd.read())
+        return explorer
+
+    @classmethod
+    def get_view(cls, key: Tuple[str, ...], files: List[Path]) -> ExplorerView:
+        with cls._lock:
+            load_lock = cls._load_locks.setdefault(key, threading.Lock())
+
+        with load_lock:
+            signature = tuple(cls.get_signature(f) for f in files)
+            cached = cls._entries.get(key)
+            if cached and cached[0] == signature:
+                explorer, explorer_lock = cached[1]
+            else:
+                log.debug("explorer for {} is not cached or outdated: reloading", key)
+                explorer = cls.load_explorer(files)
+                explorer_lock = threading.Lock()
+                with cls._lock:
+                    cls._entries[key] = (signature, (explorer, explorer_lock))
+
+        return ExplorerView(explorer, explorer_lock)
+
+    @classmethod
+    def clear(cls) -> None:
+        with cls._lock:
+            cls._entries.clear()
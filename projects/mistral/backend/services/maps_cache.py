@@ -0,0 +1,191 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from restapi.env import Env
+
+# seconds a cached maps response is considered valid (0 disables the cache)
+MAPS_CACHE_TTL = Env.get_int("MAPS_CACHE_TTL", 600)
+MAPS_CACHE_SIZE = Env.get_int("MAPS_CACHE_SIZE", 512)
+# step in degrees of the grid the bounding boxes are snapped to
+MAPS_CACHE_BBOX_STEP = float(Env.get("MAPS_CACHE_BBOX_STEP", "0.05"))
+# stamps of the networks and of the DB-All.e DSNs with new data, written by the
+# ingestion scripts (nifi/scripts/obs/maps_cache_stamps.py)
+MAPS_CACHE_STAMPS_DIR = Path(Env.get("DATA_PATH", "/data"), ".maps_cache")
+
+CacheKey = Tuple[Tuple[str, Any], ...]
+Stamps = Tuple[Optional[int], ...]
+
+# clauses of the q parameter whose values are alternatives (in any order)
+LIST_CLAUSES = ("network", "product", "level", "timerange")
+
+
+class MapsResponseCache:
+    """
+    Process-wide cache of the responses of the observations maps.
+    Equivalent requests share the same entry, that expires after MAPS_CACHE_TTL
+    seconds or as soon as new data of its networks are imported (see get_stamp_names)
+    """
+
+    # key -> (expiration, stamps, stamp names, response)
+    _entries: "OrderedDict[CacheKey, Tuple[float, Stamps, Tuple[str, ...], Any]]" = (
+        OrderedDict()
+    )
+    _lock = threading.Lock()
+    _stats: Dict[str, int] = {
+        "hits": 0,
+        "misses": 0,
+        "expired": 0,
+        "invalidated": 0,
+        "evicted": 0,
+    }
+
+    @staticmethod
+    def normalize_q(q: Optional[str]) -> str:
+        # the order of the clauses and of the alternative values does not change the query
+        if not q:
+            return ""
+        clauses = []
+        for clause in q.split(";"):
+            clause = clause.strip()
+            if not clause:
+                continue
+            name, sep, value = clause.partition(":")
+            name = name.strip()
+            if sep and name in LIST_CLAUSES:
+                value = " or ".join(sorted(v.strip() for v in value.split(" or ")))
+            else:
+                value = value.strip()
+            clauses.append(f"{name}{sep}{value}")
+        return ";".join(sorted(clauses))
+
+    @staticmethod
+    def snap_bbox(
+        latmin: float, lonmin: float, latmax: float, lonmax: float
+    ) -> Tuple[float, float, float, float]:
+        """
+        Enlarge the bounding box to the closest points of a grid, so that
+        slightly different boxes are requested with the same query
+        """
+        step = MAPS_CACHE_BBOX_STEP
+        if step <= 0:
+            return latmin, lonmin, latmax, lonmax
+        return (
+            round(math.floor(latmin / step) * step, 6),
+            round(math.floor(lonmin / step) * step, 6),
+            round(math.ceil(latmax / step) * step, 6),
+            round(math.ceil(lonmax / step) * step, 6),
+        )
+
+    @staticmethod
+    def get_key(**params: Any) -> CacheKey:
+        if "q" in params:
+            params["q"] = MapsResponseCache.normalize_q(params["q"])
+        return tuple(sorted((k, v) for k, v in params.items() if v is not None))
+
+    @staticmethod
+    def get_stamp_path(name: str) -> Path:
+        return MAPS_CACHE_STAMPS_DIR.joinpath(f"{name}.stamp")
+
+    @staticmethod
+    def get_stamp_names(
+        networks: Optional[List[str]], dsn: Optional[str]
+    ) -> Tuple[str, ...]:
+        """
+        Stamps invalidating a response: the ones of its networks or, for the responses
+        not limited to some networks, the one of the DSN of their license group
+        """
+        if networks:
+            return tuple(sorted(set(networks)))
+        if dsn:
+            return (f"{dsn}.dsn",)
+        # no data ingested by nifi: the response only expires
+        return ()
+
+    @staticmethod
+    def get_stamps(names: Tuple[str, ...]) -> Stamps:
+        stamps = []
+        for name in names:
+            try:
+                stamps.append(
+                    os.stat(MapsResponseCache.get_stamp_path(name)).st_mtime_ns
+                )
+            except FileNotFoundError:
+                stamps.append(None)
+        return tuple(stamps)
+
+    @classmethod
+    def get(
+        cls, key: CacheKey, stamp_names: Tuple[str, ...] = ()
+    ) -> Tuple[Optional[Any], Stamps]:
+        """
+        Return the cached response, or None, and the current stamps. On a miss the
+        stamps are read before the query and stored with its response: data
+        ingested while querying invalidate it
+        """
+        if MAPS_CACHE_TTL <= 0:
+            return None, ()
+        stamps = cls.get_stamps(stamp_names)
+        with cls._lock:
+            cached = cls._entries.get(key)
+        if cached is None:
+            with cls._lock:
+                cls._stats["misses"] += 1
+            return None, stamps
+
+        expiration, cached_stamps, cached_stamp_names, response = cached
+        if expiration < time.monotonic():
+            stat = "expired"
+        elif (cached_stamp_names, cached_stamps) != (stamp_names, stamps):
+            stat = "invalidated"
+        else:
+            with cls._lock:
+                if key in cls._entries:
+                    cls._entries.move_to_end(key)
+                cls._stats["hits"] += 1
+            return response, stamps
+
+        with cls._lock:
+            cls._entries.pop(key, None)
+            cls._stats[stat] += 1
+            cls._stats["misses"] += 1
+        return None, stamps
+
+    @classmethod
+    def set(
+        cls,
+        key: CacheKey,
+        response: Any,
+        stamp_names: Tuple[str, ...] = (),
+        stamps: Stamps = (),
+    ) -> None:
+        """
+        Store a response with the stamps returned by get before querying its data
+        """
+        if MAPS_CACHE_TTL <= 0:
+            return
+        entry = (time.monotonic() + MAPS_CACHE_TTL, stamps, stamp_names, response)
+        with cls._lock:
+            cls._entries[key] = entry
+            cls._entries.move_to_end(key)
+            while len(cls._entries) > MAPS_CACHE_SIZE:
+                cls._entries.popitem(last=False)
+                cls._stats["evicted"] += 1
+
+    @classmethod
+    def get_stats(cls) -> Dict[str, int]:
+        with cls._lock:
+            stats = dict(cls._stats)
+            stats["entries"] = len(cls._entries)
+        stats["ttl"] = MAPS_CACHE_TTL
+        stats["max_entries"] = MAPS_CACHE_SIZE
+        return stats
+
+    @classmethod
+    def clear(cls) -> None:
+        with cls._lock:
+            cls._entries.clear()
@@ -0,0 +1,342 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from mistral.services.maps_response import NO_TIME, MapsResponseBuilder
+from mistral.services.station_details import StationDetailsCache
+from restapi.env import Env
+from restapi.utilities.logs import log
+
+# cells in which a map tile is divided on each side, when the grid is set by zoom level
+MAPS_GRID_CELLS_PER_TILE = Env.get_int("MAPS_GRID_CELLS_PER_TILE", 4)
+# seconds the station indexes built from the summaries are kept in memory
+MAPS_GRID_INDEX_TTL = Env.get_int("MAPS_GRID_INDEX_TTL", 600)
+# max number of station indexes kept in memory, the least recently used are dropped
+MAPS_GRID_INDEX_SIZE = Env.get_int("MAPS_GRID_INDEX_SIZE", 32)
+MAPS_GRID_MAX_ZOOM = 18
+
+EPOCH = datetime(1970, 1, 1)
+
+StationKey = Tuple[Any, ...]
+IndexKey = Tuple[Any, ...]
+BBox = Tuple[float, float, float, float]
+# the bounding box is applied to the indexes, not to the summaries
+BBOX_KEYS = ("latmin", "lonmin", "latmax", "lonmax")
+
+
+class StationIndex:
+    """
+    Position and network of the stations found in the summaries of the observed
+    data, stored in arrays to assign the stations to the cells of a grid
+    """
+
+    def __init__(self, stations: Dict[StationKey, Tuple[float, float, str]]) -> None:
+        self.keys: List[StationKey] = list(stations)
+        self.positions = {key: i for i, key in enumerate(self.keys)}
+        self.lat = np.array([s[0] for s in stations.values()], dtype=np.float64)
+        self.lon = np.array([s[1] for s in stations.values()], dtype=np.float64)
+        self.networks = [s[2] for s in stations.values()]
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @classmethod
+    def from_summary(cls, entries: Sequence[Dict[str, Any]]) -> "StationIndex":
+        stations: Dict[StationKey, Tuple[float, float, str]] = {}
+        for entry in entries:
+            key = StationDetailsCache.get_station_key(entry)
+            # mobile stations are placed at their last known position
+            stations[key] = (
+                float(entry["lat"]),
+                float(entry["lon"]),
+                entry["rep_memo"],
+            )
+        return cls(stations)
+
+    def within(self, bbox: Optional[BBox]) -> "StationIndex":
+        """
+        Stations of the index in the bounding box (latmin, lonmin, latmax, lonmax)
+        """
+        if bbox is None:
+            return self
+        latmin, lonmin, latmax, lonmax = bbox
+        inside = (
+            (self.lat >= latmin)
+            & (self.lat <= latmax)
+            & (self.lon >= lonmin)
+            & (self.lon <= lonmax)
+        )
+        return StationIndex(
+            {
+                self.keys[i]: (self.lat[i], self.lon[i], self.networks[i])
+                for i in np.flatnonzero(inside).tolist()
+            }
+        )
+
+    def get_position(self, station: StationKey) -> Optional[Tuple[float, float]]:
+        if len(station) == 3:
+            return station[0], station[1]
+        i = self.positions.get(station)
+        if i is None:
+            return None
+        return float(self.lat[i]), float(self.lon[i])
+
+
+class MapsGrid:
+    """
+    Aggregation of the stations and of the observed values of the maps in the
+    cells of a regular lat/lon grid
+    """
+
+    _indexes: "OrderedDict[IndexKey, Tuple[float, StationIndex]]" = OrderedDict()
+    _lock = threading.Lock()
+
+    @staticmethod
+    def get_cell_size(
+        zoom: Optional[int] = None, grid_size: Optional[float] = None
+    ) -> float:
+        """
+        Size in degrees of the cells: the requested one or the size of the
+        tiles of the zoom level divided by MAPS_GRID_CELLS_PER_TILE
+        """
+        if grid_size:
+            return grid_size
+        zoom = min(max(zoom or 0, 0), MAPS_GRID_MAX_ZOOM)
+        return 360 / 2**zoom / MAPS_GRID_CELLS_PER_TILE
+
+    @staticmethod
+    def get_index_key(
+        license_group: str,
+        db_type: str,
+        queries: List[Dict[str, Any]],
+        networks: Optional[List[str]],
+    ) -> IndexKey:
+        # the same index serves all the bounding boxes of the same queries
+        return (
+            license_group,
+            db_type,
+            tuple(
+                tuple(sorted((k, repr(v)) for k, v in q.items() if k not in BBOX_KEYS))
+                for q in queries
+            ),
+            tuple(sorted(networks)) if networks is not None else None,
+        )
+
+    @classmethod
+    def get_station_index(
+        cls,
+        key: IndexKey,
+        explorer: Any,
+        queries: List[Dict[str, Any]],
+        networks: Optional[List[str]] = None,
+    ) -> StationIndex:
+        """
+        Index of the stations having data matching one of the queries, built from the
+        summaries. If networks is given, only the stations of those networks are indexed.
+        The bounding boxes of the queries are ignored: use StationIndex.within
+        """
+        with cls._lock:
+            cached = cls._indexes.get(key)
+            if cached and cached[0] > time.monotonic():
+                cls._indexes.move_to_end(key)
+                return cached[1]
+
+        entries: List[Dict[str, Any]] = []
+        for query in queries:
+            query = {k: v for k, v in query.items() if k not in BBOX_KEYS}
+            for entry in explorer.query_summary(query):
+                if networks is None or entry["rep_memo"] in networks:
+                    entries.append(entry)
+        index = StationIndex.from_summary(entries)
+        log.debug("index of {} stations built for {}", len(index), key)
+        if MAPS_GRID_INDEX_TTL > 0:
+            with cls._lock:
+                now = time.monotonic()
+                # drop the expired indexes
+                for k in [k for k, v in cls._indexes.items() if v[0] <= now]:
+                    cls._indexes.pop(k)
+                cls._indexes[key] = (now + MAPS_GRID_INDEX_TTL, index)
+                cls._indexes.move_to_end(key)
+                while len(cls._indexes) > max(MAPS_GRID_INDEX_SIZE, 1):
+                    cls._indexes.popitem(last=False)
+        return index
+
+    @staticmethod
+    def get_cells(
+        lat: np.ndarray, lon: np.ndarray, cell_size: float
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return the cells of the positions (as row and column of the grid)
+        and the index of the cell of each position
+        """
+        rows = np.floor(lat / cell_size).astype(np.int64)
+        cols = np.floor(lon / cell_size).astype(np.int64)
+        cells, cell_ids = np.unique(
+            np.stack([rows, cols], axis=1), axis=0, return_inverse=True
+        )
+        return cells, cell_ids.reshape(-1)
+
+    @staticmethod
+    def get_cell_el(row: int, col: int, cell_size: float) -> Dict[str, float]:
+        latmin = row * cell_size
+        lonmin = col * cell_size
+        return {
+            "lat": latmin + cell_size / 2,
+            "lon": lonmin + cell_size / 2,
+            "latmin": latmin,
+            "lonmin": lonmin,
+            "latmax": latmin + cell_size,
+            "lonmax": lonmin + cell_size,
+        }
+
+    @staticmethod
+    def aggregate_stations(
+        index: StationIndex, cell_size: float
+    ) -> List[Dict[str, Any]]:
+        """
+        Number of stations and networks in each cell of the grid
+        """
+        if not len(index):
+            return []
+        cells, cell_ids = MapsGrid.get_cells(index.lat, index.lon, cell_size)
+        counts = np.bincount(cell_ids, minlength=len(cells)).tolist()
+        networks: List[Dict[str, None]] = [{} for _ in range(len(cells))]
+        for cell_id, network in zip(cell_ids.tolist(), index.networks):
+            networks[cell_id][network] = None
+
+        res = []
+        for cell_id, (row, col) in enumerate(cells.tolist()):
+            res.append(
+                {
+                    "cell": MapsGrid.get_cell_el(row, col, cell_size),
+                    "count": counts[cell_id],
+                    "nets": list(networks[cell_id]),
+                }
+            )
+        return res
+
+    @staticmethod
+    def aggregate_values(
+        response: MapsResponseBuilder,
+        index: StationIndex,
+        cell_size: float,
+        only_last_data: bool = False,
+    ) -> List[Dict[str, Any]]:
+        """
+        Count, min, max, mean and most recent value of each product in each cell of the
+        grid. If only_last_data, only the most recent value of each station is considered
+        """
+        if not len(response):
+            return []
+
+        # position of the stations of the response
+        positions = [index.get_position(s) for s in response.station_keys]
+        located = [i for i, p in enumerate(positions) if p is not None]
+        if len(located) < len(positions):
+            log.debug(
+                "{} stations without a position are not aggregated",
+                len(positions) - len(located),
+            )
+        if not located:
+            return []
+        lat = np.array([positions[i][0] for i in located], dtype=np.float64)
+        lon = np.array([positions[i][1] for i in located], dtype=np.float64)
+        cells, located_cell_ids = MapsGrid.get_cells(lat, lon, cell_size)
+        station_cells = np.full(len(positions), -1, dtype=np.int64)
+        station_cells[located] = located_cell_ids
+
+        # stations count and networks of each cell
+        station_counts = np.bincount(located_cell_ids, minlength=len(cells)).tolist()
+        networks: List[Dict[str, None]] = [{} for _ in range(len(cells))]
+        for i, cell_id in zip(located, located_cell_ids.tolist()):
+            networks[cell_id][response.station_keys[i][-1]] = None
+
+        # station and product of each series, only numeric products are aggregated
+        products: Dict[Any, int] = {}
+        series_cells = np.full(len(response.series_products), -1, dtype=np.int64)
+        series_products = np.full(len(response.series_products), -1, dtype=np.int64)
+        for (station_id, product), series_id in response.series.items():
+            var = product[0] if isinstance(product, tuple) else product
+            if response.var_types[var] == "string":
+                continue
+            series_cells[series_id] = station_cells[station_id]
+            series_products[series_id] = products.setdefault(product, len(products))
+
+        if only_last_data:
+            rows = np.frombuffer(response.series_last, dtype=np.int64)
+            rows = rows[rows >= 0]
+        else:
+            rows = np.arange(len(response.row_series), dtype=np.int64)
+        row_series = np.frombuffer(response.row_series, dtype=np.int32)[rows]
+        row_cells = series_cells[row_series]
+        row_products = series_products[row_series]
+        valid = (row_cells >= 0) & (row_products >= 0)
+        rows = rows[valid]
+        row_cells = row_cells[valid]
+        row_products = row_products[valid]
+
+        cell_products: List[List[Dict[str, Any]]] = [[] for _ in range(len(cells))]
+        if len(rows):
+            values = np.frombuffer(response.values, dtype=np.float64)[rows]
+            times = np.frombuffer(response.times, dtype=np.int64)[rows]
+            groups = row_cells * max(len(products), 1) + row_products
+            group_keys, group_ids = np.unique(groups, return_inverse=True)
+            group_ids = group_ids.reshape(-1)
+            n_groups = len(group_keys)
+
+            counts = np.bincount(group_ids, minlength=n_groups)
+            sums = np.bincount(group_ids, weights=values, minlength=n_groups)
+            mins = np.full(n_groups, np.inf)
+            np.minimum.at(mins, group_ids, values)
+            maxs = np.full(n_groups, -np.inf)
+            np.maximum.at(maxs, group_ids, values)
+            # most recent value of each group: the last row sorting by group and time
+            # (on equal times the first extracted value is kept, as in the maps)
+            order = np.lexsort((-rows, times, group_ids))
+            last_rows = order[np.cumsum(counts) - 1]
+
+            product_keys = list(products)
+            for g, group in enumerate(group_keys.tolist()):
+                cell_id, product_id = divmod(group, max(len(products), 1))
+                product = product_keys[product_id]
+                var = product[0] if isinstance(product, tuple) else product
+                integer = response.var_types[var] == "integer"
+                product_el: Dict[str, Any] = {}
+                if isinstance(product, tuple):
+                    product_el["var"] = product[0]
+                    product_el["lev"] = product[1]
+                    product_el["trange"] = product[2]
+                else:
+                    product_el["var"] = product
+                last = {"val": values[last_rows[g]].item()}
+                if integer:
+                    last["val"] = int(last["val"])
+                last_time = int(times[last_rows[g]])
+                if last_time != NO_TIME:
+                    last["ref"] = (EPOCH + timedelta(seconds=last_time)).isoformat()
+                product_el["count"] = int(counts[g])
+                product_el["min"] = int(mins[g]) if integer else float(mins[g])
+                product_el["max"] = int(maxs[g]) if integer else float(maxs[g])
+                product_el["mean"] = float(sums[g] / counts[g])
+                product_el["last"] = last
+                cell_products[cell_id].append(product_el)
+
+        res = []
+        for cell_id, (row, col) in enumerate(cells.tolist()):
+            res.append(
+                {
+                    "cell": MapsGrid.get_cell_el(row, col, cell_size),
+                    "count": station_counts[cell_id],
+                    "nets": list(networks[cell_id]),
+                    "prod": cell_products[cell_id],
+                }
+            )
+        return res
+
+    @classmethod
+    def clear(cls) -> None:
+        with cls._lock:
+            cls._indexes.clear()
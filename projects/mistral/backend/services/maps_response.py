@@ -0,0 +1,324 @@
+import json
+from array import array
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+StationKey = Tuple[Any, ...]
+# a product is a varcode or a (varcode, level, timerange) tuple
+ProductKey = Any
+
+EPOCH = datetime(1970, 1, 1)
+# reference time not available (multimodel data without a requested run)
+NO_TIME = -(2**63)
+# reliability flag not available (multimodel data)
+NO_FLAG = -1
+
+
+class MapsResponseBuilder:
+    """
+    Observed data of the maps stored by column: a row for every value with the index
+    of its station and product, the reference time as epoch seconds, the value and
+    the reliability flag. The response is serialized straight from the columns
+    """
+
+    def __init__(self) -> None:
+        self.stations: Dict[StationKey, int] = {}
+        self.station_keys: List[StationKey] = []
+        self.station_details: List[List[Dict[str, Any]]] = []
+        # products of each station, in order of appearance
+        self.station_series: List[List[int]] = []
+        self.series: Dict[Tuple[int, ProductKey], int] = {}
+        self.series_products: List[ProductKey] = []
+        # row of the most recent value of each series
+        self.series_last = array("q")
+        # varcode -> type of the values ("integer", "decimal" or "string")
+        self.var_types: Dict[str, str] = {}
+
+        self.row_series = array("i")
+        self.times = array("q")
+        self.values = array("d")
+        self.reliability = array("b")
+        # values that are not numbers, by row
+        self.other_values: Dict[int, Any] = {}
+
+    def __len__(self) -> int:
+        return len(self.station_keys)
+
+    def __contains__(self, station: StationKey) -> bool:
+        return station in self.stations
+
+    def add_station(self, station: StationKey, details: List[Dict[str, Any]]) -> int:
+        station_id = self.stations.get(station)
+        if station_id is None:
+            station_id = len(self.station_keys)
+            self.stations[station] = station_id
+            self.station_keys.append(station)
+            self.station_details.append(details)
+            self.station_series.append([])
+        return station_id
+
+    def add_value(
+        self,
+        station_id: int,
+        product: ProductKey,
+        value: Any,
+        time: int = NO_TIME,
+        reliability: int = NO_FLAG,
+    ) -> None:
+        series_id = self.series.get((station_id, product))
+        if series_id is None:
+            series_id = len(self.series_products)
+            self.series[(station_id, product)] = series_id
+            self.series_products.append(product)
+            self.series_last.append(-1)
+            self.station_series[station_id].append(series_id)
+
+        var = product[0] if isinstance(product, tuple) else product
+        var_type = self.var_types.get(var)
+        if var_type is None:
+            if isinstance(value, int):
+                var_type = "integer"
+            elif isinstance(value, float):
+                var_type = "decimal"
+            else:
+                var_type = "string"
+            self.var_types[var] = var_type
+
+        row = len(self.row_series)
+        self.row_series.append(series_id)
+        self.times.append(time)
+        self.reliability.append(reliability)
+        if var_type == "string":
+            self.values.append(0.0)
+            self.other_values[row] = value
+        else:
+            self.values.append(value)
+
+        # the last value is found while collecting the data:
+        # on equal times the first value is kept
+        last = self.series_last[series_id]
+        if last < 0 or time > self.times[last]:
+            self.series_last[series_id] = row
+
+    def merge(self, other: "MapsResponseBuilder") -> None:
+        """
+        Append the data of another response, as if they had been extracted after
+        the data of this one
+        """
+        # values are stored as floats: the type of the variables is kept as it is
+        for var, var_type in other.var_types.items():
+            self.var_types.setdefault(var, var_type)
+        station_ids = [
+            self.add_station(station, other.station_details[i])
+            for i, station in enumerate(other.station_keys)
+        ]
+        series_keys = [None] * len(other.series_products)
+        for (station_id, product), series_id in other.series.items():
+            series_keys[series_id] = (station_ids[station_id], product)
+        for row, series_id in enumerate(other.row_series):
+            station_id, product = series_keys[series_id]
+            value = other.other_values.get(row, other.values[row])
+            self.add_value(
+                station_id,
+                product,
+                value,
+                time=other.times[row],
+                reliability=other.reliability[row],
+            )
+
+    def clip(
+        self, bbox: Optional[Tuple[float, float, float, float]]
+    ) -> "MapsResponseBuilder":
+        """
+        Response with only the stations in the bounding box (latmin, lonmin, latmax,
+        lonmax). Mobile stations have no fixed position and are kept. The response
+        itself is returned if no station is outside the box
+        """
+        if not bbox:
+            return self
+        latmin, lonmin, latmax, lonmax = bbox
+        kept = [
+            station_id
+            for station_id, station in enumerate(self.station_keys)
+            if len(station) == 2
+            or (latmin <= station[0] <= latmax and lonmin <= station[1] <= lonmax)
+        ]
+        if len(kept) == len(self.station_keys):
+            return self
+
+        clipped = MapsResponseBuilder()
+        clipped.var_types = dict(self.var_types)
+        # series of the kept stations, renumbered in order
+        new_series = np.full(len(self.series_products), -1, dtype=np.int64)
+        old_series = []
+        for station_id in kept:
+            new_station_id = clipped.add_station(
+                self.station_keys[station_id], self.station_details[station_id]
+            )
+            for series_id in self.station_series[station_id]:
+                product = self.series_products[series_id]
+                new_series_id = len(clipped.series_products)
+                new_series[series_id] = new_series_id
+                old_series.append(series_id)
+                clipped.series[(new_station_id, product)] = new_series_id
+                clipped.series_products.append(product)
+                clipped.station_series[new_station_id].append(new_series_id)
+
+        # rows of the kept series, in the same order
+        row_series = new_series[np.frombuffer(self.row_series, dtype=np.int32)]
+        rows = np.flatnonzero(row_series >= 0)
+        new_rows = np.full(len(row_series), -1, dtype=np.int64)
+        new_rows[rows] = np.arange(len(rows))
+        # the columns are copied as bytes
+        clipped.row_series = array("i", row_series[rows].astype(np.int32).tobytes())
+        clipped.times = array("q", np.frombuffer(self.times, np.int64)[rows].tobytes())
+        clipped.values = array(
+            "d", np.frombuffer(self.values, np.float64)[rows].tobytes()
+        )
+        clipped.reliability = array(
+            "b", np.frombuffer(self.reliability, np.int8)[rows].tobytes()
+        )
+        series_last = np.frombuffer(self.series_last, np.int64)[old_series]
+        clipped.series_last = array("q", new_rows[series_last].tobytes())
+        clipped.other_values = {
+            int(new_rows[row]): value
+            for row, value in self.other_values.items()
+            if new_rows[row] >= 0
+        }
+        return clipped
+
+    def get_varcodes(self) -> Tuple[List[str], List[str], List[str], List[str]]:
+        """
+        Products varcodes, station details varcodes, levels and timeranges
+        in order of appearance
+        """
+        product_varcodes: Dict[str, None] = {}
+        station_varcodes: Dict[str, None] = {}
+        levels: Dict[str, None] = {}
+        timeranges: Dict[str, None] = {}
+        for station_id, series_ids in enumerate(self.station_series):
+            for series_id in series_ids:
+                product = self.series_products[series_id]
+                if isinstance(product, tuple):
+                    product_varcodes[product[0]] = None
+                    levels[product[1]] = None
+                    timeranges[product[2]] = None
+                else:
+                    product_varcodes[product] = None
+            for detail in self.station_details[station_id]:
+                station_varcodes[detail["var"]] = None
+        return (
+            list(product_varcodes),
+            list(station_varcodes),
+            list(levels),
+            list(timeranges),
+        )
+
+    def get_series_rows(self) -> Tuple[np.ndarray, np.ndarray]:
+        # rows sorted by series, keeping the order of extraction inside a series
+        row_series = np.frombuffer(self.row_series, dtype=np.int32)
+        order = np.argsort(row_series, kind="stable")
+        ends = np.cumsum(np.bincount(row_series, minlength=len(self.series_products)))
+        return order, ends
+
+    def iter_values(self, only_last_data: bool) -> Iterator[Tuple[int, List[int]]]:
+        if not self.row_series:
+            return
+        rows: List[int] = []
+        ends: List[int] = []
+        for series_id, product in enumerate(self.series_products):
+            if only_last_data and not isinstance(product, tuple):
+                # only the most recent value is needed (the values of the
+                # extended response products are always returned in full)
+                yield series_id, [self.series_last[series_id]]
+                continue
+            if not ends:
+                # rows are grouped by series only when all the values are needed
+                order, series_ends = self.get_series_rows()
+                rows = order.tolist()
+                ends = series_ends.tolist()
+            start = ends[series_id - 1] if series_id else 0
+            yield series_id, rows[start : ends[series_id]]
+
+    def to_json(
+        self, descriptions: Dict[str, Dict[str, Any]], only_last_data: bool = False
+    ) -> str:
+        """
+        Serialize the response for the maps as
+        {"descr": descriptions, "data": [{"stat": station, "prod": products}]}
+        """
+        times = self.times.tolist()
+        values = self.values.tolist()
+        reliability = self.reliability.tolist()
+        isoformats: Dict[int, str] = {}
+
+        def format_value(row: int, var_type: str) -> str:
+            if var_type == "integer":
+                val = str(int(values[row]))
+            elif var_type == "decimal":
+                val = repr(values[row])
+            else:
+                val = json.dumps(self.other_values[row])
+            fragment = '{"val": ' + val
+            time = times[row]
+            if time != NO_TIME:
+                ref = isoformats.get(time)
+                if ref is None:
+                    ref = (EPOCH + timedelta(seconds=time)).isoformat()
+                    isoformats[time] = ref
+                fragment += ', "ref": "' + ref + '"'
+            if reliability[row] != NO_FLAG:
+                fragment += ', "rel": ' + str(reliability[row])
+            return fragment + "}"
+
+        series_values: List[Optional[str]] = [None] * len(self.series_products)
+        for series_id, rows in self.iter_values(only_last_data):
+            product = self.series_products[series_id]
+            var = product[0] if isinstance(product, tuple) else product
+            var_type = self.var_types[var]
+            series_values[series_id] = ", ".join(
+                format_value(row, var_type) for row in rows
+            )
+
+        data = []
+        for station_id, station in enumerate(self.station_keys):
+            if len(station) == 2:
+                station_el = {"ident": station[0], "net": station[1]}
+            else:
+                station_el = {"lat": station[0], "lon": station[1], "net": station[2]}
+            station_el["details"] = self.station_details[station_id]
+            products = []
+            for series_id in self.station_series[station_id]:
+                product = self.series_products[series_id]
+                if isinstance(product, tuple):
+                    product_el = {
+                        "var": product[0],
+                        "lev": product[1],
+                        "trange": product[2],
+                    }
+                else:
+                    product_el = {"var": product}
+                # the values are added to the already serialized product
+                products.append(
+                    json.dumps(product_el)[:-1]
+                    + ', "val": ['
+                    + (series_values[series_id] or "")
+                    + "]}"
+                )
+            data.append(
+                '{"stat": '
+                + json.dumps(station_el)
+                + ', "prod": ['
+                + ", ".join(products)
+                + "]}"
+            )
+
+        return (
+            '{"descr": '
+            + json.dumps(descriptions)
+            + ', "data": ['
+            + ", ".join(data)
+            + "]}"
+        )
@@ -0,0 +1,207 @@
+from datetime import datetime, timedelta
+from typing import Any, BinaryIO, Collection, Dict, Iterable, List, Optional, Tuple
+
+import dballe
+
+# attributes with the confidence assigned by the quality control
+QC_CODES = ("B33007", "B33192")
+
+
+class MessageFilter:
+    """
+    Select the data of the observed BUFR messages, variable by variable.
+    A message is copied only when some of its data are dropped: untouched messages
+    are returned as they are and, when filtering files, written as the original bytes.
+    Without data_attrs the attributes of the data are not copied, so only the messages
+    whose data have no attributes are left untouched
+    """
+
+    def __init__(
+        self,
+        runs: Optional[Collection[datetime]] = None,
+        quality_check: bool = False,
+        pind: Optional[int] = None,
+        data_attrs: bool = True,
+    ) -> None:
+        # keep only the data of these runs (multimodel forecasts)
+        self.runs = runs
+        # keep only the data considered reliable by the quality control
+        self.quality_check = quality_check
+        # keep only the data with this statistical processing
+        self.pind = pind
+        # copy the attributes of the data (the station data always keep them)
+        self.data_attrs = data_attrs
+
+    @staticmethod
+    def data_qc(attrs: Iterable[Any]) -> int:
+        for attr in attrs:
+            # data is considered unreliable if its confidence is less than 50%
+            if attr.code in QC_CODES and attr.get() < 50:
+                return 0
+        return 1
+
+    @staticmethod
+    def get_validity_time(msg: Any) -> datetime:
+        return datetime(
+            msg.get_named("year").get(),
+            msg.get_named("month").get(),
+            msg.get_named("day").get(),
+            msg.get_named("hour").get(),
+            msg.get_named("minute").get(),
+        )
+
+    def select(self, msg: Any) -> List[bool]:
+        """
+        Return, for each data of the message, if it has to be kept
+        """
+        selected = []
+        # the validity time is the same for all the data of the message
+        validity_time = self.get_validity_time(msg) if self.runs else None
+        for data in msg.query_data({"query": "attrs"}):
+            if self.pind is not None and data["trange"].pind != self.pind:
+                selected.append(False)
+                continue
+            if validity_time is not None:
+                # the run the data comes from
+                validity_interval = timedelta(seconds=data["trange"].p1)
+                if validity_time - validity_interval not in self.runs:
+                    selected.append(False)
+                    continue
+            if self.quality_check:
+                if not self.data_qc(data["variable"].get_attrs()):
+                    selected.append(False)
+                    continue
+            selected.append(True)
+        return selected
+
+    def is_untouched(self, msg: Any, selected: List[bool]) -> bool:
+        if not all(selected):
+            return False
+        if self.data_attrs:
+            return True
+        # the attributes of the data have to be removed
+        return not any(
+            data["variable"].get_attrs() for data in msg.query_data({"query": "attrs"})
+        )
+
+    @staticmethod
+    def copy_message(
+        msg: Any, selected: List[bool], keep: bool = True, data_attrs: bool = True
+    ) -> Any:
+        """
+        Copy the station data of the message and its data selected as keep
+        """
+        new_msg = dballe.Message("generic")
+        new_msg.set_named("year", msg.get_named("year"))
+        new_msg.set_named("month", msg.get_named("month"))
+        new_msg.set_named("day", msg.get_named("day"))
+        new_msg.set_named("hour", msg.get_named("hour"))
+        new_msg.set_named("minute", msg.get_named("minute"))
+        new_msg.set_named("second", msg.get_named("second"))
+        new_msg.set_named("rep_memo", msg.report)
+        new_msg.set_named("longitude", int(msg.coords[0] * 10**5))
+        new_msg.set_named("latitude", int(msg.coords[1] * 10**5))
+        if msg.ident:
+            new_msg.set_named("ident", msg.ident)
+
+        for data, is_selected in zip(msg.query_data({"query": "attrs"}), selected):
+            if is_selected != keep:
+                continue
+            new_msg.set(
+                data["level"], data["trange"], MessageFilter.copy_var(data, data_attrs)
+            )
+        for data in msg.query_station_data({"query": "attrs"}):
+            new_msg.set(dballe.Level(), dballe.Trange(), MessageFilter.copy_var(data))
+        return new_msg
+
+    @staticmethod
+    def copy_var(data: Any, attrs: bool = True) -> Any:
+        variable = data["variable"]
+        v = dballe.var(variable.code, variable.get())
+        if attrs:
+            for a in variable.get_attrs():
+                v.seta(a)
+        return v
+
+    def split(self, msg: Any) -> Tuple[Optional[Any], Optional[Any]]:
+        """
+        Split the message in the kept and in the dropped data.
+        Each part is None if empty and it is the message itself if it has all the data
+        and no attributes to remove
+        """
+        selected = self.select(msg)
+        if not selected:
+            return None, None
+        if self.is_untouched(msg, selected):
+            return msg, None
+        if self.is_untouched(msg, [not s for s in selected]):
+            return None, msg
+        if not any(selected):
+            return None, self.copy_message(
+                msg, selected, keep=False, data_attrs=self.data_attrs
+            )
+        if all(selected):
+            return self.copy_message(msg, selected, data_attrs=self.data_attrs), None
+        return (
+            self.copy_message(msg, selected, data_attrs=self.data_attrs),
+            self.copy_message(msg, selected, keep=False, data_attrs=self.data_attrs),
+        )
+
+    def filter(self, msg: Any) -> Optional[Any]:
+        selected = self.select(msg)
+        if not any(selected):
+            return None
+        if self.is_untouched(msg, selected):
+            # nothing to drop: the message is not copied
+            return msg
+        return self.copy_message(msg, selected, data_attrs=self.data_attrs)
+
+    def filter_file(
+        self,
+        input_file: BinaryIO,
+        output_file: BinaryIO,
+        dropped_file: Optional[BinaryIO] = None,
+    ) -> Dict[str, int]:
+        """
+        Filter a BUFR file subset by subset. The BUFR messages whose subsets are all
+        kept are copied as raw bytes, without being decoded and encoded again.
+        If dropped_file is given, the dropped data are written there
+        """
+        importer = dballe.Importer("BUFR")
+        exporter = dballe.Exporter("BUFR")
+        stats = {"messages": 0, "untouched": 0, "copied": 0, "dropped": 0}
+        with dballe.File(input_file, "BUFR") as f:
+            for binmsg in f:
+                stats["messages"] += 1
+                msgs = importer.from_binary(binmsg)
+                if dropped_file is None:
+                    parts = [(self.filter(msg), None) for msg in msgs]
+                else:
+                    parts = [self.split(msg) for msg in msgs]
+                kept = [p[0] for p in parts]
+                if all(k is m for k, m in zip(kept, msgs)):
+                    # fast path: nothing to drop
+                    output_file.write(binmsg.data)
+                    stats["untouched"] += 1
+                    continue
+                if not any(k is not None for k in kept):
+                    stats["dropped"] += 1
+                else:
+                    stats["copied"] += 1
+                MessageFilter.write(output_file, binmsg, msgs, kept, exporter)
+                if dropped_file is not None:
+                    dropped = [p[1] for p in parts]
+                    MessageFilter.write(dropped_file, binmsg, msgs, dropped, exporter)
+        return stats
+
+    @staticmethod
+    def write(
+        out: BinaryIO, binmsg: Any, msgs: List[Any], parts: List[Any], exporter: Any
+    ) -> None:
+        if all(p is m for p, m in zip(parts, msgs)):
+            # the original message as it is
+            out.write(binmsg.data)
+            return
+        for part in parts:
+            if part is not None:
+                out.write(exporter.to_binary(part))
@@ -0,0 +1,161 @@
+import itertools
+from datetime import datetime, timedelta
+from typing import Any, Collection, Dict, Iterable, List, Sequence, Tuple
+
+from restapi.utilities.logs import log
+
+Fields = List[str]
+Queries = List[List[Any]]
+# fields whose lists are checked in memory when only the summaries are needed
+POST_FILTER_FIELDS = ("level", "trange")
+
+
+class QueryPlanner:
+    """
+    Translate the lists of values of the observed data filters in the smallest
+    set of DB-All.e queries. Lists of variables are pushed to DB-All.e as a
+    varlist filter, while a query is still needed for every combination of the
+    filters DB-All.e can not match against a list (network, level, timerange)
+    """
+
+    @staticmethod
+    def plan(fields: Fields, queries: Queries) -> Tuple[Fields, Queries]:
+        """
+        Return fields and lists of values as expected by the callers of
+        itertools.product, with all the requested variables in a single varlist
+        """
+        planned_fields = []
+        planned_queries = []
+        for field, values in zip(fields, queries):
+            # the same value requested twice gives the same data twice
+            values = list(dict.fromkeys(values))
+            if field == "var" and len(values) > 1:
+                planned_fields.append("varlist")
+                planned_queries.append([",".join(values)])
+            else:
+                planned_fields.append(field)
+                planned_queries.append(values)
+        return planned_fields, planned_queries
+
+    @staticmethod
+    def get_queries(fields: Fields, queries: Queries) -> List[Dict[str, Any]]:
+        planned_fields, planned_queries = QueryPlanner.plan(fields, queries)
+        planned = [
+            dict(zip(planned_fields, q)) for q in itertools.product(*planned_queries)
+        ]
+        log.debug(
+            "{} queries planned instead of {}",
+            len(planned),
+            QueryPlanner.count_combinations(queries),
+        )
+        return planned
+
+    @staticmethod
+    def get_run_queries(
+        fields: Fields,
+        queries: Queries,
+        runs: Collection[datetime],
+        tranges: Iterable[Any],
+    ) -> List[Dict[str, Any]]:
+        """
+        Queries for the multimodel forecasts of the requested runs. The data of a
+        run are stored at the run time plus the forecast time of their timerange,
+        so every timerange is queried only in the window of validity times of
+        the requested runs (within the requested datetimemin and datetimemax)
+        """
+        if not runs:
+            return []
+        first_run = min(runs)
+        last_run = max(runs)
+        datetimemin = datetimemax = None
+        if "datetimemin" in fields:
+            datetimemin = queries[fields.index("datetimemin")][0]
+        if "datetimemax" in fields:
+            datetimemax = queries[fields.index("datetimemax")][0]
+
+        other_fields = []
+        other_queries = []
+        for field, values in zip(fields, queries):
+            if field not in ("trange", "datetimemin", "datetimemax"):
+                other_fields.append(field)
+                other_queries.append(values)
+        other = QueryPlanner.get_queries(other_fields, other_queries)
+
+        planned = []
+        timeranges = dict.fromkeys(QueryPlanner.to_tuple("trange", t) for t in tranges)
+        for trange in timeranges:
+            forecast_time = timedelta(seconds=trange[1] or 0)
+            validity_min = first_run + forecast_time
+            validity_max = last_run + forecast_time
+            if datetimemin and validity_min < datetimemin:
+                validity_min = datetimemin
+            if datetimemax and validity_max > datetimemax:
+                validity_max = datetimemax
+            if validity_min > validity_max:
+                # no data of the requested runs in the interval
+                continue
+            for query in other:
+                planned.append(
+                    {
+                        **query,
+                        "trange": trange,
+                        "datetimemin": validity_min,
+                        "datetimemax": validity_max,
+                    }
+                )
+        log.debug("{} queries planned for {} runs", len(planned), len(runs))
+        return planned
+
+    @staticmethod
+    def get_summary_queries(
+        fields: Fields, queries: Queries
+    ) -> List[Tuple[Dict[str, Any], Dict[str, List[Any]]]]:
+        """
+        Queries for the summaries, each with the lists of levels and timeranges
+        to be checked in memory on the resulting rows (see matches)
+        """
+        query_fields = []
+        query_values = []
+        post_filter = {}
+        for field, values in zip(fields, queries):
+            if field in POST_FILTER_FIELDS and len(values) > 1:
+                post_filter[field] = values
+            else:
+                query_fields.append(field)
+                query_values.append(values)
+        return [
+            (query, post_filter)
+            for query in QueryPlanner.get_queries(query_fields, query_values)
+        ]
+
+    @staticmethod
+    def matches(row: Dict[str, Any], post_filter: Dict[str, List[Any]]) -> bool:
+        for field, values in post_filter.items():
+            actual = QueryPlanner.to_tuple(field, row[field])
+            if not any(QueryPlanner.match_value(actual, value) for value in values):
+                return False
+        return True
+
+    @staticmethod
+    def to_tuple(field: str, value: Any) -> Tuple[Any, ...]:
+        if value is None:
+            return ()
+        if isinstance(value, tuple):
+            return value
+        if field == "level":
+            return (value.ltype1, value.l1, value.ltype2, value.l2)
+        return (value.pind, value.p1, value.p2)
+
+    @staticmethod
+    def match_value(actual: Sequence[Any], requested: Sequence[Any]) -> bool:
+        # missing values in the request do not constrain the result, as in DB-All.e
+        if not actual:
+            return False
+        return all(r is None or a == r for a, r in zip(actual, requested))
+
+    @staticmethod
+    def count_combinations(queries: Queries) -> int:
+        count = 1
+        for values in queries:
+            count *= len(values)
+        return count
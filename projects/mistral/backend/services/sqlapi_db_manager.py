@@ -1,11 +1,14 @@
 import datetime
 import json
+import threading
+import time
 from pathlib import Path
-from typing import Any, Optional
+from typing import Any, Dict, List, NamedTuple, Optional, Set, Tuple
 
 from celery.result import AsyncResult
 from celery.states import READY_STATES
 from mistral.endpoints import DOWNLOAD_DIR, OPENDATA_DIR
+from mistral.services.usage_ledger import UsageLedger
 from restapi.connectors import sqlalchemy
 from restapi.env import Env
 from restapi.exceptions import NotFound, Unauthorized
@@ -14,9 +17,76 @@
 
 grace_period_days = Env.get_int("GRACE_PERIOD", 2)
 GRACE_PERIOD = datetime.timedelta(days=grace_period_days)
+# seconds the datasets catalog is kept in memory before being reloaded from db
+DATASET_CATALOG_TTL = Env.get_int("DATASET_CATALOG_TTL", 60)
+
+
+class LicenseGroupEntry(NamedTuple):
+    id: int
+    name: str
+    descr: str
+    is_public: bool
+    dballe_dsn: Optional[str]
+
+
+class DatasetCatalog:
+    """
+    Datasets with their license, license group and attribution,
+    loaded from the db with a single query
+    """
+
+    def __init__(self, rows: List[Tuple[Any, Any, Any, Any]]) -> None:
+        self.datasets: List[Dict[str, Any]] = []
+        self.by_arkimet_id: Dict[str, Dict[str, Any]] = {}
+        self.license_groups: Dict[int, LicenseGroupEntry] = {}
+        self.license_groups_by_name: Dict[str, LicenseGroupEntry] = {}
+
+        for ds, license, group_license, attribution in rows:
+            group = self.license_groups.get(group_license.id)
+            if group is None:
+                group = LicenseGroupEntry(
+                    id=group_license.id,
+                    name=group_license.name,
+                    descr=group_license.descr,
+                    is_public=group_license.is_public,
+                    dballe_dsn=group_license.dballe_dsn,
+                )
+                self.license_groups[group.id] = group
+                self.license_groups_by_name.setdefault(group.name, group)
+            dataset = {
+                "arkimet_id": ds.arkimet_id,
+                "name": ds.name,
+                "description": ds.description,
+                "category": ds.category.name if ds.category else None,
+                "fileformat": ds.fileformat,
+                "bounding": ds.bounding,
+                "sort_index": ds.sort_index,
+                "license": license.name,
+                "license_description": license.descr,
+                "license_url": license.url,
+                "group_license": group,
+                "attribution": attribution.name if attribution else None,
+                "attribution_description": attribution.descr if attribution else None,
+                "attribution_url": attribution.url if attribution else None,
+            }
+            self.datasets.append(dataset)
+            self.by_arkimet_id[ds.arkimet_id] = dataset
+
+    def get_obs_datasets(self, group_ids: Set[int]) -> List[str]:
+        return [
+            ds["arkimet_id"]
+            for ds in self.datasets
+            if ds["category"] == "OBS" and ds["group_license"].id in group_ids
+        ]
 
 
 class SqlApiDbManager:
+
+    # datasets catalog shared by all the requests of the process
+    _catalog: Optional[DatasetCatalog] = None
+    _catalog_expiration = 0.0
+    _catalog_lock = threading.Lock()
+
     @staticmethod
     def check_fileoutput(user: User, filename: str) -> Path:
 
@@ -160,11 +230,16 @@ def create_schedule_record(db, user, product_name, args, **schedule_settings):
         return s.id
 
     @staticmethod
-    def create_fileoutput_record(db, user_id, request_id, filename, data_size):
+    def create_fileoutput_record(
+        db, user_id, request_id, filename, data_size, opendata=False
+    ):
         f = db.FileOutput(
             user_id=user_id, request_id=request_id, filename=filename, size=data_size
         )
         db.session.add(f)
+        # opendata files are not stored in the user folder
+        if not opendata:
+            UsageLedger.add(db, user_id, data_size)
         db.session.commit()
         log.info("fileoutput for request ID <{}>", request_id)
 
@@ -181,10 +256,14 @@ def delete_request_record(db, user, request_id):
             try:
                 filepath = file_dir.joinpath(out_file.filename)
                 filepath.unlink()
-                db.session.delete(out_file)
             except FileNotFoundError as error:
                 # silently pass when file is not found
                 log.warning(error)
+            # the file is gone anyway: its record and its size are removed too,
+            # so that the ledger stays aligned with the records (see reconcile)
+            if not out_file.request.opendata:
+                UsageLedger.remove(db, out_file.user_id, out_file.size or 0)
+            db.session.delete(out_file)
         # db.session.delete(request)
         db.session.commit()
 
@@ -478,77 +557,126 @@ def _get_schedule_response(schedule):
             resp["period"] = schedule.period.name
         return resp
 
+    @staticmethod
+    def get_dataset_catalog(db):
+        catalog = SqlApiDbManager._catalog
+        if catalog is None or SqlApiDbManager._catalog_expiration < time.monotonic():
+            with SqlApiDbManager._catalog_lock:
+                catalog = SqlApiDbManager._catalog
+                if (
+                    catalog is None
+                    or SqlApiDbManager._catalog_expiration < time.monotonic()
+                ):
+                    rows = (
+                        db.session.query(
+                            db.Datasets, db.License, db.GroupLicense, db.Attribution
+                        )
+                        .join(db.License, db.Datasets.license_id == db.License.id)
+                        .join(
+                            db.GroupLicense,
+                            db.License.group_license_id == db.GroupLicense.id,
+                        )
+                        .outerjoin(
+                            db.Attribution,
+                            db.Datasets.attribution_id == db.Attribution.id,
+                        )
+                        .order_by(db.Datasets.id)
+                        .all()
+                    )
+                    catalog = DatasetCatalog(rows)
+                    SqlApiDbManager._catalog = catalog
+                    SqlApiDbManager._catalog_expiration = (
+                        time.monotonic() + DATASET_CATALOG_TTL
+                    )
+        return catalog
+
+    @staticmethod
+    def invalidate_dataset_catalog():
+        with SqlApiDbManager._catalog_lock:
+            SqlApiDbManager._catalog = None
+
+    @staticmethod
+    def get_user_authorized_datasets(db, user):
+        """
+        Names and arkimet ids of the datasets explicitly authorized to the user.
+        They are read once and stored in the user object of the current request
+        """
+        authorized = getattr(user, "_authorized_datasets", None)
+        if authorized is None:
+            rows = (
+                db.session.query(db.Datasets.name, db.Datasets.arkimet_id)
+                .filter(db.Datasets.users.any(id=user.id))
+                .all()
+            )
+            authorized = (
+                {name for name, _ in rows},
+                {arkimet_id for _, arkimet_id in rows},
+            )
+            user._authorized_datasets = authorized
+        return authorized
+
     @staticmethod
     def get_datasets(db, user, category=None, licenceSpecs=False, group_license=None):
-        # get all datasets
-        ds_objects = db.Datasets.query.filter_by().all()
+        catalog = SqlApiDbManager.get_dataset_catalog(db)
+        user_datasets_auth: Set[str] = set()
+        if user:
+            # get user authorized datasets
+            user_datasets_auth = SqlApiDbManager.get_user_authorized_datasets(db, user)[
+                0
+            ]
         datasets = []
-        for ds in ds_objects:
+        for ds in catalog.datasets:
             dataset_el = {}
             if category:
-                if ds.category.name != category:
+                if ds["category"] != category:
                     continue
-            # get license
-            license = db.License.query.filter_by(id=ds.license_id).first()
-            # get license group
-            group_license_obj = db.GroupLicense.query.filter_by(
-                id=license.group_license_id
-            ).first()
+            group_license_obj = ds["group_license"]
             if group_license:
                 if group_license_obj.name != group_license:
                     continue
             if user:
-                # get user authorized datasets
-                user_datasets_auth = [ds.name for ds in user.datasets]
-                open_dataset = user.open_dataset
                 # check the authorization
                 if not group_license_obj.is_public:
                     # looking for exception: check the authorized datasets
-                    if ds.name not in user_datasets_auth:
+                    if ds["name"] not in user_datasets_auth:
                         continue
                 # check if the user want to see also open dataset
                 else:
-                    if not open_dataset:
+                    if not user.open_dataset:
                         continue
             else:
                 # discard the not public datasets
                 if not group_license_obj.is_public:
                     continue
 
-            dataset_el["id"] = ds.arkimet_id
-            dataset_el["name"] = ds.name
-            dataset_el["description"] = ds.description
-            dataset_el["category"] = ds.category.name
-            dataset_el["format"] = ds.fileformat
-            dataset_el["bounding"] = ds.bounding
-            dataset_el["sort_index"] = ds.sort_index
+            dataset_el["id"] = ds["arkimet_id"]
+            dataset_el["name"] = ds["name"]
+            dataset_el["description"] = ds["description"]
+            dataset_el["category"] = ds["category"]
+            dataset_el["format"] = ds["fileformat"]
+            dataset_el["bounding"] = ds["bounding"]
+            dataset_el["sort_index"] = ds["sort_index"]
             dataset_el["is_public"] = group_license_obj.is_public
 
             if licenceSpecs:
-                attribution = db.Attribution.query.filter_by(
-                    id=ds.attribution_id
-                ).first()
-                dataset_el["license"] = license.name
-                dataset_el["license_description"] = license.descr
-                dataset_el["license_url"] = license.url
+                dataset_el["license"] = ds["license"]
+                dataset_el["license_description"] = ds["license_description"]
+                dataset_el["license_url"] = ds["license_url"]
                 dataset_el["group_license"] = group_license_obj.name
                 dataset_el["group_license_description"] = group_license_obj.descr
-                dataset_el["attribution"] = attribution.name
-                dataset_el["attribution_description"] = attribution.descr
-                dataset_el["attribution_url"] = attribution.url
+                dataset_el["attribution"] = ds["attribution"]
+                dataset_el["attribution_description"] = ds["attribution_description"]
+                dataset_el["attribution_url"] = ds["attribution_url"]
             datasets.append(dataset_el)
 
         return datasets
 
     @staticmethod
     def get_license_group(db, datasets):
-        license_group: Optional[Any] = None
+        catalog = SqlApiDbManager.get_dataset_catalog(db)
+        license_group: Optional[LicenseGroupEntry] = None
         for d in datasets:
-            ds = db.Datasets.query.filter_by(arkimet_id=d).first()
-            license = db.License.query.filter_by(id=ds.license_id).first()
-            group_license = db.GroupLicense.query.filter_by(
-                id=license.group_license_id
-            ).first()
+            group_license = catalog.by_arkimet_id[d]["group_license"]
             if not license_group:
                 license_group = group_license
             elif license_group.id != group_license.id:
@@ -558,84 +686,70 @@ def get_license_group(db, datasets):
 
     @staticmethod
     def check_dataset_authorization(db, dataset_name, user):
-        ds_object = db.Datasets.query.filter_by(arkimet_id=dataset_name).first()
-        if not ds_object:
+        catalog = SqlApiDbManager.get_dataset_catalog(db)
+        ds = catalog.by_arkimet_id.get(dataset_name)
+        if not ds:
             raise NotFound(
                 f"Dataset with the following arkimet id {dataset_name} not found"
             )
-        license = db.License.query.filter_by(id=ds_object.license_id).first()
-        group_license = db.GroupLicense.query.filter_by(
-            id=license.group_license_id
-        ).first()
-        if group_license.is_public:
+        if ds["group_license"].is_public:
             # open dataset
             return True
         else:
             if not user:
                 # anonymous user and private dataset
                 return False
-            user_datasets_auth = [ds.arkimet_id for ds in user.datasets]
-            if dataset_name in user_datasets_auth:
-                return True
-            else:
-                return False
+            user_datasets_auth = SqlApiDbManager.get_user_authorized_datasets(db, user)[
+                1
+            ]
+            return dataset_name in user_datasets_auth
 
     @staticmethod
     def retrieve_dataset_by_dsn(db, dsn_name):
-        license_groups = db.GroupLicense.query.filter_by(dballe_dsn=dsn_name).all()
-        datasets_names = []
-        for lg in license_groups:
-            # get all licenses
-            licenses = lg.license.all()
-            for lic in licenses:
-                datasets = lic.datasets.all()
-                for d in datasets:
-                    if d.category.name == "OBS":
-                        datasets_names.append(d.arkimet_id)
-        return datasets_names
+        catalog = SqlApiDbManager.get_dataset_catalog(db)
+        group_ids = {
+            lg.id for lg in catalog.license_groups.values() if lg.dballe_dsn == dsn_name
+        }
+        return catalog.get_obs_datasets(group_ids)
 
     @staticmethod
     def retrieve_dataset_by_license_group(db, group_license_name):
         # function used for observed data
-        license_group = db.GroupLicense.query.filter_by(name=group_license_name).first()
-        datasets_names = []
-        # get all licenses
-        licenses = license_group.license.all()
-        for lic in licenses:
-            datasets = lic.datasets.all()
-            for d in datasets:
-                if d.category.name == "OBS":
-                    datasets_names.append(d.arkimet_id)
-        return datasets_names
+        catalog = SqlApiDbManager.get_dataset_catalog(db)
+        license_group = catalog.license_groups_by_name.get(group_license_name)
+        if not license_group:
+            return []
+        return catalog.get_obs_datasets({license_group.id})
 
     @staticmethod
     def get_all_user_authorized_license_groups(db, user):
+        catalog = SqlApiDbManager.get_dataset_catalog(db)
+        user_datasets_auth: Set[str] = set()
+        if user:
+            # get all authorized datasets
+            user_datasets_auth = SqlApiDbManager.get_user_authorized_datasets(db, user)[
+                0
+            ]
         auth_license_groups = []
-        all_license_groups = db.GroupLicense.query.filter_by().all()
-        for lg in all_license_groups:
+        for lg in sorted(catalog.license_groups.values()):
             if lg.is_public:
                 # check if user want to see also opendata datasets
                 if user and not user.open_dataset:
                     continue
-                else:
-                    ds_per_license_group = (
-                        SqlApiDbManager.retrieve_dataset_by_license_group(db, lg.name)
-                    )
-                    if ds_per_license_group:
-                        auth_license_groups.append(lg.name)
+                if catalog.get_obs_datasets({lg.id}):
+                    auth_license_groups.append(lg.name)
             else:
                 if not user:
                     # to see private dataset the user has to be logged
                     continue
-                else:
-                    # get all authorized datasets
-                    user_datasets_auth = [ds.name for ds in user.datasets]
-                    # get all license group datasets
-                    lg_dataset_list = SqlApiDbManager.retrieve_dataset_by_license_group(
-                        db, lg.name
-                    )
-                    if any(item in user_datasets_auth for item in lg_dataset_list):
-                        auth_license_groups.append(lg.name)
+                # get all license group datasets
+                lg_dataset_list = [
+                    ds["name"]
+                    for ds in catalog.datasets
+                    if ds["category"] == "OBS" and ds["group_license"].id == lg.id
+                ]
+                if any(item in user_datasets_auth for item in lg_dataset_list):
+                    auth_license_groups.append(lg.name)
         return auth_license_groups
 
     @staticmethod
@@ -0,0 +1,90 @@
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from restapi.env import Env
+from restapi.utilities.logs import log
+
+# seconds the station details read from a dsn are kept in memory
+STATION_DETAILS_TTL = Env.get_int("STATION_DETAILS_TTL", 3600)
+# station name, the only detail returned in the maps of many stations
+STATION_NAME_VARCODE = "B01019"
+
+StationKey = Tuple[Any, ...]
+StationDetails = Dict[StationKey, List[Dict[str, Any]]]
+
+
+class StationDetailsCache:
+    """
+    Station details (station data of dballe) of a whole network, read with
+    a single query and grouped by station. Details read from a dsn are kept
+    for STATION_DETAILS_TTL seconds, as station metadata rarely change
+    """
+
+    _entries: Dict[Tuple[Any, ...], Tuple[float, StationDetails]] = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def get_station_key(rec: Any) -> StationKey:
+        # stations are identified as in the maps response
+        if rec["ident"]:
+            return (rec["ident"], rec["rep_memo"])
+        return (float(rec["lat"]), float(rec["lon"]), rec["rep_memo"])
+
+    @staticmethod
+    def get_details_query(query: Dict[str, Any], all_details: bool) -> Dict[str, Any]:
+        details_query = {}
+        if "rep_memo" in query:
+            details_query["rep_memo"] = query["rep_memo"]
+        if all_details:
+            # a single station is requested: all its details are returned
+            for key in ("ident", "lat", "lon"):
+                if key in query:
+                    details_query[key] = query[key]
+        else:
+            details_query["var"] = STATION_NAME_VARCODE
+        return details_query
+
+    @staticmethod
+    def load_details(tr: Any, details_query: Dict[str, Any]) -> StationDetails:
+        details: StationDetails = {}
+        for el in tr.query_station_data(details_query):
+            var = el["variable"]
+            station_details = details.setdefault(
+                StationDetailsCache.get_station_key(el), []
+            )
+            station_details.append({"var": var.code, "val": var.get()})
+        return details
+
+    @classmethod
+    def get_details(
+        cls,
+        tr: Any,
+        query: Dict[str, Any],
+        all_details: bool = False,
+        dsn: Optional[str] = None,
+    ) -> StationDetails:
+        """
+        Get the details of all the stations matching the query.
+        Details are cached only if they come from a dsn (and not from a temporary db)
+        """
+        details_query = cls.get_details_query(query, all_details)
+        if not dsn or STATION_DETAILS_TTL <= 0:
+            return cls.load_details(tr, details_query)
+
+        key = (dsn, tuple(sorted(details_query.items())))
+        with cls._lock:
+            cached = cls._entries.get(key)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+
+        details = cls.load_details(tr, details_query)
+        log.debug("details of {} stations loaded for {}", len(details), key)
+        with cls._lock:
+            cls._entries[key] = (time.monotonic() + STATION_DETAILS_TTL, details)
+        return details
+
+    @classmethod
+    def clear(cls) -> None:
+        with cls._lock:
+            cls._entries.clear()
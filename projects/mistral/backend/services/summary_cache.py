@@ -0,0 +1,139 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from restapi.env import Env
+from restapi.utilities.logs import log
+
+# seconds a cached summary is considered valid (0 disables the cache)
+SUMMARY_CACHE_TTL = Env.get_int("FIELDS_SUMMARY_CACHE_TTL", 600)
+SUMMARY_CACHE_SIZE = Env.get_int("FIELDS_SUMMARY_CACHE_SIZE", 256)
+# invalidation stamps are shared by all the processes through the data volume
+SUMMARY_STAMPS_DIR = Path(Env.get("DATA_PATH", "/data"), ".summary_cache")
+
+CacheKey = Tuple[Tuple[str, ...], str]
+Stamps = Tuple[Optional[int], ...]
+
+
+class SummaryCache:
+    """
+    Process-wide cache of the arkimet summaries of the forecast datasets.
+    An entry expires after SUMMARY_CACHE_TTL seconds or as soon as one of its
+    datasets is notified as updated (see invalidate)
+    """
+
+    # key -> (expiration, dataset stamps, serialized summary)
+    _entries: "OrderedDict[CacheKey, Tuple[float, Stamps, str]]" = OrderedDict()
+    _lock = threading.Lock()
+    _stats: Dict[str, int] = {
+        "hits": 0,
+        "misses": 0,
+        "expired": 0,
+        "invalidated": 0,
+        "evicted": 0,
+    }
+
+    @staticmethod
+    def normalize_query(query: Optional[str]) -> str:
+        # the order of the matchers does not change the arkimet query
+        if not query:
+            return ""
+        matchers = [m.strip() for m in query.split(";")]
+        return "; ".join(sorted(m for m in matchers if m))
+
+    @staticmethod
+    def get_key(datasets: List[str], query: Optional[str]) -> CacheKey:
+        return tuple(sorted(set(datasets))), SummaryCache.normalize_query(query)
+
+    @staticmethod
+    def get_stamp_path(dataset: str) -> Path:
+        return SUMMARY_STAMPS_DIR.joinpath(f"{dataset}.stamp")
+
+    @staticmethod
+    def get_stamps(datasets: Tuple[str, ...]) -> Stamps:
+        stamps = []
+        for dataset in datasets:
+            try:
+                stamps.append(os.stat(SummaryCache.get_stamp_path(dataset)).st_mtime_ns)
+            except FileNotFoundError:
+                stamps.append(None)
+        return tuple(stamps)
+
+    @classmethod
+    def _count(cls, stat: str) -> None:
+        with cls._lock:
+            cls._stats[stat] += 1
+
+    @classmethod
+    def get(cls, key: CacheKey) -> Optional[Any]:
+        if SUMMARY_CACHE_TTL <= 0:
+            return None
+        with cls._lock:
+            cached = cls._entries.get(key)
+        if cached is None:
+            cls._count("misses")
+            return None
+
+        expiration, stamps, summary = cached
+        if expiration < time.monotonic():
+            cls._count("expired")
+        elif stamps != cls.get_stamps(key[0]):
+            cls._count("invalidated")
+        else:
+            with cls._lock:
+                if key in cls._entries:
+                    cls._entries.move_to_end(key)
+                cls._stats["hits"] += 1
+            # every caller gets its own copy, since the endpoints modify the summary
+            return json.loads(summary)
+
+        with cls._lock:
+            cls._entries.pop(key, None)
+            cls._stats["misses"] += 1
+        return None
+
+    @classmethod
+    def set(cls, key: CacheKey, summary: Any) -> None:
+        if SUMMARY_CACHE_TTL <= 0:
+            return
+        # stamps are read before storing, so that a concurrent invalidation is not lost
+        stamps = cls.get_stamps(key[0])
+        entry = (time.monotonic() + SUMMARY_CACHE_TTL, stamps, json.dumps(summary))
+        with cls._lock:
+            cls._entries[key] = entry
+            cls._entries.move_to_end(key)
+            while len(cls._entries) > SUMMARY_CACHE_SIZE:
+                cls._entries.popitem(last=False)
+                cls._stats["evicted"] += 1
+
+    @staticmethod
+    def invalidate(dataset: str) -> None:
+        """
+        Notify all the processes that the summaries of the dataset are outdated
+        """
+        stamp = SummaryCache.get_stamp_path(dataset)
+        try:
+            stamp.parent.mkdir(parents=True, exist_ok=True)
+            stamp.write_text(str(time.time()))
+        except OSError as exc:
+            log.warning("Unable to invalidate the summaries of {}: {}", dataset, exc)
+            return
+        log.debug("cached summaries of {} invalidated", dataset)
+
+    @classmethod
+    def get_stats(cls) -> Dict[str, int]:
+        with cls._lock:
+            stats = dict(cls._stats)
+            stats["entries"] = len(cls._entries)
+        stats["ttl"] = SUMMARY_CACHE_TTL
+        stats["max_entries"] = SUMMARY_CACHE_SIZE
+        return stats
+
+    @classmethod
+    def clear(cls) -> None:
+        with cls._lock:
+            cls._entries.clear()
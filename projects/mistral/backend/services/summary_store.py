@@ -0,0 +1,385 @@
+import os
+import sqlite3
+from datetime import datetime
+from decimal import Decimal
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+import dballe
+from restapi.utilities.logs import log
+
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+SCHEMA = """
+CREATE TABLE summary (
+    rep_memo TEXT NOT NULL,
+    lat INTEGER NOT NULL,
+    lon INTEGER NOT NULL,
+    ident TEXT,
+    var TEXT NOT NULL,
+    ltype1 INTEGER,
+    l1 INTEGER,
+    ltype2 INTEGER,
+    l2 INTEGER,
+    pind INTEGER,
+    p1 INTEGER,
+    p2 INTEGER,
+    datetimemin TEXT NOT NULL,
+    datetimemax TEXT NOT NULL,
+    count INTEGER NOT NULL
+);
+CREATE INDEX summary_network ON summary (rep_memo, var);
+CREATE INDEX summary_var ON summary (var);
+CREATE INDEX summary_level ON summary (ltype1, l1, ltype2, l2);
+CREATE INDEX summary_trange ON summary (pind, p1, p2);
+CREATE INDEX summary_station ON summary (lat, lon, rep_memo);
+"""
+
+STATION_COLUMNS = ("rep_memo", "lat", "lon", "ident")
+LEVEL_COLUMNS = ("ltype1", "l1", "ltype2", "l2")
+TRANGE_COLUMNS = ("pind", "p1", "p2")
+DATA_COLUMNS = ("var",) + LEVEL_COLUMNS + TRANGE_COLUMNS
+# query keys translated in sql: the other ones (e.g. ana_id) are answered by the explorer
+QUERY_KEYS = (
+    "rep_memo",
+    "report",
+    "var",
+    "varlist",
+    "level",
+    "trange",
+    "datetimemin",
+    "datetimemax",
+    "latmin",
+    "lonmin",
+    "latmax",
+    "lonmax",
+    "lat",
+    "lon",
+    "ident",
+)
+
+
+def to_int_coord(value: Union[str, float, Decimal]) -> int:
+    # coordinates are stored as integers, as in dballe (5 decimal digits)
+    return int(round(float(value) * 100000))
+
+
+def to_db_datetime(value: Union[str, datetime]) -> str:
+    if isinstance(value, datetime):
+        return value.strftime(DATETIME_FORMAT)
+    return datetime.fromisoformat(str(value)).strftime(DATETIME_FORMAT)
+
+
+class SummaryStoreView:
+    """
+    Read-only view on one or more sqlite summaries, answering the same
+    calls BeDballe does on a DBExplorer with indexed queries.
+    Queries with keys the store can not translate are answered by the
+    explorer view built by fallback. The stations have no ana_id, as the store
+    does not know the station ids of the databases
+    """
+
+    def __init__(
+        self, paths: List[Path], fallback: Optional[Callable[[], Any]] = None
+    ) -> None:
+        self._paths = paths
+        self._filter: Dict[str, Any] = {}
+        self._conn: Optional[sqlite3.Connection] = None
+        self._fallback = fallback
+        self._fallback_view: Any = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(
+                f"file:{self._paths[0]}?mode=ro", uri=True, check_same_thread=False
+            )
+            for i, path in enumerate(self._paths[1:], start=1):
+                conn.execute(f"ATTACH DATABASE ? AS db{i}", (f"file:{path}?mode=ro",))
+            self._conn = conn
+        return self._conn
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def __enter__(self) -> "SummaryStoreView":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def __del__(self) -> None:
+        self.close()
+
+    @property
+    def source(self) -> str:
+        if len(self._paths) == 1:
+            return "summary"
+        # summaries of different db types (mixed case) are queried together
+        tables = ["SELECT * FROM main.summary"]
+        tables.extend(
+            f"SELECT * FROM db{i}.summary" for i in range(1, len(self._paths))
+        )
+        return "({}) AS summary".format(" UNION ALL ".join(tables))
+
+    def set_filter(self, query: Dict[str, Any]) -> None:
+        self._filter = dict(query)
+
+    @staticmethod
+    def is_supported(query: Dict[str, Any]) -> bool:
+        return all(v is None or k in QUERY_KEYS for k, v in query.items())
+
+    def get_fallback(self) -> Any:
+        if self._fallback is None:
+            raise ValueError("Query not supported by the summary store")
+        if self._fallback_view is None:
+            log.debug("summary query not supported by the store: using the explorer")
+            self._fallback_view = self._fallback()
+        self._fallback_view.set_filter(self._filter)
+        return self._fallback_view
+
+    def _where(self, query: Dict[str, Any]) -> Tuple[List[str], List[Any]]:
+        clauses: List[str] = []
+        args: List[Any] = []
+        for key, value in query.items():
+            if value is None:
+                continue
+            if key in ("rep_memo", "report"):
+                clauses.append("rep_memo = ?")
+                args.append(value)
+            elif key == "var":
+                clauses.append("var = ?")
+                args.append(value)
+            elif key == "varlist":
+                if isinstance(value, str):
+                    value = value.split(",")
+                clauses.append("var IN ({})".format(",".join("?" * len(value))))
+                args.extend(value)
+            elif key in ("level", "trange"):
+                columns = LEVEL_COLUMNS if key == "level" else TRANGE_COLUMNS
+                if isinstance(value, dballe.Level):
+                    value = (value.ltype1, value.l1, value.ltype2, value.l2)
+                elif isinstance(value, dballe.Trange):
+                    value = (value.pind, value.p1, value.p2)
+                # missing values in the query do not constrain the result
+                for col, v in zip(columns, value):
+                    if v is not None:
+                        clauses.append(f"{col} = ?")
+                        args.append(v)
+            elif key == "datetimemin":
+                # as in the explorer, the data interval has only to overlap the requested one
+                clauses.append("datetimemax >= ?")
+                args.append(to_db_datetime(value))
+            elif key == "datetimemax":
+                clauses.append("datetimemin <= ?")
+                args.append(to_db_datetime(value))
+            elif key in ("latmin", "lonmin"):
+                clauses.append(f"{key[:3]} >= ?")
+                args.append(to_int_coord(value))
+            elif key in ("latmax", "lonmax"):
+                clauses.append(f"{key[:3]} <= ?")
+                args.append(to_int_coord(value))
+            elif key in ("lat", "lon"):
+                clauses.append(f"{key} = ?")
+                args.append(to_int_coord(value))
+            elif key == "ident":
+                clauses.append("ident = ?")
+                args.append(value)
+            else:
+                # a wider result than the explorer one would be silently wrong
+                raise ValueError(f"Unsupported summary query key: {key}")
+        return clauses, args
+
+    def _select(
+        self,
+        columns: Tuple[str, ...],
+        query: Optional[Dict[str, Any]] = None,
+        use_filter: bool = True,
+    ) -> List[Tuple[Any, ...]]:
+        clauses, args = self._where(self._filter) if use_filter else ([], [])
+        if query:
+            query_clauses, query_args = self._where(query)
+            clauses.extend(query_clauses)
+            args.extend(query_args)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        # null values are sorted last, as missing values in dballe
+        order = ", ".join(f"{c} IS NULL, {c}" for c in columns)
+        sql = "SELECT DISTINCT {} FROM {}{} ORDER BY {}".format(
+            ", ".join(columns), self.source, where, order
+        )
+        return self.conn.execute(sql, args).fetchall()
+
+    @property
+    def varcodes(self) -> List[str]:
+        if not self.is_supported(self._filter):
+            return self.get_fallback().varcodes
+        return [r[0] for r in self._select(("var",))]
+
+    @property
+    def levels(self) -> List[dballe.Level]:
+        if not self.is_supported(self._filter):
+            return self.get_fallback().levels
+        return [dballe.Level(*r) for r in self._select(LEVEL_COLUMNS)]
+
+    @property
+    def tranges(self) -> List[dballe.Trange]:
+        if not self.is_supported(self._filter):
+            return self.get_fallback().tranges
+        return [dballe.Trange(*r) for r in self._select(TRANGE_COLUMNS)]
+
+    @property
+    def reports(self) -> List[str]:
+        if not self.is_supported(self._filter):
+            return self.get_fallback().reports
+        return [r[0] for r in self._select(("rep_memo",))]
+
+    @property
+    def all_reports(self) -> List[str]:
+        return [r[0] for r in self._select(("rep_memo",), use_filter=False)]
+
+    def _query_summary(
+        self, query: Dict[str, Any], use_filter: bool
+    ) -> List[Dict[str, Any]]:
+        clauses, args = self._where(self._filter) if use_filter else ([], [])
+        query_clauses, query_args = self._where(query)
+        clauses.extend(query_clauses)
+        args.extend(query_args)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        key_columns = ", ".join(STATION_COLUMNS + DATA_COLUMNS)
+        if len(self._paths) == 1:
+            sql = "SELECT {}, datetimemin, datetimemax, count FROM {}{}".format(
+                key_columns, self.source, where
+            )
+        else:
+            # the same data can be in more summaries: merge them as the explorer does
+            sql = (
+                "SELECT {cols}, MIN(datetimemin), MAX(datetimemax), SUM(count) "
+                "FROM {source}{where} GROUP BY {cols}"
+            ).format(cols=key_columns, source=self.source, where=where)
+
+        res = []
+        for row in self.conn.execute(sql, args):
+            rep_memo, lat, lon, ident, var = row[:5]
+            ltype1, l1, ltype2, l2, pind, p1, p2 = row[5:12]
+            datetimemin, datetimemax, count = row[12:]
+            res.append(
+                {
+                    "rep_memo": rep_memo,
+                    "ident": ident,
+                    "lat": Decimal(lat).scaleb(-5),
+                    "lon": Decimal(lon).scaleb(-5),
+                    "var": var,
+                    "level": dballe.Level(ltype1, l1, ltype2, l2),
+                    "trange": dballe.Trange(pind, p1, p2),
+                    "leveltype1": ltype1,
+                    "l1": l1,
+                    "leveltype2": ltype2,
+                    "l2": l2,
+                    "pindicator": pind,
+                    "p1": p1,
+                    "p2": p2,
+                    "datetimemin": datetime.strptime(datetimemin, DATETIME_FORMAT),
+                    "datetimemax": datetime.strptime(datetimemax, DATETIME_FORMAT),
+                    "count": count,
+                }
+            )
+        return res
+
+    def query_summary(self, query: Dict[str, Any]) -> List[Dict[str, Any]]:
+        if not self.is_supported(self._filter) or not self.is_supported(query):
+            return self.get_fallback().query_summary(query)
+        return self._query_summary(query, use_filter=True)
+
+    def query_summary_all(self, query: Dict[str, Any]) -> List[Dict[str, Any]]:
+        if not self.is_supported(query):
+            return self.get_fallback().query_summary_all(query)
+        return self._query_summary(query, use_filter=False)
+
+
+class SummaryStore:
+    """
+    Indexed sqlite copy of the json summaries of the observed data.
+    The store lives next to its json file, with the .sqlite extension
+    """
+
+    @staticmethod
+    def get_store_path(json_summary: Union[str, Path]) -> Path:
+        return Path(json_summary).with_suffix(".sqlite")
+
+    @staticmethod
+    def get_view(
+        paths: List[Path], fallback: Optional[Callable[[], Any]] = None
+    ) -> SummaryStoreView:
+        return SummaryStoreView(paths, fallback=fallback)
+
+    @staticmethod
+    def write_from_explorer(explorer: dballe.DBExplorer, path: Path) -> int:
+        # the store is written to a temporary file and then moved,
+        # so that readers always find a complete store
+        tmp_path = Path(f"{path}.tmp")
+        if tmp_path.exists():
+            tmp_path.unlink()
+        conn = sqlite3.connect(tmp_path)
+        total_count = 0
+        try:
+            conn.executescript(SCHEMA)
+            rows = []
+            for cur in explorer.query_summary_all({}):
+                rows.append(
+                    (
+                        cur["rep_memo"],
+                        to_int_coord(cur["lat"]),
+                        to_int_coord(cur["lon"]),
+                        cur["ident"],
+                        cur["var"],
+                        cur["leveltype1"],
+                        cur["l1"],
+                        cur["leveltype2"],
+                        cur["l2"],
+                        cur["pindicator"],
+                        cur["p1"],
+                        cur["p2"],
+                        to_db_datetime(cur["datetimemin"]),
+                        to_db_datetime(cur["datetimemax"]),
+                        cur["count"],
+                    )
+                )
+                total_count += cur["count"]
+            conn.executemany(
+                "INSERT INTO summary VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)", rows
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        os.replace(tmp_path, path)
+        return total_count
+
+    @staticmethod
+    def convert_json(
+        json_summary: Union[str, Path], path: Optional[Path] = None
+    ) -> Path:
+        json_summary = Path(json_summary)
+        if not path:
+            path = SummaryStore.get_store_path(json_summary)
+        explorer = dballe.DBExplorer()
+        with explorer.update() as updater:
+            with open(json_summary) as fd:
+                updater.add_json(fd.read())
+        total_count = SummaryStore.write_from_explorer(explorer, path)
+        log.info("{} converted in {}: {} data", json_summary, path, total_count)
+        return path
+
+    @staticmethod
+    def sync(
+        json_summary: Union[str, Path], explorer: Optional[dballe.DBExplorer] = None
+    ) -> None:
+        # stores are updated only for the summaries already migrated
+        path = SummaryStore.get_store_path(json_summary)
+        if not path.exists():
+            return
+        if explorer is None:
+            SummaryStore.convert_json(json_summary, path)
+        else:
+            SummaryStore.write_from_explorer(explorer, path)
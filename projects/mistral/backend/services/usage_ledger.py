@@ -0,0 +1,106 @@
+import os
+from pathlib import Path
+from typing import Any, Iterable, Tuple
+
+from mistral.endpoints import DOWNLOAD_DIR
+from restapi.utilities.logs import log
+
+
+class UsageLedger:
+    """
+    Disk space used by every user, stored in the used_quota column of the user table.
+    It is the size of the output files registered in the db (opendata files excluded)
+    plus the size of the uploaded templates. The ledger is updated when files are added
+    or removed and periodically realigned (see reconcile)
+    """
+
+    @staticmethod
+    def add(db: Any, user_id: int, size: int) -> None:
+        # the increment is done by the database, so that concurrent tasks do not
+        # overwrite each other. Changes are committed by the caller
+        if not size:
+            return
+        db.session.query(db.User).filter_by(id=user_id).update(
+            {db.User.used_quota: db.func.coalesce(db.User.used_quota, 0) + size},
+            synchronize_session=False,
+        )
+
+    @staticmethod
+    def remove(db: Any, user_id: int, size: int) -> None:
+        UsageLedger.add(db, user_id, -size)
+
+    @staticmethod
+    def get_usage(db: Any, user_id: int) -> Tuple[int, int]:
+        """
+        Return the used space and the disk quota of the user
+        """
+        used_quota, disk_quota = (
+            db.session.query(db.User.used_quota, db.User.disk_quota)
+            .filter_by(id=user_id)
+            .one()
+        )
+        return max(used_quota or 0, 0), disk_quota
+
+    @staticmethod
+    def get_files_size(files: Iterable[Path]) -> int:
+        size = 0
+        for f in files:
+            try:
+                size += f.stat().st_size
+            except FileNotFoundError:
+                pass
+        return size
+
+    @staticmethod
+    def get_dir_size(path: Path) -> int:
+        size = 0
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            size += UsageLedger.get_dir_size(Path(entry.path))
+                        else:
+                            size += entry.stat(follow_symlinks=False).st_size
+                    except FileNotFoundError:
+                        # file deleted during the scan
+                        continue
+        except FileNotFoundError:
+            pass
+        return size
+
+    @staticmethod
+    def reconcile(db: Any, user: Any) -> int:
+        """
+        Realign the ledger of the user with the db records and the uploaded files
+        """
+        # the user row is locked, so that no update is lost during the scan
+        previous = (
+            db.session.query(db.User.used_quota)
+            .filter_by(id=user.id)
+            .with_for_update()
+            .scalar()
+        )
+        outputs_size = (
+            db.session.query(db.func.coalesce(db.func.sum(db.FileOutput.size), 0))
+            .join(db.Request, db.FileOutput.request_id == db.Request.id)
+            .filter(db.FileOutput.user_id == user.id)
+            .filter(db.Request.opendata.isnot(True))
+            .scalar()
+        )
+        uploads_size = UsageLedger.get_dir_size(
+            DOWNLOAD_DIR.joinpath(user.uuid, "uploads")
+        )
+        used_quota = int(outputs_size) + uploads_size
+        if previous != used_quota:
+            log.info(
+                "Used space of user {} realigned: {} -> {}",
+                user.id,
+                previous,
+                used_quota,
+            )
+            db.session.query(db.User).filter_by(id=user.id).update(
+                {db.User.used_quota: used_quota}, synchronize_session=False
+            )
+        db.session.commit()
+        return used_quota
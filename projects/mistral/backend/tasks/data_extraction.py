@@ -1,5 +1,6 @@
 import datetime
 import json
+import resource
 import subprocess
 import tarfile
 import time
@@ -23,10 +24,11 @@
 from mistral.services.arkimet import BeArkimet as arki
 from mistral.services.dballe import BeDballe as dballe
 from mistral.services.sqlapi_db_manager import SqlApiDbManager
+from mistral.services.usage_ledger import UsageLedger
 from mistral.tools import derived_variables as pp1
 from mistral.tools import grid_cropping as pp3_2
 from mistral.tools import grid_interpolation as pp3_1
-from mistral.tools import output_formatting
+from mistral.tools import output_formatting, pipeline
 from mistral.tools import quality_check_filter as qc
 from mistral.tools import spare_point_interpol as pp3_3
 from mistral.tools import statistic_elaboration as pp2
@@ -59,6 +61,8 @@ def data_extract(
 ):
 
     log.info("Start task [{}:{}]", self.request.id, self.name)
+    # workers run many tasks: the peak memory is measured from the start of this one
+    reset_peak_rss()
     try:
         db = sqlalchemy.get_instance()
         data_size = 0
@@ -292,32 +296,42 @@ def data_extract(
                     fileformat=dataset_format,
                 )
 
-            if p := requested_postprocessors.get("grid_cropping"):
-
-                pp_output = pp3_2.pp_grid_cropping(
-                    params=p,
+            streamable = pipeline.get_streamable(requested_postprocessors)
+            if pipeline.POSTPROCESSORS_PIPELINE and len(streamable) > 1:
+                # the intermediate outputs are streamed without being written on disk
+                pp_output = pipeline.pp_pipeline(
+                    postprocessors=streamable,
                     input_file=pp_output or tmp_outfile,
                     output_folder=output_dir,
                     fileformat=dataset_format,
                 )
+            else:
+                if p := requested_postprocessors.get("grid_cropping"):
 
-            if p := requested_postprocessors.get("grid_interpolation"):
+                    pp_output = pp3_2.pp_grid_cropping(
+                        params=p,
+                        input_file=pp_output or tmp_outfile,
+                        output_folder=output_dir,
+                        fileformat=dataset_format,
+                    )
 
-                pp_output = pp3_1.pp_grid_interpolation(
-                    params=p,
-                    input_file=pp_output or tmp_outfile,
-                    output_folder=output_dir,
-                    fileformat=dataset_format,
-                )
+                if p := requested_postprocessors.get("grid_interpolation"):
 
-            if p := requested_postprocessors.get("spare_point_interpolation"):
+                    pp_output = pp3_1.pp_grid_interpolation(
+                        params=p,
+                        input_file=pp_output or tmp_outfile,
+                        output_folder=output_dir,
+                        fileformat=dataset_format,
+                    )
 
-                pp_output = pp3_3.pp_sp_interpolation(
-                    params=p,
-                    input_file=pp_output or tmp_outfile,
-                    output_folder=output_dir,
-                    fileformat=dataset_format,
-                )
+                if p := requested_postprocessors.get("spare_point_interpolation"):
+
+                    pp_output = pp3_3.pp_sp_interpolation(
+                        params=p,
+                        input_file=pp_output or tmp_outfile,
+                        output_folder=output_dir,
+                        fileformat=dataset_format,
+                    )
 
             # rename the final postprocessors output unless it is a bufr file
             if pp_output:
@@ -398,7 +412,7 @@ def data_extract(
             # when pushing data output to amqp queue
             # create fileoutput record in db
             SqlApiDbManager.create_fileoutput_record(
-                db, user_id, request_id, outfile.name, data_size
+                db, user_id, request_id, outfile.name, data_size, opendata=opendata
             )
         else:
             # remove the empty output file
@@ -433,6 +447,7 @@ def data_extract(
         # log.exception("Failed to extract data: {}", repr(exc))
         raise exc
     finally:
+        log.info("Task {} peak RSS: {}", self.request.id, human_size(get_peak_rss()))
         if not double_request:  # which means if the extraction hasn't been interrupted
             if output_dir:
                 # remove tmp files
@@ -519,19 +534,13 @@ def check_user_quota(
 
             raise MaxOutputSizeExceeded(message)
 
-        # check for current used space
-        used_quota = int(subprocess.check_output(["du", "-sb", user_dir]).split()[0])
-
-        # in case of extimation done after the data extraction, subtract the output file size from the user quota
-        if output_filename:
-            used_quota = used_quota - Path(user_dir, output_filename).stat().st_size
+        # check for current used space.
+        # The output file of an extraction is not in the ledger until its db record is created
+        used_quota, max_user_quota = UsageLedger.get_usage(db, user_id)
 
         log.info("Current used space: {} ({})", used_quota, human_size(used_quota))
 
         # check for exceeding quota
-        max_user_quota = (
-            db.session.query(db.User.disk_quota).filter_by(id=user_id).scalar()
-        )
         log.debug("MAX USER QUOTA for user<{}>: {}", user_id, max_user_quota)
         if used_quota + esti_data_size > max_user_quota:
             free_space = max(max_user_quota - used_quota, 0)
@@ -619,7 +628,7 @@ def observed_extraction(
                 fields.index("datetimemax")
             ][0]
             max_trange_interval: Optional[int] = None
-            if ["trange"] in fields:
+            if "trange" in fields:
                 req_trange_list = queries[fields.index("trange")]
                 for t in req_trange_list:
                     if not max_trange_interval:
@@ -748,6 +757,28 @@ def human_size(bytes, units=[" bytes", "KB", "MB", "GB", "TB", "PB", "EB"]):
     return str(bytes) + units[0] if bytes < 1024 else human_size(bytes >> 10, units[1:])
 
 
+def reset_peak_rss():
+    # reset the peak resident set size of the process (supported by linux >= 4.0)
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError as exc:
+        log.debug("Unable to reset the peak RSS: {}", exc)
+
+
+def get_peak_rss():
+    """Returns the peak resident set size of the process in bytes"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes and it is never reset
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
 def adapt_reftime(schedule, reftime):
     new_reftime = None
     if reftime is not None:
@@ -0,0 +1,24 @@
+from mistral.services.usage_ledger import UsageLedger
+from restapi.connectors import sqlalchemy
+from restapi.connectors.celery import CeleryExt, Task
+from restapi.utilities.logs import log
+
+
+@CeleryExt.task(idempotent=True)
+def usage_reconciliation(self: Task[[], str]) -> str:
+    log.info("Usage reconciliation task started!")
+
+    db = sqlalchemy.get_instance()
+    user_ids = [u_id for u_id, in db.session.query(db.User.id).all()]
+    for u_id in user_ids:
+        user = db.session.query(db.User).get(u_id)
+        if user is None:
+            continue
+        try:
+            UsageLedger.reconcile(db, user)
+        except Exception as exc:
+            db.session.rollback()
+            log.error("Unable to reconcile the used space of user {}: {}", u_id, exc)
+
+    log.info("Usage reconciliation task completed")
+    return "Usage reconciliation task completed"
@@ -0,0 +1,118 @@
+import os
+from datetime import date, datetime, timedelta
+
+import dballe
+from mistral.services import archive_cache
+from mistral.services.archive_cache import ArchiveDaysCache, ArchiveDB
+from mistral.services.dballe import BeDballe
+from restapi.tests import BaseTests
+
+
+def insert_data(db, lat: float, lon: float, day: datetime) -> None:
+    with db.transaction() as tr:
+        tr.insert_data(
+            {
+                "report": "agrmet",
+                "lat": lat,
+                "lon": lon,
+                "datetime": day,
+                "level": dballe.Level(103, 2000),
+                "trange": dballe.Trange(254, 0, 0),
+                "B12101": 280.0,
+            },
+            can_replace=True,
+            can_add_stations=True,
+        )
+
+
+def count_data(db) -> int:
+    with db.transaction() as tr:
+        return sum(1 for _ in tr.query_data({}))
+
+
+class TestArchiveCache(BaseTests):
+    def test_days(self) -> None:
+        days = ArchiveDaysCache.get_days(
+            datetime(2022, 12, 30, 18), datetime(2023, 1, 2, 6)
+        )
+        assert days == [
+            date(2022, 12, 30),
+            date(2022, 12, 31),
+            date(2023, 1, 1),
+            date(2023, 1, 2),
+        ]
+        # queries without a reftime interval are not served by the cache
+        assert ArchiveDaysCache.get_db(["agrmet"], None, datetime(2023, 1, 2)) is None
+
+    def test_recent_days(self, monkeypatch, tmp_path) -> None:
+        monkeypatch.setattr(archive_cache, "ARCHIVE_CACHE_DIR", tmp_path)
+        # the days still migrated from dballe are read from arkimet every time
+        now = datetime.utcnow()
+        datemin = now - timedelta(days=archive_cache.ARCHIVE_CACHE_RECENT_DAYS + 1)
+        assert ArchiveDaysCache.get_db(["agrmet"], datemin, now) is None
+        assert not list(tmp_path.iterdir())
+
+    def test_eviction(self, monkeypatch, tmp_path) -> None:
+        monkeypatch.setattr(archive_cache, "ARCHIVE_CACHE_DIR", tmp_path)
+        # 2 MB of cached days
+        monkeypatch.setattr(archive_cache, "ARCHIVE_CACHE_SIZE", 2)
+        paths = []
+        for i in range(4):
+            path = ArchiveDaysCache.get_day_path("agrmet", date(2023, 1, i + 1))
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(b"\0" * 1024 * 1024)
+            # the days are used from the oldest to the most recent
+            os.utime(path, (1000 + i, 1000 + i))
+            paths.append(path)
+
+        # the least recently used day is kept if still needed
+        ArchiveDaysCache.evict(keep={paths[0]})
+        assert [p.exists() for p in paths] == [True, False, False, True]
+
+    def test_download(self, tmp_path) -> None:
+        day = datetime(2023, 1, 1, 12)
+        path = tmp_path.joinpath("2023-01-01.sqlite")
+        insert_data(dballe.DB.connect(f"sqlite:{path}?wipe=1"), 44.5, 11.34, day)
+        dballe_db = dballe.DB.connect("mem:")
+        insert_data(dballe_db, 45.07, 7.68, day + timedelta(days=1))
+
+        # the data of dballe are merged in a temporary db for the mixed downloads
+        db, _ = BeDballe.merge_db_for_download(
+            dballe_db, {}, arki_db=ArchiveDB([path]), arki_query_data={}
+        )
+        assert not isinstance(db, ArchiveDB)
+        assert count_data(db) == 2
+        # the cached day is left untouched
+        assert count_data(ArchiveDB([path])) == 1
+
+    def test_decode_once(self, monkeypatch, tmp_path) -> None:
+        monkeypatch.setattr(archive_cache, "ARCHIVE_CACHE_DIR", tmp_path)
+        decoded = []
+
+        def fill_day(dataset: str, day: date, path) -> None:
+            decoded.append(day)
+            db = dballe.DB.connect(f"sqlite:{path}?wipe=1")
+            insert_data(db, 44.5, 11.34, datetime.combine(day, datetime.min.time()))
+
+        evictions = []
+        monkeypatch.setattr(ArchiveDaysCache, "fill_day", staticmethod(fill_day))
+        monkeypatch.setattr(
+            ArchiveDaysCache,
+            "evict",
+            classmethod(lambda cls, keep: evictions.append(keep)),
+        )
+        datemin, datemax = datetime(2023, 1, 1), datetime(2023, 1, 2, 23)
+        db = ArchiveDaysCache.get_db(["agrmet"], datemin, datemax)
+        assert len(decoded) == 2
+        # the cache is checked for eviction only when new days are decoded
+        assert len(evictions) == 1
+        db = ArchiveDaysCache.get_db(["agrmet"], datemin, datemax)
+        assert len(decoded) == 2
+        assert len(evictions) == 1
+
+        # a day evicted by another process is decoded again, not read empty
+        db.paths[0].unlink()
+        assert count_data(db) == 2
+        assert len(decoded) == 3
+        # the links used to read the days are removed
+        assert not list(tmp_path.glob("*/*.read"))
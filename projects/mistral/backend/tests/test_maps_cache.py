@@ -0,0 +1,68 @@
+import os
+
+from mistral.services import maps_cache
+from mistral.services.maps_cache import MapsResponseCache
+from restapi.tests import BaseTests
+
+
+class TestMapsCache(BaseTests):
+    def test_normalized_key(self) -> None:
+        q1 = "license:CCBY_COMPLIANT;product:B12101 or B13011;level:1,0,0,0"
+        q2 = " level:1,0,0,0 ; product:B13011 or B12101;license:CCBY_COMPLIANT"
+        assert MapsResponseCache.normalize_q(q1) == MapsResponseCache.normalize_q(q2)
+        assert MapsResponseCache.get_key(q=q1, last=True) == MapsResponseCache.get_key(
+            last=True, q=q2, ident=None
+        )
+        assert MapsResponseCache.get_key(q=q1) != MapsResponseCache.get_key(
+            q=q1.replace("B13011", "B11001")
+        )
+
+        bbox = MapsResponseCache.snap_bbox(44.01, 10.99, 45.52, 12.61)
+        assert bbox == MapsResponseCache.snap_bbox(44.02, 10.98, 45.53, 12.62)
+        # the snapped box contains the requested one
+        assert bbox[0] <= 44.01 and bbox[1] <= 10.99
+        assert bbox[2] >= 45.52 and bbox[3] >= 12.61
+
+    def test_network_invalidation(self, monkeypatch, tmp_path) -> None:
+        monkeypatch.setattr(maps_cache, "MAPS_CACHE_STAMPS_DIR", tmp_path)
+        MapsResponseCache.clear()
+        clock = {"time": 1000}
+
+        def notify_new_data(name: str) -> None:
+            # as the ingestion scripts do
+            clock["time"] += 1
+            path = MapsResponseCache.get_stamp_path(name)
+            path.touch()
+            os.utime(path, (clock["time"], clock["time"]))
+
+        agrmet_names = MapsResponseCache.get_stamp_names(["agrmet"], "DBALLE")
+        all_names = MapsResponseCache.get_stamp_names(None, "DBALLE")
+        assert agrmet_names == ("agrmet",)
+        assert all_names == ("DBALLE.dsn",)
+        # arkimet only license groups have no stamps
+        assert MapsResponseCache.get_stamp_names(None, None) == ()
+
+        agrmet_key = MapsResponseCache.get_key(networks="agrmet")
+        all_key = MapsResponseCache.get_key()
+        for key, names in ((agrmet_key, agrmet_names), (all_key, all_names)):
+            response, stamps = MapsResponseCache.get(key, names)
+            assert response is None
+            MapsResponseCache.set(key, names[0], names, stamps)
+        assert MapsResponseCache.get(agrmet_key, agrmet_names)[0] == "agrmet"
+        assert MapsResponseCache.get(all_key, all_names)[0] == "DBALLE.dsn"
+
+        # new data of another network in the same dsn
+        notify_new_data("fidupo")
+        notify_new_data("DBALLE.dsn")
+        assert MapsResponseCache.get(agrmet_key, agrmet_names)[0] == "agrmet"
+        assert MapsResponseCache.get(all_key, all_names)[0] is None
+
+        notify_new_data("agrmet")
+        assert MapsResponseCache.get(agrmet_key, agrmet_names)[0] is None
+
+        # data ingested while querying are not hidden by the stored response
+        _, stamps = MapsResponseCache.get(agrmet_key, agrmet_names)
+        notify_new_data("agrmet")
+        MapsResponseCache.set(agrmet_key, "agrmet", agrmet_names, stamps)
+        assert MapsResponseCache.get(agrmet_key, agrmet_names)[0] is None
+        MapsResponseCache.clear()
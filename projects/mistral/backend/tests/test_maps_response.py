@@ -0,0 +1,213 @@
+import calendar
+import json
+from datetime import datetime
+from typing import Any, Dict, List
+
+from mistral.services import maps_grid
+from mistral.services.maps_grid import MapsGrid, StationIndex
+from mistral.services.maps_response import MapsResponseBuilder
+from restapi.tests import BaseTests
+
+START = calendar.timegm(datetime(2023, 1, 1).timetuple())
+DETAILS = [{"var": "B01019", "val": "Bologna"}]
+
+
+class TestMapsResponse(BaseTests):
+    @staticmethod
+    def build_response():
+        response = MapsResponseBuilder()
+        station = response.add_station(("BO", "agrmet"), DETAILS)
+        # values are not extracted in order of time
+        for hour, value in ((1, 274.5), (0, 273.15), (2, 271.0), (2, 272.0)):
+            response.add_value(
+                station, "B12101", value, time=START + hour * 3600, reliability=1
+            )
+        response.add_value(station, "B13011", 3, time=START, reliability=0)
+        other_station = response.add_station((44.5, 11.34, "agrmet"), [])
+        response.add_value(
+            other_station,
+            ("B12101", "103,2000,0,0", "254,0,0"),
+            270.0,
+            time=START,
+            reliability=1,
+        )
+        return response
+
+    def test_maps_response(self) -> None:
+        response = self.build_response()
+        assert len(response) == 2
+        assert ("BO", "agrmet") in response
+        assert response.get_varcodes() == (
+            ["B12101", "B13011"],
+            ["B01019"],
+            ["103,2000,0,0"],
+            ["254,0,0"],
+        )
+
+        res = json.loads(response.to_json({}))
+        assert res["descr"] == {}
+        assert len(res["data"]) == 2
+        station = res["data"][0]
+        assert station["stat"] == {"ident": "BO", "net": "agrmet", "details": DETAILS}
+        assert [p["var"] for p in station["prod"]] == ["B12101", "B13011"]
+        # values are returned in order of extraction
+        assert [v["val"] for v in station["prod"][0]["val"]] == [
+            274.5,
+            273.15,
+            271.0,
+            272.0,
+        ]
+        assert station["prod"][1]["val"] == [
+            {"val": 3, "ref": "2023-01-01T00:00:00", "rel": 0}
+        ]
+        other_station = res["data"][1]
+        assert other_station["stat"] == {
+            "lat": 44.5,
+            "lon": 11.34,
+            "net": "agrmet",
+            "details": [],
+        }
+        assert other_station["prod"][0]["lev"] == "103,2000,0,0"
+        assert other_station["prod"][0]["trange"] == "254,0,0"
+
+    def test_clip(self) -> None:
+        response = self.build_response()
+        # a station outside the box, with its own products and values
+        outside = response.add_station((46.0, 12.0, "locali"), [])
+        response.add_value(outside, "B11001", 10, time=START, reliability=1)
+        response.add_value(
+            outside,
+            ("B20003", "1,0,0,0", "1,0,3600"),
+            "trace",
+            time=START,
+            reliability=0,
+        )
+        response.merge(self.build_response())
+        expected = self.build_response()
+        expected.merge(self.build_response())
+
+        bbox = (44.0, 11.0, 45.0, 12.0)
+        clipped = response.clip(bbox)
+        # the mobile stations are kept
+        assert clipped.station_keys == expected.station_keys
+        # the descriptions are built only for the remaining products
+        assert clipped.get_varcodes() == expected.get_varcodes()
+        for only_last_data in (False, True):
+            assert clipped.to_json({}, only_last_data) == expected.to_json(
+                {}, only_last_data
+            )
+        # nothing to clip
+        assert clipped.clip(bbox) is clipped
+        assert response.clip(None) is response
+
+    def test_last_value(self) -> None:
+        response = self.build_response()
+        res = json.loads(response.to_json({}, only_last_data=True))
+        # the first of the most recent values is kept
+        assert res["data"][0]["prod"][0]["val"] == [
+            {"val": 271.0, "ref": "2023-01-01T02:00:00", "rel": 1}
+        ]
+        assert len(res["data"][1]["prod"][0]["val"]) == 1
+
+    def test_empty_response(self) -> None:
+        response = MapsResponseBuilder()
+        assert not response
+        assert json.loads(response.to_json({})) == {"descr": {}, "data": []}
+
+    def test_grid_aggregation(self) -> None:
+        response = self.build_response()
+        # the position of the stations identified by ident comes from the summaries
+        index = StationIndex.from_summary(
+            [{"ident": "BO", "rep_memo": "agrmet", "lat": 44.49, "lon": 11.34}]
+        )
+        cells = MapsGrid.aggregate_values(response, index, 1.0)
+        # both the stations are in the same cell
+        assert len(cells) == 1
+        assert cells[0]["cell"]["latmin"] == 44
+        assert cells[0]["cell"]["lonmin"] == 11
+        assert cells[0]["count"] == 2
+        assert cells[0]["nets"] == ["agrmet"]
+        products = {p["var"]: p for p in cells[0]["prod"] if "lev" not in p}
+        temperature = products["B12101"]
+        assert temperature["count"] == 4
+        assert temperature["min"] == 271.0
+        assert temperature["max"] == 274.5
+        assert temperature["last"] == {"val": 271.0, "ref": "2023-01-01T02:00:00"}
+
+        # only the most recent value of each station
+        cells = MapsGrid.aggregate_values(response, index, 1.0, only_last_data=True)
+        products = {p["var"]: p for p in cells[0]["prod"] if "lev" not in p}
+        assert products["B12101"]["count"] == 1
+        assert products["B12101"]["mean"] == 271.0
+
+        stations = MapsGrid.aggregate_stations(index, MapsGrid.get_cell_size(zoom=0))
+        assert len(stations) == 1
+        assert stations[0]["count"] == 1
+
+    def test_station_index(self, monkeypatch) -> None:
+        class FakeExplorer:
+            def __init__(self) -> None:
+                self.queries: List[Dict[str, Any]] = []
+
+            def query_summary(self, query: Dict[str, Any]) -> List[Dict[str, Any]]:
+                self.queries.append(query)
+                return [
+                    {"ident": None, "rep_memo": "agrmet", "lat": 44.5, "lon": 11.34},
+                    {"ident": None, "rep_memo": "agrmet", "lat": 45.07, "lon": 7.68},
+                ]
+
+        monkeypatch.setattr(maps_grid, "MAPS_GRID_INDEX_SIZE", 2)
+        MapsGrid.clear()
+        explorer = FakeExplorer()
+        indexes = []
+        for bbox in ((44.0, 11.0, 45.0, 12.0), (40.0, 6.0, 46.0, 12.0)):
+            query = {"rep_memo": "agrmet", **dict(zip(maps_grid.BBOX_KEYS, bbox))}
+            key = MapsGrid.get_index_key("group", "dballe", [query], None)
+            indexes.append(MapsGrid.get_station_index(key, explorer, [query]))
+            # the bounding box is applied on the index
+            assert len(indexes[-1]) == 2
+        # the same index serves every bounding box
+        assert indexes[0] is indexes[1]
+        assert explorer.queries == [{"rep_memo": "agrmet"}]
+        assert len(indexes[0].within((44.0, 11.0, 45.0, 12.0))) == 1
+        assert len(indexes[0].within(None)) == 2
+
+        # only the most recently used indexes are kept
+        for network in ("locali", "meteonetwork"):
+            key = MapsGrid.get_index_key(
+                "group", "dballe", [{"rep_memo": network}], None
+            )
+            MapsGrid.get_station_index(key, explorer, [{"rep_memo": network}])
+        assert len(MapsGrid._indexes) == 2
+        MapsGrid.clear()
+
+    def test_merge(self) -> None:
+        response = self.build_response()
+        # the same data extracted by two queries and merged in order
+        first = MapsResponseBuilder()
+        station = first.add_station(("BO", "agrmet"), DETAILS)
+        for hour, value in ((1, 274.5), (0, 273.15)):
+            first.add_value(
+                station, "B12101", value, time=START + hour * 3600, reliability=1
+            )
+        second = MapsResponseBuilder()
+        station = second.add_station(("BO", "agrmet"), DETAILS)
+        for hour, value in ((2, 271.0), (2, 272.0)):
+            second.add_value(
+                station, "B12101", value, time=START + hour * 3600, reliability=1
+            )
+        second.add_value(station, "B13011", 3, time=START, reliability=0)
+        other_station = second.add_station((44.5, 11.34, "agrmet"), [])
+        second.add_value(
+            other_station,
+            ("B12101", "103,2000,0,0", "254,0,0"),
+            270.0,
+            time=START,
+            reliability=1,
+        )
+        merged = MapsResponseBuilder()
+        merged.merge(first)
+        merged.merge(second)
+
+        for last in (False, True):
+            assert merged.to_json({}, last) == response.to_json({}, last)
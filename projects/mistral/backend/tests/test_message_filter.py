@@ -0,0 +1,86 @@
+from datetime import datetime
+from pathlib import Path
+
+import dballe
+from mistral.services.message_filter import MessageFilter
+from mistral.tools.quality_check_filter import pp_quality_check_filter
+from restapi.tests import BaseTests
+
+
+class TestMessageFilter(BaseTests):
+    @staticmethod
+    def build_message(confidences):
+        msg = dballe.Message("generic")
+        msg.set_named("year", dballe.var("B04001", 2023))
+        msg.set_named("month", dballe.var("B04002", 1))
+        msg.set_named("day", dballe.var("B04003", 1))
+        msg.set_named("hour", dballe.var("B04004", 6))
+        msg.set_named("minute", dballe.var("B04005", 0))
+        msg.set_named("second", dballe.var("B04006", 0))
+        msg.set_named("rep_memo", dballe.var("B01194", "agrmet"))
+        msg.set_named("longitude", dballe.var("B06001", 1134000))
+        msg.set_named("latitude", dballe.var("B05001", 4450000))
+        for hour, confidence in enumerate(confidences):
+            v = dballe.var("B12101", 273.15 + hour)
+            v.seta(dballe.var("B33007", confidence))
+            msg.set(
+                dballe.Level(103, 2000, None, None),
+                dballe.Trange(254, hour * 3600, 0),
+                v,
+            )
+        return msg
+
+    def test_quality_check(self) -> None:
+        qc_filter = MessageFilter(quality_check=True)
+        # nothing to drop: the message is not copied
+        msg = self.build_message([100, 80])
+        assert qc_filter.filter(msg) is msg
+        # no reliable data
+        assert qc_filter.filter(self.build_message([10])) is None
+
+        msg = self.build_message([100, 10])
+        kept, dropped = qc_filter.split(msg)
+        assert kept is not msg
+        assert len(list(kept.query_data())) == 1
+        assert len(list(dropped.query_data())) == 1
+
+    def test_runs(self) -> None:
+        msg = self.build_message([100, 100])
+        # the data of the run of 05:00 (+1h) are kept
+        runs_filter = MessageFilter(runs={datetime(2023, 1, 1, 5)})
+        assert sorted(runs_filter.select(msg)) == [False, True]
+        filtered = runs_filter.filter(msg)
+        assert [d["trange"].p1 for d in filtered.query_data()] == [3600]
+
+    def test_quality_check_output(self, tmp_path: Path) -> None:
+        # as in the legacy filter, the quality check output has no data attributes
+        qc_filter = MessageFilter(quality_check=True, data_attrs=False)
+        filtered = qc_filter.filter(self.build_message([100, 10]))
+        data = list(filtered.query_data({"query": "attrs"}))
+        assert len(data) == 1
+        assert not data[0]["variable"].get_attrs()
+        # the reliable data are copied anyway to remove their attributes
+        msg = self.build_message([100, 80])
+        filtered = qc_filter.filter(msg)
+        assert filtered is not msg
+        data = list(filtered.query_data({"query": "attrs"}))
+        assert len(data) == 2
+        assert not any(d["variable"].get_attrs() for d in data)
+        # the station data keep their attributes
+        assert filtered.get_named("rep_memo") is not None
+
+        input_file = tmp_path / "input.bufr"
+        output_file = tmp_path / "output.bufr"
+        exporter = dballe.Exporter("BUFR")
+        with open(input_file, "wb") as f:
+            for confidences in ([100, 10], [10], [80]):
+                f.write(exporter.to_binary(self.build_message(confidences)))
+        pp_quality_check_filter(input_file, output_file)
+        importer = dballe.Importer("BUFR")
+        with importer.from_file(output_file) as fp:
+            msgs = [msg for msgs in fp for msg in msgs]
+        assert len(msgs) == 2
+        for msg in msgs:
+            data = list(msg.query_data({"query": "attrs"}))
+            assert len(data) == 1
+            assert not data[0]["variable"].get_attrs()
@@ -0,0 +1,84 @@
+import os
+from pathlib import Path
+
+import pytest
+from mistral.tools import pipeline
+from restapi.tests import BaseTests
+
+
+class TestPipeline(BaseTests):
+    def test_run_commands(self, tmp_path: Path) -> None:
+        input_file = tmp_path.joinpath("input.grib")
+        input_file.write_bytes(b"GRIB" * 100000)
+        fifos = [tmp_path.joinpath("stage1.tmp"), tmp_path.joinpath("stage2.tmp")]
+        for fifo in fifos:
+            os.mkfifo(fifo)
+        output_file = tmp_path.joinpath("output.grib")
+
+        commands = [
+            ["cp", str(input_file), str(fifos[0])],
+            ["cp", str(fifos[0]), str(fifos[1])],
+            ["cp", str(fifos[1]), str(output_file)],
+        ]
+        pipeline.run_commands(commands, fifos)
+        assert output_file.read_bytes() == input_file.read_bytes()
+
+    def test_failure(self, tmp_path: Path) -> None:
+        fifo = tmp_path.joinpath("stage1.tmp")
+        os.mkfifo(fifo)
+        output_file = tmp_path.joinpath("output.grib")
+
+        # the first stage fails without opening the fifo:
+        # the next one is terminated instead of waiting forever
+        commands = [
+            ["cp", str(tmp_path.joinpath("missing.grib")), str(fifo)],
+            ["cp", str(fifo), str(output_file)],
+        ]
+        with pytest.raises(Exception):
+            pipeline.run_commands(commands, [fifo])
+
+    def test_late_stages(self, tmp_path: Path) -> None:
+        fifo = tmp_path.joinpath("stage1.tmp")
+        os.mkfifo(fifo)
+        output_file = tmp_path.joinpath("output.grib")
+
+        # the first stage exits before the next one opens the fifo
+        commands = [
+            ["true"],
+            ["sh", "-c", f"sleep 0.5 && cp {fifo} {output_file}"],
+        ]
+        pipeline.run_commands(commands, [fifo], timeout=10)
+        assert output_file.read_bytes() == b""
+
+        # the last stage exits before the previous one opens the fifo
+        input_file = tmp_path.joinpath("input.grib")
+        input_file.write_bytes(b"GRIB" * 100000)
+        commands = [
+            ["sh", "-c", f"sleep 0.5 && cp {input_file} {fifo}"],
+            ["true"],
+        ]
+        # it is released and fails writing, instead of waiting forever
+        with pytest.raises(Exception, match="sh exited"):
+            pipeline.run_commands(commands, [fifo], timeout=10)
+
+    def test_timeout(self, tmp_path: Path) -> None:
+        fifo = tmp_path.joinpath("stage1.tmp")
+        os.mkfifo(fifo)
+
+        commands = [["sleep", "60"], ["cat", str(fifo)]]
+        with pytest.raises(Exception, match="first, second still running"):
+            pipeline.run_commands(
+                commands, [fifo], names=["first", "second"], timeout=0.5
+            )
+
+    def test_get_streamable(self) -> None:
+        requested = {
+            "spare_point_interpolation": {"sub_type": "near"},
+            "derived_variables": {},
+            "grid_cropping": {"sub_type": "coord"},
+        }
+        streamable = pipeline.get_streamable(requested)
+        assert [pp_type for pp_type, _ in streamable] == [
+            "grid_cropping",
+            "spare_point_interpolation",
+        ]
@@ -0,0 +1,82 @@
+from collections import namedtuple
+from datetime import datetime
+
+from mistral.services.query_planner import QueryPlanner
+from restapi.tests import BaseTests
+
+Level = namedtuple("Level", "ltype1 l1 ltype2 l2")
+Trange = namedtuple("Trange", "pind p1 p2")
+
+FIELDS = ["rep_memo", "var", "level", "trange"]
+QUERIES = [
+    ["agrmet"],
+    ["B12101", "B13011", "B11001", "B12101"],
+    [(103, 2000, None, None), (1, None, None, None)],
+    [(254, 0, 0), (1, 0, 3600), (0, 0, 3600)],
+]
+
+
+class TestQueryPlanner(BaseTests):
+    def test_varlist(self) -> None:
+        fields, queries = QueryPlanner.plan(FIELDS, QUERIES)
+        assert fields == ["rep_memo", "varlist", "level", "trange"]
+        assert queries[1] == ["B12101,B13011,B11001"]
+
+        planned = QueryPlanner.get_queries(FIELDS, QUERIES)
+        # a query for every level and timerange instead of 24
+        assert len(planned) == 6
+        assert planned[0] == {
+            "rep_memo": "agrmet",
+            "varlist": "B12101,B13011,B11001",
+            "level": (103, 2000, None, None),
+            "trange": (254, 0, 0),
+        }
+
+        # a single variable is still queried as var
+        fields, _ = QueryPlanner.plan(["var"], [["B12101"]])
+        assert fields == ["var"]
+
+    def test_summary_queries(self) -> None:
+        planned = QueryPlanner.get_summary_queries(FIELDS, QUERIES)
+        assert len(planned) == 1
+        query, post_filter = planned[0]
+        assert "level" not in query and "trange" not in query
+        assert post_filter["level"] == QUERIES[2]
+
+        row = {"level": Level(103, 2000, None, None), "trange": Trange(1, 0, 3600)}
+        assert QueryPlanner.matches(row, post_filter)
+        # missing values of the requested level match any value
+        row["level"] = Level(1, 10, None, None)
+        assert QueryPlanner.matches(row, post_filter)
+        row["trange"] = Trange(254, 0, 3600)
+        assert not QueryPlanner.matches(row, post_filter)
+
+    def test_run_queries(self) -> None:
+        runs = {datetime(2023, 1, 1), datetime(2023, 1, 2), datetime(2023, 1, 3)}
+        fields = ["rep_memo", "var", "trange", "datetimemin", "datetimemax"]
+        queries = [
+            ["multim-forecast"],
+            ["B12101"],
+            [(254, 3600, 0), (254, 86400, 0)],
+            [datetime(2023, 1, 1)],
+            # the interval ends before the last forecasts of the last run
+            [datetime(2023, 1, 3, 12)],
+        ]
+        planned = QueryPlanner.get_run_queries(fields, queries, runs, queries[2])
+        assert planned == [
+            {
+                "rep_memo": "multim-forecast",
+                "var": "B12101",
+                "trange": (254, 3600, 0),
+                "datetimemin": datetime(2023, 1, 1, 1),
+                "datetimemax": datetime(2023, 1, 3, 1),
+            },
+            {
+                "rep_memo": "multim-forecast",
+                "var": "B12101",
+                "trange": (254, 86400, 0),
+                "datetimemin": datetime(2023, 1, 2),
+                "datetimemax": datetime(2023, 1, 3, 12),
+            },
+        ]
+        assert QueryPlanner.get_run_queries(fields, queries, set(), queries[2]) == []
@@ -0,0 +1,121 @@
+from datetime import datetime, timedelta
+
+import dballe
+import pytest
+from mistral.services.dballe import BeDballe
+from mistral.services.query_planner import QueryPlanner
+from restapi.tests import BaseTests
+
+NETWORK = "agrmet"
+START = datetime(2023, 1, 1)
+STATIONS = [(44.5, 11.34), (45.07, 7.68), (43.77, 11.25)]
+PRODUCTS = [
+    ("B12101", dballe.Level(103, 2000), dballe.Trange(254, 0, 0), 1),
+    ("B12101", dballe.Level(103, 2000), dballe.Trange(0, 0, 3600), 3),
+    ("B13011", dballe.Level(1), dballe.Trange(1, 0, 3600), 1),
+    ("B11001", dballe.Level(103, 10000), dballe.Trange(200, 0, 3600), 2),
+]
+
+
+class TestSummaryEstimator(BaseTests):
+    @staticmethod
+    def build_db():
+        db = dballe.DB.connect("mem:")
+        with db.transaction() as tr:
+            for n_station, (lat, lon) in enumerate(STATIONS):
+                for var, level, trange, step in PRODUCTS:
+                    # different number of data for every station and product
+                    for hour in range(0, 72 - n_station * 12, step):
+                        tr.insert_data(
+                            {
+                                "report": NETWORK,
+                                "lat": lat,
+                                "lon": lon,
+                                "datetime": START + timedelta(hours=hour),
+                                "level": level,
+                                "trange": trange,
+                                var: 1.0,
+                            },
+                            can_replace=True,
+                            can_add_stations=True,
+                        )
+        return db
+
+    @staticmethod
+    def build_explorer(db=None):
+        if db is None:
+            db = TestSummaryEstimator.build_db()
+        explorer = dballe.DBExplorer()
+        with explorer.update() as updater:
+            with db.transaction() as tr:
+                updater.add_db(tr)
+        return explorer
+
+    @pytest.mark.parametrize(
+        "query",
+        [
+            {},
+            {"datetimemin": START + timedelta(hours=10)},
+            {"datetimemax": START + timedelta(hours=30, minutes=30)},
+            {
+                "datetimemin": START + timedelta(hours=5),
+                "datetimemax": START + timedelta(hours=50),
+            },
+            {"var": ["B12101", "B13011"]},
+            {"trange": [(254, 0, 0), (1, 0, 3600)]},
+            {"level": [(103, 2000, None, None)], "var": ["B12101"]},
+            {
+                "var": ["B12101"],
+                "level": [(103, 2000, None, None)],
+                "trange": [(0, 0, 3600)],
+                "datetimemin": START + timedelta(hours=20),
+            },
+        ],
+    )
+    def test_vectorized_summary(self, monkeypatch, query) -> None:
+        explorer = self.build_explorer()
+        fields = ["rep_memo"]
+        queries = [[NETWORK]]
+        for key, value in query.items():
+            fields.append(key)
+            queries.append(value if isinstance(value, list) else [value])
+
+        monkeypatch.setattr(BeDballe, "VECTORIZED_SUMMARY", False)
+        legacy_summary = BeDballe.get_summary(
+            [NETWORK], explorer, fields=fields, queries=queries
+        )
+        monkeypatch.setattr(BeDballe, "VECTORIZED_SUMMARY", True)
+        vectorized_summary = BeDballe.get_summary(
+            [NETWORK], explorer, fields=fields, queries=queries
+        )
+
+        assert legacy_summary
+        assert vectorized_summary == legacy_summary
+
+    def test_varlist_summary(self) -> None:
+        db = self.build_db()
+        explorer = self.build_explorer(db)
+        fields = ["rep_memo", "var"]
+        queries = [[NETWORK], ["B12101", "B13011"]]
+        summary = BeDballe.get_summary(
+            [NETWORK], explorer, fields=fields, queries=queries
+        )
+
+        # the variables are extracted in the same messages, as estimated
+        with db.transaction() as tr:
+            extracted = [
+                cur.message
+                for q in QueryPlanner.get_queries(fields, queries)
+                for cur in tr.query_messages(q)
+            ]
+        assert summary["c"] == len(extracted)
+
+        # the estimate is lower than the one of a query for each variable
+        var_summaries = [
+            BeDballe.get_summary(
+                [NETWORK], explorer, fields=fields, queries=[[NETWORK], [v]]
+            )
+            for v in queries[1]
+        ]
+        assert summary["c"] < sum(s["c"] for s in var_summaries)
+        assert summary["s"] < sum(s["s"] for s in var_summaries)
@@ -0,0 +1,68 @@
+import sqlite3
+from pathlib import Path
+from typing import Any, Dict, List
+
+import pytest
+from mistral.services.summary_store import SCHEMA, SummaryStoreView
+from restapi.tests import BaseTests
+
+ROWS = [
+    ("agrmet", 4450000, 1134000, None, "B12101", 103, 2000, None, None, 254, 0, 0),
+    ("agrmet", 4507000, 768000, None, "B12101", 103, 2000, None, None, 254, 0, 0),
+    ("locali", 4450000, 1134000, None, "B13011", 1, None, None, None, 1, 0, 3600),
+]
+
+
+class FakeExplorerView:
+    def __init__(self) -> None:
+        self.filter: Dict[str, Any] = {}
+        self.queries: List[Dict[str, Any]] = []
+
+    def set_filter(self, query: Dict[str, Any]) -> None:
+        self.filter = query
+
+    def query_summary(self, query: Dict[str, Any]) -> List[Dict[str, Any]]:
+        self.queries.append(query)
+        return [{"ana_id": 1}]
+
+
+class TestSummaryStore(BaseTests):
+    @staticmethod
+    def build_store(path: Path) -> Path:
+        conn = sqlite3.connect(path)
+        conn.executescript(SCHEMA)
+        conn.executemany(
+            "INSERT INTO summary VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)",
+            [r + ("2023-01-01 00:00:00", "2023-01-02 00:00:00", 24) for r in ROWS],
+        )
+        conn.commit()
+        conn.close()
+        return path
+
+    def test_query_summary(self, tmp_path: Path) -> None:
+        store = self.build_store(tmp_path.joinpath("summary.sqlite"))
+        with SummaryStoreView([store]) as view:
+            view.set_filter({"rep_memo": "agrmet"})
+            res = view.query_summary({"var": "B12101"})
+            assert len(res) == 2
+            # the store does not know the station ids of the databases
+            assert all("ana_id" not in r for r in res)
+            assert view.reports == ["agrmet"]
+        # the connection is closed with the view
+        assert view._conn is None
+
+    def test_unsupported_keys(self, tmp_path: Path) -> None:
+        store = self.build_store(tmp_path.joinpath("summary.sqlite"))
+        fallback = FakeExplorerView()
+        view = SummaryStoreView([store], fallback=lambda: fallback)
+        view.set_filter({"rep_memo": "agrmet"})
+        # answered by the explorer, not by a wider query on the store
+        assert view.query_summary({"ana_id": 3}) == [{"ana_id": 1}]
+        assert fallback.filter == {"rep_memo": "agrmet"}
+        assert fallback.queries == [{"ana_id": 3}]
+
+        # without a fallback the query fails instead of ignoring the key
+        view = SummaryStoreView([store])
+        with pytest.raises(ValueError):
+            view.query_summary({"ana_id": 3})
+        view.close()
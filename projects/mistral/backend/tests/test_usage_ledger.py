@@ -0,0 +1,113 @@
+import io
+import shutil
+from pathlib import Path
+
+from faker import Faker
+from mistral.endpoints import DOWNLOAD_DIR, OPENDATA_DIR
+from mistral.services.sqlapi_db_manager import SqlApiDbManager
+from mistral.services.usage_ledger import UsageLedger
+from restapi.connectors import sqlalchemy
+from restapi.tests import API_URI, BaseTests, FlaskClient
+
+
+class TestUsageLedger(BaseTests):
+    @staticmethod
+    def get_used_quota(db, user_id: int) -> int:
+        used_quota, _ = UsageLedger.get_usage(db, user_id)
+        return used_quota
+
+    @staticmethod
+    def create_output(db, faker: Faker, user, size: int, opendata: bool = False):
+        request = SqlApiDbManager.create_request_record(
+            db, user.id, faker.pystr(), {}, opendata=opendata
+        )
+        if opendata:
+            output_dir = OPENDATA_DIR
+        else:
+            output_dir = DOWNLOAD_DIR.joinpath(user.uuid, "outputs")
+        output_dir.mkdir(parents=True, exist_ok=True)
+        filename = f"{faker.pystr()}.grib"
+        output_dir.joinpath(filename).write_bytes(b"0" * size)
+        SqlApiDbManager.create_fileoutput_record(
+            db, user.id, request.id, filename, size, opendata=opendata
+        )
+        return request.id, output_dir.joinpath(filename)
+
+    def test_fileoutputs(self, faker: Faker, client: FlaskClient) -> None:
+        db = sqlalchemy.get_instance()
+        uuid, _ = self.create_user(client)
+        user = db.User.query.filter_by(uuid=uuid).first()
+        assert self.get_used_quota(db, user.id) == 0
+
+        request_id, _ = self.create_output(db, faker, user, 1000)
+        assert self.get_used_quota(db, user.id) == 1000
+        missing_request_id, missing_file = self.create_output(db, faker, user, 500)
+        assert self.get_used_quota(db, user.id) == 1500
+
+        # opendata files are not stored in the user folder
+        opendata_request_id, _ = self.create_output(
+            db, faker, user, 2000, opendata=True
+        )
+        assert self.get_used_quota(db, user.id) == 1500
+        SqlApiDbManager.delete_request_record(db, user, opendata_request_id)
+        assert self.get_used_quota(db, user.id) == 1500
+
+        SqlApiDbManager.delete_request_record(db, user, request_id)
+        assert self.get_used_quota(db, user.id) == 500
+
+        # the size of a file already removed from the disk is removed as well
+        missing_file.unlink()
+        SqlApiDbManager.delete_request_record(db, user, missing_request_id)
+        assert self.get_used_quota(db, user.id) == 0
+        assert db.Request.query.get(missing_request_id).fileoutput is None
+
+        self.delete_user(client, uuid)
+
+    def test_templates(self, client: FlaskClient) -> None:
+        db = sqlalchemy.get_instance()
+        uuid, data = self.create_user(client)
+        user = db.User.query.filter_by(uuid=uuid).first()
+        headers, _ = self.do_login(client, data.get("email"), data.get("password"))
+
+        r = client.post(
+            f"{API_URI}/templates",
+            headers=headers,
+            data={"file": (io.BytesIO(b"0" * 3000), "template.grib")},
+        )
+        assert r.status_code == 200
+        assert self.get_used_quota(db, user.id) == 3000
+
+        r = client.delete(f"{API_URI}/templates/template.grib", headers=headers)
+        assert r.status_code == 200
+        assert self.get_used_quota(db, user.id) == 0
+
+        self.delete_user(client, uuid)
+
+    def test_reconcile(self, faker: Faker, client: FlaskClient) -> None:
+        db = sqlalchemy.get_instance()
+        uuid, _ = self.create_user(client)
+        user = db.User.query.filter_by(uuid=uuid).first()
+
+        self.create_output(db, faker, user, 1000)
+        _, opendata_file = self.create_output(db, faker, user, 2000, opendata=True)
+        uploads_dir = DOWNLOAD_DIR.joinpath(uuid, "uploads", "grib")
+        uploads_dir.mkdir(parents=True, exist_ok=True)
+        uploads_dir.joinpath("template.grib").write_bytes(b"0" * 300)
+
+        # a drifted ledger is realigned to the outputs (opendata excluded)
+        # plus the uploaded templates
+        UsageLedger.add(db, user.id, 12345)
+        db.session.commit()
+        assert UsageLedger.reconcile(db, user) == 1300
+        assert self.get_used_quota(db, user.id) == 1300
+        # nothing changes if the ledger is aligned
+        assert UsageLedger.reconcile(db, user) == 1300
+
+        opendata_file.unlink()
+        self.delete_user(client, uuid)
+
+    def delete_user(self, client: FlaskClient, uuid: str) -> None:
+        admin_headers, _ = self.do_login(client, None, None)
+        r = client.delete(f"{API_URI}/admin/users/{uuid}", headers=admin_headers)
+        assert r.status_code == 204
+        shutil.rmtree(Path(DOWNLOAD_DIR, uuid), ignore_errors=True)
@@ -1,39 +1,49 @@
 import subprocess
 from pathlib import Path
+from typing import List
 
 from mistral.endpoints import PostProcessorsType
 from mistral.exceptions import PostProcessingException
 from restapi.utilities.logs import log
 
 
+def get_output_file(input_file: Path, output_folder: Path, fileformat: str) -> Path:
+    return output_folder.joinpath(f"{input_file.stem}-pp3_2.{fileformat}.tmp")
+
+
+def get_command(
+    params: PostProcessorsType, input_file: Path, output_file: Path, fileformat: str
+) -> List[str]:
+    post_proc_cmd = []
+    post_proc_cmd.append("vg6d_transform")
+    # limit memory usage by elaborating a message at once
+    post_proc_cmd.append("--trans-mode=s")
+    post_proc_cmd.append("--trans-type={}".format(params.get("trans_type")))
+    post_proc_cmd.append("--sub-type={}".format(params.get("sub_type")))
+
+    if "ilon" in params["boundings"]:
+        post_proc_cmd.append("--ilon={}".format(params["boundings"]["ilon"]))
+    if "ilat" in params["boundings"]:
+        post_proc_cmd.append("--ilat={}".format(params["boundings"]["ilat"]))
+    if "flon" in params["boundings"]:
+        post_proc_cmd.append("--flon={}".format(params["boundings"]["flon"]))
+    if "flat" in params["boundings"]:
+        post_proc_cmd.append("--flat={}".format(params["boundings"]["flat"]))
+
+    post_proc_cmd.append(str(input_file))
+    post_proc_cmd.append(str(output_file))
+    return post_proc_cmd
+
+
 def pp_grid_cropping(
     params: PostProcessorsType, input_file: Path, output_folder: Path, fileformat: str
 ) -> Path:
     log.debug("Grid cropping postprocessor")
     try:
 
-        output_file = output_folder.joinpath(
-            f"{input_file.stem}-pp3_2.{fileformat}.tmp"
-        )
-
-        post_proc_cmd = []
-        post_proc_cmd.append("vg6d_transform")
-        # limit memory usage by elaborating a message at once
-        post_proc_cmd.append("--trans-mode=s")
-        post_proc_cmd.append("--trans-type={}".format(params.get("trans_type")))
-        post_proc_cmd.append("--sub-type={}".format(params.get("sub_type")))
-
-        if "ilon" in params["boundings"]:
-            post_proc_cmd.append("--ilon={}".format(params["boundings"]["ilon"]))
-        if "ilat" in params["boundings"]:
-            post_proc_cmd.append("--ilat={}".format(params["boundings"]["ilat"]))
-        if "flon" in params["boundings"]:
-            post_proc_cmd.append("--flon={}".format(params["boundings"]["flon"]))
-        if "flat" in params["boundings"]:
-            post_proc_cmd.append("--flat={}".format(params["boundings"]["flat"]))
-
-        post_proc_cmd.append(str(input_file))
-        post_proc_cmd.append(str(output_file))
+        output_file = get_output_file(input_file, output_folder, fileformat)
+
+        post_proc_cmd = get_command(params, input_file, output_file, fileformat)
         log.debug("Post process command: {}>", post_proc_cmd)
 
         proc = subprocess.Popen(post_proc_cmd)
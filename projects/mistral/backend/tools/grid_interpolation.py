@@ -1,5 +1,6 @@
 import subprocess
 from pathlib import Path
+from typing import List
 
 from mistral.endpoints import PostProcessorsType
 from mistral.exceptions import PostProcessingException
@@ -21,54 +22,53 @@ def get_trans_type(params: PostProcessorsType) -> None:
         params["trans_type"] = "boxinter"
 
 
+def get_output_file(input_file: Path, output_folder: Path, fileformat: str) -> Path:
+    return output_folder.joinpath(f"{input_file.stem}-pp3_1.{fileformat}.tmp")
+
+
+def get_command(
+    params: PostProcessorsType, input_file: Path, output_file: Path, fileformat: str
+) -> List[str]:
+    post_proc_cmd = []
+    post_proc_cmd.append("vg6d_transform")
+    post_proc_cmd.append("--trans-type={}".format(params.get("trans_type")))
+    post_proc_cmd.append("--sub-type={}".format(params.get("sub_type")))
+
+    # check if there is a grib file template or look for others interpolation params
+    if "template" in params:
+        post_proc_cmd.append("--output-format=grib_api:{}".format(params["template"]))
+    else:
+        # vg6d_transform automatically provides defaults for missing optional params
+        if "boundings" in params:
+            if "x_min" in params["boundings"]:
+                post_proc_cmd.append("--x-min={}".format(params["boundings"]["x_min"]))
+            if "x_max" in params["boundings"]:
+                post_proc_cmd.append("--x-max={}".format(params["boundings"]["x_max"]))
+            if "y_min" in params["boundings"]:
+                post_proc_cmd.append("--y-min={}".format(params["boundings"]["y_min"]))
+            if "y_max" in params["boundings"]:
+                post_proc_cmd.append("--y-max={}".format(params["boundings"]["y_max"]))
+        if "nodes" in params:
+            if "nx" in params["nodes"]:
+                post_proc_cmd.append("--nx={}".format(params["nodes"]["nx"]))
+            if "ny" in params["nodes"]:
+                post_proc_cmd.append("--ny={}".format(params["nodes"]["ny"]))
+
+    # post_proc_cmd.append('--display')
+    post_proc_cmd.append(str(input_file))
+    post_proc_cmd.append(str(output_file))
+    return post_proc_cmd
+
+
 def pp_grid_interpolation(
     params: PostProcessorsType, input_file: Path, output_folder: Path, fileformat: str
 ) -> Path:
     log.debug("Grid interpolation postprocessor")
     try:
 
-        output_file = output_folder.joinpath(
-            f"{input_file.stem}-pp3_1.{fileformat}.tmp"
-        )
-
-        post_proc_cmd = []
-        post_proc_cmd.append("vg6d_transform")
-        post_proc_cmd.append("--trans-type={}".format(params.get("trans_type")))
-        post_proc_cmd.append("--sub-type={}".format(params.get("sub_type")))
-
-        # check if there is a grib file template or look for others interpolation params
-        if "template" in params:
-            post_proc_cmd.append(
-                "--output-format=grib_api:{}".format(params["template"])
-            )
-        else:
-            # vg6d_transform automatically provides defaults for missing optional params
-            if "boundings" in params:
-                if "x_min" in params["boundings"]:
-                    post_proc_cmd.append(
-                        "--x-min={}".format(params["boundings"]["x_min"])
-                    )
-                if "x_max" in params["boundings"]:
-                    post_proc_cmd.append(
-                        "--x-max={}".format(params["boundings"]["x_max"])
-                    )
-                if "y_min" in params["boundings"]:
-                    post_proc_cmd.append(
-                        "--y-min={}".format(params["boundings"]["y_min"])
-                    )
-                if "y_max" in params["boundings"]:
-                    post_proc_cmd.append(
-                        "--y-max={}".format(params["boundings"]["y_max"])
-                    )
-            if "nodes" in params:
-                if "nx" in params["nodes"]:
-                    post_proc_cmd.append("--nx={}".format(params["nodes"]["nx"]))
-                if "ny" in params["nodes"]:
-                    post_proc_cmd.append("--ny={}".format(params["nodes"]["ny"]))
-
-        # post_proc_cmd.append('--display')
-        post_proc_cmd.append(str(input_file))
-        post_proc_cmd.append(str(output_file))
+        output_file = get_output_file(input_file, output_folder, fileformat)
+
+        post_proc_cmd = get_command(params, input_file, output_file, fileformat)
         log.debug("Post process command: {}>", post_proc_cmd)
 
         proc = subprocess.Popen(post_proc_cmd)
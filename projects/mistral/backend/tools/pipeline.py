@@ -0,0 +1,161 @@
+import os
+import subprocess
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from mistral.endpoints import PostProcessorsType
+from mistral.exceptions import PostProcessingException
+from mistral.tools import grid_cropping as pp3_2
+from mistral.tools import grid_interpolation as pp3_1
+from mistral.tools import spare_point_interpol as pp3_3
+from restapi.env import Env
+from restapi.utilities.logs import log
+
+# run the consecutive streamable postprocessors concurrently, connected by fifos
+POSTPROCESSORS_PIPELINE = Env.get_bool("POSTPROCESSORS_PIPELINE", False)
+# seconds after which the stages still running are killed
+POSTPROCESSORS_PIPELINE_TIMEOUT = Env.get_int("POSTPROCESSORS_PIPELINE_TIMEOUT", 21600)
+# seconds between two checks of the running postprocessors
+POLL_INTERVAL = 0.1
+# seconds given to a terminated stage before killing it
+TERMINATE_TIMEOUT = 5
+
+# postprocessors reading their input and writing their output sequentially,
+# in the order they are applied. derived_variables and statistic_elaboration
+# need a seekable input and are always run on files
+STREAMABLE_POSTPROCESSORS = {
+    "grid_cropping": pp3_2,
+    "grid_interpolation": pp3_1,
+    "spare_point_interpolation": pp3_3,
+}
+
+
+def get_streamable(
+    requested_postprocessors: Dict[str, PostProcessorsType]
+) -> List[Tuple[str, PostProcessorsType]]:
+    return [
+        (pp_type, requested_postprocessors[pp_type])
+        for pp_type in STREAMABLE_POSTPROCESSORS
+        if pp_type in requested_postprocessors
+    ]
+
+
+def release_fifo(fifo: Path, flags: int) -> None:
+    # open and close the other end of a fifo, so that a process still waiting
+    # to open it does not wait forever for a stage that is no longer running.
+    # It is retried at every check, as the process may not have opened it yet
+    try:
+        fd = os.open(fifo, flags | os.O_NONBLOCK)
+    except OSError:
+        # ENXIO: nobody is reading the fifo yet
+        return
+    os.close(fd)
+
+
+def stop(proc: subprocess.Popen) -> None:
+    if proc.poll() is not None:
+        return
+    proc.terminate()
+    try:
+        proc.wait(TERMINATE_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+
+def run_commands(
+    commands: List[List[str]],
+    fifos: List[Path],
+    names: Optional[List[str]] = None,
+    timeout: float = POSTPROCESSORS_PIPELINE_TIMEOUT,
+) -> None:
+    """
+    Run the commands concurrently. The output of each command is the input of the
+    next one through fifos[i], so a failure or the timeout terminates the whole
+    pipeline. The stages are named after their command if names are not given
+    """
+    if names is None:
+        names = [cmd[0] for cmd in commands]
+    procs: List[subprocess.Popen] = []
+    try:
+        for cmd in commands:
+            log.debug("Post process command: {}>", cmd)
+            procs.append(subprocess.Popen(cmd))
+
+        deadline = time.monotonic() + timeout
+        while True:
+            returncodes = [proc.poll() for proc in procs]
+            # the first failing stage is the cause of the failures of the others
+            for i, returncode in enumerate(returncodes):
+                if returncode:
+                    raise Exception(
+                        f"Failure in post-processing: {names[i]} "
+                        f"exited with {returncode}"
+                    )
+            running = [
+                i for i, returncode in enumerate(returncodes) if returncode is None
+            ]
+            if not running:
+                return
+            if time.monotonic() > deadline:
+                still_running = ", ".join(names[i] for i in running)
+                raise Exception(
+                    f"Failure in post-processing: {still_running} still running "
+                    f"after {timeout}s"
+                )
+            # release the neighbours of the exited stages still waiting for them
+            for i in running:
+                if i > 0 and returncodes[i - 1] is not None:
+                    release_fifo(fifos[i - 1], os.O_WRONLY)
+                if i < len(fifos) and returncodes[i + 1] is not None:
+                    release_fifo(fifos[i], os.O_RDONLY)
+            time.sleep(POLL_INTERVAL)
+    finally:
+        for proc in procs:
+            stop(proc)
+
+
+def pp_pipeline(
+    postprocessors: List[Tuple[str, PostProcessorsType]],
+    input_file: Path,
+    output_folder: Path,
+    fileformat: str,
+) -> Path:
+    log.debug(
+        "Postprocessors pipeline: {}",
+        ", ".join(pp_type for pp_type, _ in postprocessors),
+    )
+    fifos: List[Path] = []
+    try:
+        commands = []
+        names = []
+        stage_input = input_file
+        for pp_type, params in postprocessors:
+            pp = STREAMABLE_POSTPROCESSORS[pp_type]
+            # same names of the file based postprocessors
+            stage_output = pp.get_output_file(stage_input, output_folder, fileformat)
+            commands.append(
+                pp.get_command(params, stage_input, stage_output, fileformat)
+            )
+            names.append(pp_type)
+            fifos.append(stage_output)
+            stage_input = stage_output
+        # the last stage writes the actual output file
+        output_file = fifos.pop()
+
+        for fifo in fifos:
+            fifo.unlink(missing_ok=True)
+            os.mkfifo(fifo)
+
+        run_commands(commands, fifos, names)
+
+        return output_file
+
+    except Exception as perr:
+        log.warning(perr)
+        message = "Error in post-processing: no results"
+        raise PostProcessingException(message)
+    finally:
+        for fifo in fifos:
+            fifo.unlink(missing_ok=True)
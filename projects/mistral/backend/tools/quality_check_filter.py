@@ -1,23 +1,16 @@
 from pathlib import Path
 
-import dballe
-from mistral.services.dballe import BeDballe
+from mistral.services.message_filter import MessageFilter
 from restapi.utilities.logs import log
 
 
 def pp_quality_check_filter(input_file: Path, output_file: Path) -> None:
     log.info("Filter the output file with quality check filter")
-    try:
-        with open(input_file, "rb") as inf:
-            with open(output_file, "wb") as outf:
-                importer = dballe.Importer("BUFR")
-                exporter = dballe.Exporter("BUFR")
-
-                with importer.from_file(inf) as fp:
-                    for msgs in fp:
-                        for msg in msgs:
-                            new_msg = BeDballe.filter_messages(msg, quality_check=True)
-                            if new_msg:
-                                outf.write(exporter.to_binary(new_msg))
-    except Exception as exc:
-        raise exc
+    with open(input_file, "rb") as inf:
+        with open(output_file, "wb") as outf:
+            # the filtered data are written without their attributes, as before:
+            # only the messages without attributes are copied as they are
+            stats = MessageFilter(quality_check=True, data_attrs=False).filter_file(
+                inf, outf
+            )
+    log.debug("quality check filter: {}", stats)
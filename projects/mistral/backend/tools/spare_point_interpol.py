@@ -1,6 +1,7 @@
 import shutil
 import subprocess
 from pathlib import Path
+from typing import List
 
 from mistral.endpoints import PostProcessorsType
 from mistral.exceptions import PostProcessingException
@@ -40,30 +41,41 @@ def check_coord_filepath(params: PostProcessorsType) -> None:
             )
 
 
+def get_output_file(input_file: Path, output_folder: Path, fileformat: str) -> Path:
+    return output_folder.joinpath(f"{input_file.stem}").with_suffix(".bufr")
+
+
+def get_command(
+    params: PostProcessorsType, input_file: Path, output_file: Path, fileformat: str
+) -> List[str]:
+    post_proc_cmd = []
+
+    if fileformat.startswith("grib"):
+        post_proc_cmd.append("vg6d_getpoint")
+        post_proc_cmd.append("--trans-type={}".format(params.get("trans_type")))
+    else:
+        post_proc_cmd.append("v7d_transform")
+        post_proc_cmd.append("--pre-trans-type={}".format(params.get("trans_type")))
+        post_proc_cmd.append("--input-format=BUFR")
+
+    post_proc_cmd.append("--sub-type={}".format(params.get("sub_type")))
+    post_proc_cmd.append("--coord-format={}".format(params.get("file_format")))
+    post_proc_cmd.append("--coord-file={}".format(params.get("coord_filepath")))
+    post_proc_cmd.append("--output-format=BUFR")
+    post_proc_cmd.append(str(input_file))
+    post_proc_cmd.append(str(output_file))
+    return post_proc_cmd
+
+
 def pp_sp_interpolation(
     params: PostProcessorsType, input_file: Path, output_folder: Path, fileformat: str
 ) -> Path:
     log.debug("Spare point interpolation postprocessor")
     try:
 
-        output_file = output_folder.joinpath(f"{input_file.stem}").with_suffix(".bufr")
-
-        post_proc_cmd = []
-
-        if fileformat.startswith("grib"):
-            post_proc_cmd.append("vg6d_getpoint")
-            post_proc_cmd.append("--trans-type={}".format(params.get("trans_type")))
-        else:
-            post_proc_cmd.append("v7d_transform")
-            post_proc_cmd.append("--pre-trans-type={}".format(params.get("trans_type")))
-            post_proc_cmd.append("--input-format=BUFR")
+        output_file = get_output_file(input_file, output_folder, fileformat)
 
-        post_proc_cmd.append("--sub-type={}".format(params.get("sub_type")))
-        post_proc_cmd.append("--coord-format={}".format(params.get("file_format")))
-        post_proc_cmd.append("--coord-file={}".format(params.get("coord_filepath")))
-        post_proc_cmd.append("--output-format=BUFR")
-        post_proc_cmd.append(str(input_file))
-        post_proc_cmd.append(str(output_file))
+        post_proc_cmd = get_command(params, input_file, output_file, fileformat)
         log.debug("Post process command: {}>", post_proc_cmd)
 
         proc = subprocess.Popen(post_proc_cmd)
@@ -2,10 +2,10 @@
 from pathlib import Path
 from typing import Any, Dict, List
 
-import dballe
 import eccodes
 from mistral.endpoints import PostProcessorsType
 from mistral.exceptions import PostProcessingException
+from mistral.services.message_filter import MessageFilter
 from restapi.utilities.logs import log
 
 # conversion from grib1 to grib2 style
@@ -70,76 +70,13 @@ def pp_statistic_elaboration(
                     )
                     log.debug("file for post process {} ", file_for_pp)
                     with open(file_for_pp, "wb") as match_file:
-                        importer = dballe.Importer("BUFR")
-                        exporter = dballe.Exporter("BUFR")
-
-                        with importer.from_file(in_file) as fp:
-                            for msgs in fp:
-                                for msg in msgs:
-                                    count_vars = 0
-                                    count_vars_nm = 0
-                                    new_msg = dballe.Message("generic")
-
-                                    new_msg.set_named("year", msg.get_named("year"))
-                                    new_msg.set_named("month", msg.get_named("month"))
-                                    new_msg.set_named("day", msg.get_named("day"))
-                                    new_msg.set_named("hour", msg.get_named("hour"))
-                                    new_msg.set_named("minute", msg.get_named("minute"))
-                                    new_msg.set_named("second", msg.get_named("second"))
-                                    new_msg.set_named("rep_memo", msg.report)
-                                    new_msg.set_named(
-                                        "longitude", int(msg.coords[0] * 10**5)
-                                    )
-                                    new_msg.set_named(
-                                        "latitude", int(msg.coords[1] * 10**5)
-                                    )
-                                    if msg.ident:
-                                        new_msg.set_named("ident", msg.ident)
-
-                                    new_msg_nm = new_msg
-                                    for data in msg.query_data({"query": "attrs"}):
-                                        variable = data["variable"]
-                                        attrs = variable.get_attrs()
-                                        v = dballe.var(
-                                            data["variable"].code,
-                                            data["variable"].get(),
-                                        )
-                                        for a in attrs:
-                                            v.seta(a)
-
-                                        if data["trange"].pind == tr[0]:
-                                            new_msg.set(
-                                                data["level"], data["trange"], v
-                                            )
-                                            count_vars += 1
-                                        else:
-                                            new_msg_nm.set(
-                                                data["level"], data["trange"], v
-                                            )
-                                            count_vars_nm += 1
-
-                                    for data in msg.query_station_data(
-                                        {"query": "attrs"}
-                                    ):
-                                        variable = data["variable"]
-                                        attrs = variable.get_attrs()
-                                        v = dballe.var(
-                                            data["variable"].code,
-                                            data["variable"].get(),
-                                        )
-                                        for a in attrs:
-                                            v.seta(a)
-
-                                        new_msg.set(dballe.Level(), dballe.Trange(), v)
-                                        new_msg_nm.set(
-                                            dballe.Level(), dballe.Trange(), v
-                                        )
-                                    if count_vars > 0:
-                                        match_file.write(exporter.to_binary(new_msg))
-                                    if count_vars_nm > 0:
-                                        no_match_file.write(
-                                            exporter.to_binary(new_msg_nm)
-                                        )
+                        # the data are split variable by variable: the messages
+                        # not to be split are copied as they are
+                        in_file.seek(0)
+                        stats = MessageFilter(pind=tr[0]).filter_file(
+                            in_file, match_file, dropped_file=no_match_file
+                        )
+                        log.debug("timerange {} split: {}", tr, stats)
 
     if file_not_for_pp.exists():
         fileouput_to_join.append(file_not_for_pp)
@@ -5,6 +5,7 @@
 import sys
 
 import dballe
+from maps_cache_stamps import notify_new_data
 
 # sys.stdout = open('out', 'w')
 # sys.stderr = open('err', 'w')
@@ -19,6 +20,28 @@
 DEFAULT_DSN = f"postgresql://{user}:{pw}@{host}:{port}/DBALLE"
 # print("Connecting: " + DEFAULT_DSN, file=sys.stdout)
 
+def check_message(msg):
+    """
+    Read all the values of the message, raising an error if it is malformed.
+    Return the reference time of the message
+    """
+    int(msg.coords[0] * 10**5)
+    int(msg.coords[1] * 10**5)
+    for data in msg.query_data({"query": "attrs"}):
+        data["variable"].get()
+        data["variable"].get_attrs()
+    for data in msg.query_station_data({"query": "attrs"}):
+        data["variable"].get()
+        data["variable"].get_attrs()
+    return datetime.datetime(
+        msg.get_named("year").get(),
+        msg.get_named("month").get(),
+        msg.get_named("day").get(),
+        msg.get_named("hour").get(),
+        msg.get_named("minute").get(),
+        msg.get_named("second").get(),
+    )
+
 
 # network enabled report station
 network_filter = sys.argv[1].lower().split()
@@ -49,6 +72,7 @@
     malformed_msg_errors = None
     network_errors = None
     reftime_errors = None
+    imported_networks = set()
     if data:
         with open(flowfileout, "wb") as discarded_msgs:
             importer = dballe.Importer("BUFR")
@@ -60,56 +84,11 @@
                         message_ok = True
                         count_messages += 1
                         count_vars = 0
-                        new_msg = dballe.Message("generic")
+                        dt = None
 
                         # check the correctness of the message
                         try:
-                            new_msg.set_named("year", msg.get_named("year"))
-                            new_msg.set_named("month", msg.get_named("month"))
-                            new_msg.set_named("day", msg.get_named("day"))
-                            new_msg.set_named("hour", msg.get_named("hour"))
-                            new_msg.set_named("minute", msg.get_named("minute"))
-                            new_msg.set_named("second", msg.get_named("second"))
-                            new_msg.set_named("rep_memo", msg.report)
-                            new_msg.set_named("longitude", int(msg.coords[0] * 10**5))
-                            new_msg.set_named("latitude", int(msg.coords[1] * 10**5))
-                            if msg.ident:
-                                new_msg.set_named("ident", msg.ident)
-
-                            # copy the data
-                            for data in msg.query_data({"query": "attrs"}):
-                                variable = data["variable"]
-                                attrs = variable.get_attrs()
-                                v = dballe.var(
-                                    data["variable"].code,
-                                    data["variable"].get(),
-                                )
-                                for a in attrs:
-                                    v.seta(a)
-
-                                new_msg.set(data["level"], data["trange"], v)
-
-                            # copy the station data
-                            for data in msg.query_station_data({"query": "attrs"}):
-                                variable = data["variable"]
-                                attrs = variable.get_attrs()
-                                v = dballe.var(
-                                    data["variable"].code,
-                                    data["variable"].get(),
-                                )
-                                for a in attrs:
-                                    v.seta(a)
-
-                                new_msg.set(dballe.Level(), dballe.Trange(), v)
-
-                            dt = datetime.datetime(
-                                msg.get_named("year").get(),
-                                msg.get_named("month").get(),
-                                msg.get_named("day").get(),
-                                msg.get_named("hour").get(),
-                                msg.get_named("minute").get(),
-                                msg.get_named("second").get(),
-                            )
+                            dt = check_message(msg)
                         except BaseException as exc:
                             message_ok = False
                             malformed_msg_errors = str(exc)
@@ -128,11 +107,8 @@
                             count_vars += 1
                         # if there is a discarded message save it to the file
                         if count_vars > 0:
-                            if message_ok:
-                                discarded_msgs.write(exporter.to_binary(new_msg))
-                            else:
-                                # save the original message
-                                discarded_msgs.write(exporter.to_binary(msg))
+                            # save the original message
+                            discarded_msgs.write(exporter.to_binary(msg))
                         # print(msg.report)
                         else:
                             with db.transaction() as tr:
@@ -142,6 +118,9 @@
                                     update_station=True,
                                     import_attributes=True,
                                 )
+                            imported_networks.add(msg.report)
+
+    notify_new_data(DEFAULT_DSN, imported_networks)
 
     if network_errors:
         print(f"Not valid report Network: {network_errors}", file=sys.stderr)
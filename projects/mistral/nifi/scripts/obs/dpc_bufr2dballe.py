@@ -3,6 +3,7 @@
 import sys
 
 import dballe
+from maps_cache_stamps import notify_new_data
 
 # get the DEFAULT DSN
 user = os.environ.get("ALCHEMY_USER")
@@ -12,23 +13,27 @@
 
 DEFAULT_DSN = f"postgresql://{user}:{pw}@{host}:{port}/DBALLE"
 
-
 while sys.stdin in select.select([sys.stdin], [], [], 0)[0]:
     data = sys.stdin.buffer
     if data:
         try:
             db = dballe.DB.connect(DEFAULT_DSN)
             importer = dballe.Importer("BUFR")
+            imported_networks = set()
             with db.transaction() as tr:
-                tr.import_messages(
-                    importer.from_file(data),
-                    overwrite=True,
-                    update_station=True,
-                    import_attributes=True,
-                )
+                with importer.from_file(data) as f:
+                    for messages in f:
+                        tr.import_messages(
+                            messages,
+                            overwrite=True,
+                            update_station=True,
+                            import_attributes=True,
+                        )
+                        imported_networks.update(msg.report for msg in messages)
         except BaseException as exc:
             print(str(exc))
             sys.exit(109)
+        notify_new_data(DEFAULT_DSN, imported_networks)
     sys.exit(0)
 
 sys.stdout.close()
@@ -0,0 +1,24 @@
+import os
+import sys
+import time
+from urllib.parse import urlparse
+
+# folder shared with the backend, where the networks and the DSNs with new data
+# are notified to invalidate the cached responses of the maps
+MAPS_CACHE_STAMPS_DIR = os.environ.get("MAPS_CACHE_STAMPS_DIR")
+
+
+def notify_new_data(dsn_url, networks):
+    """
+    Update the stamps of the imported networks and of the DSN they were imported in
+    (the responses not limited to some networks depend on the DSN of their license group)
+    """
+    if not MAPS_CACHE_STAMPS_DIR or not networks:
+        return
+    dsn = urlparse(dsn_url).path.strip("/")
+    for name in sorted(networks) + [f"{dsn}.dsn"]:
+        try:
+            with open(os.path.join(MAPS_CACHE_STAMPS_DIR, f"{name}.stamp"), "w") as f:
+                f.write(str(time.time()))
+        except OSError as exc:
+            print(f"Unable to notify new data of {name}: {exc}", file=sys.stderr)
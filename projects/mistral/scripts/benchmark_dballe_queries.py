@@ -0,0 +1,70 @@
+import sys
+import time
+from typing import Any, Callable, Dict
+
+import dballe
+from restapi.utilities.logs import log
+
+# compare the time needed to extract data with and without the count query
+# previously run to check if the query gives a result.
+# usage: benchmark_dballe_queries.py <dsn url> <network> [<variable> [<repetitions>]]
+if len(sys.argv) < 3:
+    log.error("Usage: {} <dsn url> <network> [<variable> [<repetitions>]]", sys.argv[0])
+    sys.exit(1)
+
+url = sys.argv[1]
+query: Dict[str, Any] = {"rep_memo": sys.argv[2]}
+if len(sys.argv) > 3:
+    query["var"] = sys.argv[3]
+repetitions = int(sys.argv[4]) if len(sys.argv) > 4 else 5
+
+
+def count_and_iterate(tr: Any) -> int:
+    if tr.query_data(query).remaining == 0:
+        return 0
+    return sum(1 for _ in tr.query_data(query))
+
+
+def iterate(tr: Any) -> int:
+    return sum(1 for _ in tr.query_data(query))
+
+
+def count_and_export(tr: Any) -> int:
+    if tr.query_data(query).remaining == 0:
+        return 0
+    exporter = dballe.Exporter("BUFR")
+    return sum(len(exporter.to_binary(row.message)) for row in tr.query_messages(query))
+
+
+def export(tr: Any) -> int:
+    exporter = dballe.Exporter("BUFR")
+    return sum(len(exporter.to_binary(row.message)) for row in tr.query_messages(query))
+
+
+def benchmark(name: str, func: Callable[[Any], int]) -> float:
+    timings = []
+    for _ in range(repetitions):
+        with db.transaction() as tr:
+            start = time.perf_counter()
+            result = func(tr)
+            timings.append(time.perf_counter() - start)
+    best = min(timings)
+    log.info("{}: {} (best of {}: {:.3f}s)", name, result, repetitions, best)
+    return best
+
+
+db = dballe.DB.connect(url)
+log.info("query: {}", query)
+for name, legacy, single_pass in (
+    ("maps", count_and_iterate, iterate),
+    ("extraction", count_and_export, export),
+):
+    legacy_time = benchmark(f"{name} with count query", legacy)
+    single_pass_time = benchmark(f"{name} single pass", single_pass)
+    if legacy_time:
+        log.info(
+            "{}: {:.3f}s saved ({:.1f}%)",
+            name,
+            legacy_time - single_pass_time,
+            (legacy_time - single_pass_time) * 100 / legacy_time,
+        )
@@ -0,0 +1,77 @@
+import io
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable, List
+
+import dballe
+from mistral.services.message_filter import MessageFilter
+from restapi.utilities.logs import log
+
+# compare the quality check filter rebuilding every message with the one
+# copying the untouched messages as raw bytes, over a corpus of BUFR files.
+# usage: benchmark_message_filter.py <bufr file or folder> [<repetitions>]
+if len(sys.argv) < 2:
+    log.error("Usage: {} <bufr file or folder> [<repetitions>]", sys.argv[0])
+    sys.exit(1)
+
+corpus = Path(sys.argv[1])
+repetitions = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+files: List[Path] = sorted(corpus.glob("*")) if corpus.is_dir() else [corpus]
+
+
+def rebuild_all(in_file: Any, out_file: Any) -> None:
+    # every message is decoded and copied in a new message before being exported
+    importer = dballe.Importer("BUFR")
+    exporter = dballe.Exporter("BUFR")
+    qc_filter = MessageFilter(quality_check=True, data_attrs=False)
+    with importer.from_file(in_file) as fp:
+        for msgs in fp:
+            for msg in msgs:
+                selected = qc_filter.select(msg)
+                if any(selected):
+                    new_msg = MessageFilter.copy_message(
+                        msg, selected, data_attrs=False
+                    )
+                    out_file.write(exporter.to_binary(new_msg))
+
+
+def fast_path(in_file: Any, out_file: Any) -> None:
+    MessageFilter(quality_check=True, data_attrs=False).filter_file(in_file, out_file)
+
+
+def benchmark(name: str, func: Callable[[Any, Any], None]) -> float:
+    timings = []
+    size = 0
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        size = 0
+        for path in files:
+            out = io.BytesIO()
+            with open(path, "rb") as in_file:
+                func(in_file, out)
+            size += out.tell()
+        timings.append(time.perf_counter() - start)
+    best = min(timings)
+    log.info("{}: {} bytes (best of {}: {:.3f}s)", name, size, repetitions, best)
+    return best
+
+
+stats = {"messages": 0, "untouched": 0, "copied": 0, "dropped": 0}
+for path in files:
+    with open(path, "rb") as in_file:
+        file_stats = MessageFilter(quality_check=True, data_attrs=False).filter_file(
+            in_file, io.BytesIO()
+        )
+    for k, v in file_stats.items():
+        stats[k] += v
+log.info("corpus: {} files, {}", len(files), stats)
+
+legacy_time = benchmark("rebuild every message", rebuild_all)
+fast_time = benchmark("untouched messages as raw bytes", fast_path)
+if legacy_time:
+    log.info(
+        "{:.3f}s saved ({:.1f}%)",
+        legacy_time - fast_time,
+        (legacy_time - fast_time) * 100 / legacy_time,
+    )
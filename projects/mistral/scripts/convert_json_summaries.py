@@ -0,0 +1,23 @@
+import sys
+from pathlib import Path
+
+from mistral.services.dballe import BeDballe as dballe_service
+from mistral.services.summary_store import SummaryStore
+from restapi.utilities.logs import log
+
+# convert the json summaries of the observed data in the indexed summary stores.
+# Summaries can be converted one by one passing their paths as arguments,
+# otherwise all the summaries in the summary folder are converted.
+# Once converted, the summary store is kept updated by the scripts writing the json
+if len(sys.argv) > 1:
+    json_summaries = [Path(x) for x in sys.argv[1:]]
+else:
+    json_summaries = sorted(dballe_service.SUMMARY_PATH.glob("*_summary_*.json"))
+
+for json_summary in json_summaries:
+    if not json_summary.exists():
+        log.warning("{} does not exist", json_summary)
+        continue
+    SummaryStore.convert_json(json_summary)
+
+log.info("{} summaries converted", len(json_summaries))
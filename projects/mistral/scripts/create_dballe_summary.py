@@ -2,6 +2,7 @@
 from mistral.services.arkimet import BeArkimet as arki_service
 from mistral.services.dballe import BeDballe as dballe_service
 from mistral.services.sqlapi_db_manager import SqlApiDbManager
+from mistral.services.summary_store import SummaryStore
 from restapi.connectors import sqlalchemy
 from restapi.utilities.logs import log
 
@@ -91,6 +92,7 @@
 
         if total_count != check_count:
             log.error("Problems in creating the dballe json summary")
+        SummaryStore.sync(complete_json_summary, explorer)
 
         # check if the dsn needs a filtered summary (multimodel use case)
         if dsn_license_group_list[0] in license_groups_need_filtering:
@@ -112,6 +114,7 @@
             # export the filtered explorer to a json file
             with open(filtered_json_summary, "w") as fd:
                 fd.write(filtered_explorer.to_json())
+            SummaryStore.sync(filtered_json_summary, filtered_explorer)
     else:
         # case of dsn containing different license groups
         for lg in dsn_license_group_list:
@@ -140,6 +143,7 @@
             # write the filtered explorer to the file
             with open(complete_json_summary, "w") as fd:
                 fd.write(subset_explorer.to_json())
+            SummaryStore.sync(complete_json_summary, subset_explorer)
 
         """
         at the moment we don't need a filtered summary in this use case as the only
@@ -3,6 +3,7 @@
 import dballe
 from mistral.services.arkimet import BeArkimet as arki_service
 from mistral.services.dballe import BeDballe as dballe_service
+from mistral.services.summary_store import SummaryStore
 from restapi.utilities.logs import log
 
 # get all observed datasets
@@ -47,6 +48,7 @@
     log.info("Exporting in JSON ...")
     with open(json_summary, "w") as fd:
         fd.write(complete_explorer.to_json())
+    SummaryStore.sync(json_summary, complete_explorer)
 
     if d not in dballe_service.MAPS_NETWORK_FILTER:
         log.info("###### Importing in filtered json summary ######")
@@ -59,6 +61,7 @@
                 updater.add_db(tr)
         with open(json_summary_filtered, "w") as fd:
             fd.write(filtered_explorer.to_json())
+        SummaryStore.sync(json_summary_filtered, filtered_explorer)
 
     log.info("#####################################")
 